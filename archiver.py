@@ -0,0 +1,351 @@
+"""
+Single entry point for the archiver:
+
+    python archiver.py vods                 sync VODs of CHANNEL_NAMES
+    python archiver.py record <channel>...  record live streams now (video + chat)
+    python archiver.py daemon               record CHANNEL_NAMES whenever they go live
+    python archiver.py token                keep the OAuth token fresh
+    python archiver.py status               token expiry, active recordings, recent streams
+    python archiver.py import-chat <file>   chat JSON -> SQLite, chat text log -> .tcb
+                                            (--sqlite: chat text log -> SQLite)
+    python archiver.py verify               re-check stored SHA-256 hashes (rolling window)
+    python archiver.py package [--upload]   tar stream folders / upload them to Archive.org
+    python archiver.py startup-check        import-time budget check (python -X importtime)
+
+    python archiver.py --profile all vods   profile a run (see modules/profiling.py)
+
+Only the standard library is imported at startup. Each subcommand imports the
+scripts and third-party packages it needs (twitchio, requests, tqdm, dotenv)
+when it runs, so cron jobs and status checks don't pay for them.
+"""
+
+import os
+import sys
+import argparse
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ENV_FILE = os.path.join(SCRIPT_DIR, ".env")
+
+# `archiver.py --help` and `archiver.py status` must start within this budget
+# and must not import any of HEAVY_MODULES.
+STARTUP_BUDGET_MS = 150
+HEAVY_MODULES = ("twitchio", "aiohttp", "requests", "tqdm", "dotenv")
+STARTUP_COMMANDS = (["--help"], ["status"])
+
+
+def _load_env():
+    from dotenv import load_dotenv
+
+    load_dotenv(ENV_FILE, override=True)
+
+
+def _channels():
+    channel_str = os.getenv("CHANNEL_NAMES", "")
+    return [c.strip() for c in channel_str.split(",") if c.strip()]
+
+
+def cmd_vods(args):
+    _load_env()
+    import download_vods
+
+    download_vods.main(order=args.order)
+
+
+def cmd_record(args):
+    _load_env()
+    import download_streams
+
+    download_streams.main(args.channels)
+
+
+def cmd_daemon(args):
+    _load_env()
+    import download_streams
+
+    download_streams.setup_logging()
+    channels = args.channels or _channels()
+    if not channels:
+        print("No channels given and CHANNEL_NAMES is empty.", file=sys.stderr)
+        return 1
+    download_streams.watch_channels(channels, args.interval)
+
+
+def cmd_token(args):
+    import refresh_env
+
+    refresh_env.main()
+
+
+def _fmt_seconds(seconds):
+    seconds = int(seconds)
+    h, rem = divmod(abs(seconds), 3600)
+    m, s = divmod(rem, 60)
+    return f"{'-' if seconds < 0 else ''}{h}h{m:02d}m{s:02d}s"
+
+
+def cmd_status(args):
+    import json
+    import time
+    import shutil
+    import sqlite3
+
+    from modules.db_utils import BASE_DIR, DB_PATH
+    from modules.token_manager import read_token_state
+
+    status = {}
+    token = read_token_state()
+    if token.get("expires_at"):
+        status["token_expires_in"] = int(token["expires_at"] - time.time())
+    else:
+        status["token_expires_in"] = None
+
+    status["recording"] = []
+    status["recent"] = []
+    if os.path.exists(DB_PATH):
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+        try:
+            status["recording"] = [
+                {"channel": c, "stream_id": s, "start_time": t, "title": ti}
+                for c, s, t, ti in conn.execute(
+                    "SELECT channel_name, stream_id, start_time, title FROM streams "
+                    "WHERE source = 'live' AND end_time IS NULL ORDER BY start_time DESC"
+                )
+            ]
+            status["recent"] = [
+                {"channel": c, "source": so, "start_time": t, "title": ti}
+                for c, so, t, ti in conn.execute(
+                    "SELECT channel_name, source, start_time, title FROM streams "
+                    "ORDER BY start_time DESC LIMIT ?",
+                    (args.limit,),
+                )
+            ]
+        finally:
+            conn.close()
+
+    status["helix_cache"] = {}
+    cache_path = os.path.join(BASE_DIR, "metadata", "helix_cache.db")
+    if os.path.exists(cache_path):
+        conn = sqlite3.connect(f"file:{cache_path}?mode=ro", uri=True)
+        try:
+            for endpoint, served, total in conn.execute(
+                "SELECT endpoint, SUM(CASE WHEN outcome != 'miss' THEN count END), "
+                "SUM(count) FROM cache_stats WHERE outcome != 'bypass' GROUP BY endpoint"
+            ):
+                status["helix_cache"][endpoint] = {
+                    "lookups": total,
+                    "hit_ratio": round((served or 0) / total, 3),
+                }
+        except sqlite3.Error:
+            pass
+        finally:
+            conn.close()
+
+    persons_dir = os.path.join(BASE_DIR, "persons")
+    if os.path.isdir(persons_dir):
+        usage = shutil.disk_usage(persons_dir)
+        status["disk_free_bytes"] = usage.free
+        status["disk_total_bytes"] = usage.total
+
+    if args.json:
+        print(json.dumps(status, indent=2))
+        return
+
+    expires_in = status["token_expires_in"]
+    if expires_in is None:
+        print("Token: unknown (run `archiver.py token`)")
+    else:
+        print(f"Token: expires in {_fmt_seconds(expires_in)}")
+    if "disk_free_bytes" in status:
+        print(
+            f"Disk:  {status['disk_free_bytes'] / 1024**3:.1f} GiB free of "
+            f"{status['disk_total_bytes'] / 1024**3:.1f} GiB"
+        )
+    if status["helix_cache"]:
+        print(
+            "Helix cache: "
+            + ", ".join(
+                f"{endpoint} {c['hit_ratio']:.0%} of {c['lookups']}"
+                for endpoint, c in sorted(status["helix_cache"].items())
+            )
+        )
+    print(f"Recording ({len(status['recording'])}):")
+    for rec in status["recording"]:
+        print(f"  {rec['channel']:<20} since {rec['start_time']}  {rec['title'] or ''}")
+    print("Recent:")
+    for rec in status["recent"]:
+        print(
+            f"  {rec['start_time'] or '?':<32} {rec['source'] or '?':<5} "
+            f"{rec['channel']:<20} {rec['title'] or ''}"
+        )
+
+
+def cmd_import_chat(args):
+    import logging
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    path = args.path
+    base, ext = os.path.splitext(path)
+    if ext == ".json":
+        from modules.file_utils import process_chat_to_sqlite
+
+        out = args.out or base + ".sqlite"
+        process_chat_to_sqlite(path, out)
+    elif args.sqlite:
+        from modules.chat_import import import_text_log
+
+        out = args.out or base + ".sqlite"
+        import_text_log(path, out, replace=True)
+    else:
+        from modules.chat_binary import text_log_to_binary
+
+        out = args.out or base + ".tcb"
+        text_log_to_binary(path, out)
+    print(out)
+
+
+def cmd_verify(args):
+    import logging
+
+    from modules.integrity import main as integrity_main
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    argv = ["verify", "--workers", str(args.workers)]
+    if args.max_mbps is not None:
+        argv += ["--max-mbps", str(args.max_mbps)]
+    if args.all:
+        argv.append("--all")
+    return integrity_main(argv)
+
+
+def cmd_package(args):
+    import logging
+
+    from modules.packager import main as packager_main
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    argv = ["upload"] if args.upload else ["tar"]
+    if args.upload and args.tar:
+        argv.append("--tar")
+    return packager_main(argv + ["--workers", str(args.workers), *args.folders])
+
+
+def _importtime(argv):
+    """
+    (total_ms, [(cumulative_us, module)], imported modules, exit code) for one
+    run of this script under python -X importtime.
+    """
+    import subprocess
+
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", os.path.abspath(__file__), *argv],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        cwd=SCRIPT_DIR,
+    )
+    top_level = []
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self_us, cumulative_us, name = line[len("import time:") :].split("|", 2)
+        modules.add(name.strip())
+        if not name[1:].startswith(" "):
+            top_level.append((int(cumulative_us), name.strip()))
+    total_ms = sum(us for us, _ in top_level) / 1000
+    return total_ms, sorted(top_level, reverse=True), modules, proc.returncode
+
+
+def cmd_startup_check(args):
+    failed = False
+    for argv in STARTUP_COMMANDS:
+        total_ms, top_level, modules, returncode = _importtime(argv)
+        heavy = sorted(m for m in modules if m in HEAVY_MODULES)
+        ok = total_ms <= args.budget_ms and not heavy and returncode == 0
+        failed |= not ok
+        print(
+            f"archiver.py {' '.join(argv)}: {total_ms:.1f} ms of imports "
+            f"(budget {args.budget_ms} ms) {'OK' if ok else 'OVER BUDGET'}"
+        )
+        for us, name in top_level[: args.top]:
+            print(f"  {us / 1000:8.1f} ms  {name}")
+        if heavy:
+            print(f"  heavy modules imported: {', '.join(heavy)}")
+        if returncode:
+            print(f"  exited with code {returncode}")
+    return 1 if failed else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="archiver.py", description="Archive Twitch streams, VODs and chat."
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="MODES",
+        help="Profile the run: spans,cprofile,sample,tracemalloc or all "
+        "(report in logs/profile/)",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("vods", help="Sync VODs of CHANNEL_NAMES")
+    p.add_argument(
+        "--order",
+        choices=("newest", "oldest", "shortest", "channels"),
+        help="Download order (default: VOD_ORDER or newest)",
+    )
+    p.set_defaults(func=cmd_vods)
+
+    p = sub.add_parser("record", help="Record live streams now")
+    p.add_argument("channels", nargs="+")
+    p.set_defaults(func=cmd_record)
+
+    p = sub.add_parser("daemon", help="Record channels whenever they go live")
+    p.add_argument("channels", nargs="*", help="Default: CHANNEL_NAMES")
+    p.add_argument("--interval", type=int, help="Seconds between live checks")
+    p.set_defaults(func=cmd_daemon)
+
+    p = sub.add_parser("token", help="Keep the OAuth token fresh")
+    p.set_defaults(func=cmd_token)
+
+    p = sub.add_parser("status", help="Token, active recordings, recent streams")
+    p.add_argument("--limit", type=int, default=10)
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(func=cmd_status)
+
+    p = sub.add_parser("import-chat", help="Convert a chat JSON/text log")
+    p.add_argument("path")
+    p.add_argument("--out")
+    p.add_argument("--sqlite", action="store_true", help="Text log -> SQLite")
+    p.set_defaults(func=cmd_import_chat)
+
+    p = sub.add_parser("verify", help="Re-check stored SHA-256 hashes")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--max-mbps", type=float, help="Read cap in MiB/s (VERIFY_MAX_MBPS)")
+    p.add_argument("--all", action="store_true", help="Verify everything now")
+    p.set_defaults(func=cmd_verify)
+
+    p = sub.add_parser("package", help="Tar stream folders or upload to Archive.org")
+    p.add_argument("folders", nargs="*")
+    p.add_argument("--upload", action="store_true", help="Upload to IA_S3_URL")
+    p.add_argument("--tar", action="store_true", help="With --upload: one tar per item")
+    p.add_argument("--workers", type=int, default=4)
+    p.set_defaults(func=cmd_package)
+
+    p = sub.add_parser("startup-check", help="Check the import-time budget")
+    p.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    p.add_argument("--top", type=int, default=5)
+    p.set_defaults(func=cmd_startup_check)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        # Must be set before modules.profiling is first imported.
+        os.environ["PROFILE"] = args.profile
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
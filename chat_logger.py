@@ -1,8 +1,61 @@
 import os
-import json
+import time
+import sqlite3
 from datetime import datetime, timezone
 from twitchio.ext import commands
 
+from modules.chat_format import EMOTE_URL_TEMPLATE, format_chat_line, format_rel
+from modules.chat_binary import ChatBinaryWriter
+from modules.seekable_archive import SeekableArchiveWriter
+from modules.file_utils import init_live_chat_sqlite, insert_chat_message_sqlite
+from modules.metadata_store import MetadataStore
+from modules.emote_cache import EmoteArchiver
+from modules.profiling import profiled
+
+CHAT_ARCHIVE_FRAME_SECONDS = 10
+# Binary chat and live SQLite are flushed at most this often.
+CHAT_FLUSH_SECONDS = 1.0
+
+
+def apply_endpoint_overrides():
+    """
+    Point TwitchIO at twitch_standin.py when TWITCH_IRC_URL / TWITCH_ID_BASE are set.
+    TwitchIO hardcodes both the IRC websocket host and the token validate URL.
+    """
+    irc_url = os.getenv("TWITCH_IRC_URL")
+    id_base = os.getenv("TWITCH_ID_BASE", "").rstrip("/")
+
+    if irc_url:
+        from twitchio import websocket
+
+        websocket.HOST = irc_url
+
+    if id_base:
+        import aiohttp
+        from twitchio import http
+        from twitchio.errors import AuthenticationError
+
+        async def validate(self, *, token=None):
+            token = token or self.token
+            headers = {"Authorization": f"OAuth {token}"}
+            async with aiohttp.ClientSession() as session:
+                async with session.get(
+                    f"{id_base}/oauth2/validate", headers=headers
+                ) as resp:
+                    if resp.status == 401:
+                        raise AuthenticationError(
+                            "Invalid or unauthorized Access Token passed."
+                        )
+                    resp.raise_for_status()
+                    data = await resp.json()
+            if not self.nick:
+                self.nick = data.get("login")
+                self.user_id = data.get("user_id") and int(data["user_id"])
+                self.client_id = data.get("client_id")
+            return data
+
+        http.TwitchHTTP.validate = validate
+
 
 class ChatLogger(commands.Bot):
     def __init__(
@@ -13,16 +66,25 @@ class ChatLogger(commands.Bot):
         initial_meta,
         chat_log_filename="chat.undetermined.log",
         *,
+        chat_binary_filename=None,
+        chat_archive_filename=None,
+        chat_sqlite_filename=None,
+        emote_manifest_filename=None,
         loop=None,
     ):
         """
         :param token: OAuth token to authenticate with Twitch (e.g., 'oauth:abcd1234')
         :param channel_name: The name of the Twitch channel to join, e.g. "SomeStreamer"
         :param stream_folder: Local path where logs and metadata for this stream session are stored
-        :param initial_meta: A dict of existing metadata for the stream (e.g., from metadata.json)
+        :param initial_meta: A MetadataStore shared with the recorder, or a dict of existing metadata (e.g., from metadata.json)
         :param chat_log_filename: Filename for logging chat messages (default is "chat.live.log")
+        :param chat_binary_filename: Optional filename for a compact binary copy of the chat (e.g. "chat.live.tcb")
+        :param chat_archive_filename: Optional base name for a seekable compressed copy (e.g. "chat.live.log" -> chat.live.log.<start>.gz)
+        :param chat_sqlite_filename: Optional live chat SQLite file (e.g. "chat.live.sqlite"), with offsets from stream start
+        :param emote_manifest_filename: Optional manifest of emotes used (e.g. "emotes.json"); also archives the emote images
         :param loop: Optional event loop if you’re integrating with an existing asyncio loop
         """
+        apply_endpoint_overrides()
         super().__init__(
             token=token, prefix="!", initial_channels=[channel_name], loop=loop
         )
@@ -32,22 +94,54 @@ class ChatLogger(commands.Bot):
         os.makedirs(stream_folder, exist_ok=True)
 
         self.metadata_path = os.path.join(stream_folder, "metadata.json")
-        self.metadata = initial_meta or {}
+        if isinstance(initial_meta, MetadataStore):
+            self.metadata_store = initial_meta
+        else:
+            self.metadata_store = MetadataStore(
+                self.metadata_path, initial=initial_meta
+            )
+        self.metadata = self.metadata_store.data
         if "start_time" in self.metadata:
             self.stream_start_time = datetime.fromisoformat(self.metadata["start_time"])
         else:
             self.stream_start_time = datetime.now(timezone.utc)
 
+        self.binary_writer = None
+        if chat_binary_filename:
+            self.binary_writer = ChatBinaryWriter(
+                os.path.join(stream_folder, chat_binary_filename),
+                self.stream_start_time,
+            )
+
+        self.archive_writer = None
+        if chat_archive_filename:
+            self.archive_writer = SeekableArchiveWriter(
+                os.path.join(stream_folder, chat_archive_filename),
+                frame_seconds=CHAT_ARCHIVE_FRAME_SECONDS,
+            )
+
+        self.chat_db = None
+        self._last_flush = time.monotonic()
+        if chat_sqlite_filename:
+            sqlite_path = os.path.join(stream_folder, chat_sqlite_filename)
+            init_live_chat_sqlite(sqlite_path)
+            self.chat_db = sqlite3.connect(sqlite_path)
+
+        self.emote_archiver = None
+        if emote_manifest_filename:
+            self.emote_archiver = EmoteArchiver(
+                os.path.join(stream_folder, emote_manifest_filename)
+            )
+
     async def event_ready(self):
         print(f"[ChatLogger] Logged in as {self.nick}")
 
+    @profiled
     async def event_message(self, message):
         now_utc = datetime.now(timezone.utc)
         abs_str = now_utc.isoformat()
         delta = now_utc - self.stream_start_time
-        h, rem = divmod(int(delta.total_seconds()), 3600)
-        m, s = divmod(rem, 60)
-        rel_str = f"{h:02d}:{m:02d}:{s:02d}"
+        rel_str = format_rel(delta.total_seconds())
         author_name = message.author.name if message.author else "UnknownUser"
         bits = 0
         if message.tags and "bits" in message.tags:
@@ -71,8 +165,7 @@ class ChatLogger(commands.Bot):
             roles.append("SUB")
         if getattr(message.author, "is_broadcaster", False):
             roles.append("BROADCASTER")
-        roles_str = " ".join(roles) if roles else "None"
-        stickers = []
+        emote_ids = []
         if message.tags and "emotes" in message.tags:
             emote_data = message.tags["emotes"]
             if emote_data:
@@ -80,39 +173,83 @@ class ChatLogger(commands.Bot):
                     parts = group.split(":")
                     if len(parts) == 2:
                         emote_id, _ranges = parts
-                        stickers.append(
-                            f"https://static-cdn.jtvnw.net/emoticons/v1/{emote_id}/3.0"
-                        )
-        extras = []
-        if bits > 0:
-            extras.append(f"bits={bits}")
-        if color_3:
-            extras.append(f"color={color_3}")
-        if roles_str and roles_str != "None":
-            extras.append(f"roles={roles_str}")
-        if stickers:
-            extras.append(f"stickers={stickers}")
-        extras_str = ""
-        if extras:
-            extras_str = f" ({', '.join(extras)})"
-        entry = (
-            f"[{abs_str}] "
-            f"[{rel_str}] "
-            f"<{author_name}>"
-            f"{extras_str} "
-            f"{message.content}\n"
+                        emote_ids.append(emote_id)
+        stickers = [EMOTE_URL_TEMPLATE.format(emote_id) for emote_id in emote_ids]
+        entry = format_chat_line(
+            abs_str,
+            rel_str,
+            author_name,
+            message.content,
+            bits=bits,
+            color=color_3,
+            roles=roles,
+            stickers=stickers,
         )
         with open(self.chat_file, "a", encoding="utf-8", buffering=1) as f:
             f.write(entry)
+        if self.archive_writer:
+            self.archive_writer.write_line(entry, now_utc.timestamp())
+        if self.binary_writer:
+            self.binary_writer.write_message(
+                int(delta.total_seconds() * 1000),
+                author_name,
+                message.content,
+                bits=bits,
+                color=color_3,
+                roles=roles,
+                emote_ids=emote_ids,
+            )
+        if self.chat_db:
+            insert_chat_message_sqlite(
+                None,
+                {
+                    "time_text": abs_str,
+                    "offset_seconds": delta.total_seconds(),
+                    "author": {"name": author_name, "color": color_3, "roles": roles},
+                    "message": message.content,
+                    "bits": bits,
+                    "emotes": emote_ids,
+                },
+                conn=self.chat_db,
+            )
+        if self.emote_archiver and emote_ids:
+            self.emote_archiver.observe(emote_ids, delta.total_seconds())
+        if time.monotonic() - self._last_flush >= CHAT_FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        if self.binary_writer:
+            self.binary_writer.flush()
+        if self.chat_db:
+            self.chat_db.commit()
+        if self.emote_archiver:
+            self.emote_archiver.flush()
+        self._last_flush = time.monotonic()
+
+    async def close(self):
+        # Writers are dropped so messages arriving until the socket closes are
+        # only written to the text log.
+        if self.binary_writer:
+            self.binary_writer.close()
+            self.binary_writer = None
+        if self.archive_writer:
+            self.archive_writer.close()
+            self.archive_writer = None
+        if self.chat_db:
+            self.chat_db.commit()
+            self.chat_db.close()
+            self.chat_db = None
+        if self.emote_archiver:
+            archiver, self.emote_archiver = self.emote_archiver, None
+            await archiver.close()
+        await super().close()
 
     def update_title(self, new_title):
         change = {
             "timestamp": datetime.now(timezone.utc).isoformat(),
             "new_title": new_title,
         }
-        self.metadata.setdefault("title_changes", []).append(change)
-        self.save_metadata()
+        self.metadata_store.append_event("title_changes", change)
 
     def save_metadata(self):
-        with open(self.metadata_path, "w", encoding="utf-8") as f:
-            json.dump(self.metadata, f, indent=2)
+        self.metadata_store.flush()
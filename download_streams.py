@@ -3,36 +3,46 @@ import threading
 import asyncio
 import time
 import logging
+import argparse
 from datetime import datetime, timezone
 
 from dotenv import load_dotenv
 from modules.logging_setup import configure_logger
-from modules.db_utils import upsert_stream_record
+from modules.db_utils import upsert_stream_record, find_stream_folder
+from modules.metadata_store import MetadataStore
 from modules.file_utils import (
-    write_json,
     read_json,
-    process_chat_to_sqlite,
     init_events_db,
     insert_viewer_event,
     insert_chapter_event,
 )
 from modules.video_utils import record_live
 from modules.api_utils import get_stream_data
+from modules.token_manager import current_access_token
+from modules.thumbnails import generate_thumbnails, monitor_live_thumbnails
+from modules.recording_journal import RecordingJournal, find_unfinished
 from chat_logger import ChatLogger
 
-logger = configure_logger(
-    logger_name="download_streams",
-    log_file_name="download_streams.log",
-    console_level=logging.DEBUG,
-    file_level=logging.DEBUG,
-)
+logger = logging.getLogger("download_streams")
 
 load_dotenv(override=True)
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 
+# Restart a recorder that exits while the channel is still live, backing off
+# after parts that recorded nothing and giving up after this many in a row.
+RESTART_DELAY = float(os.getenv("RECORDER_RESTART_DELAY", "2"))
+MAX_FAILED_RESTARTS = int(os.getenv("RECORDER_MAX_FAILED_RESTARTS", "5"))
+# A crashed session younger than this is continued in its folder.
+RESUME_WINDOW = float(os.getenv("RECORDER_RESUME_WINDOW", "900"))
+
+
+# How long to wait for the chat bot to flush and disconnect at the end.
+CHAT_STOP_TIMEOUT = 60
+
 
-def run_chat_logger(token, channel_name, folder, metadata):
+def run_chat_logger(token, channel_name, folder, metadata, chat=None):
+    """Run a ChatLogger on its own loop; chat gets {"bot", "loop"} to stop it."""
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     bot = ChatLogger(
@@ -40,9 +50,15 @@ def run_chat_logger(token, channel_name, folder, metadata):
         channel_name,
         folder,
         metadata,
-        chat_json_filename="chat.live.json",
+        chat_log_filename="chat.live.log",
+        chat_binary_filename="chat.live.tcb",
+        chat_archive_filename="chat.live.log",
+        chat_sqlite_filename="chat.live.sqlite",
+        emote_manifest_filename="emotes.json",
         loop=loop,
     )
+    if chat is not None:
+        chat.update(bot=bot, loop=loop)
     try:
         loop.run_until_complete(bot.start())
     finally:
@@ -50,6 +66,20 @@ def run_chat_logger(token, channel_name, folder, metadata):
         loop.close()
 
 
+def stop_chat_logger(chat, chat_thread, timeout=CHAT_STOP_TIMEOUT):
+    """Close the bot on its loop (flushing .tcb, SQLite, emotes) and wait for it."""
+    bot = chat.get("bot")
+    if bot is not None and chat_thread.is_alive():
+        future = asyncio.run_coroutine_threadsafe(bot.close(), chat["loop"])
+        try:
+            future.result(timeout)
+        except Exception as e:
+            logger.exception(f"Error closing chat logger: {e}")
+    chat_thread.join(timeout)
+    if chat_thread.is_alive():
+        logger.warning(f"Chat logger still running after {timeout}s")
+
+
 def monitor_viewer_chapters_sqlite(channel_name, folder, is_running_flag, interval=600):
     events_db = os.path.join(folder, "events.sqlite")
     init_events_db(events_db)
@@ -81,9 +111,60 @@ def monitor_viewer_chapters_sqlite(channel_name, folder, is_running_flag, interv
             time.sleep(1)
 
 
+def same_broadcast(channel_name, stream_id, live_id):
+    # "<channel>_<time>" is a placeholder id from when Helix was down at start.
+    return (
+        not stream_id
+        or not live_id
+        or stream_id == live_id
+        or stream_id.startswith(f"{channel_name}_")
+    )
+
+
+def still_live(channel_name, stream_id):
+    try:
+        info = get_stream_data(channel_name)
+    except Exception as e:
+        # A network blip is no reason to drop the rest of the broadcast.
+        logger.warning(f"Could not check whether {channel_name} is live: {e}")
+        return True
+    return bool(info) and same_broadcast(channel_name, stream_id, info.get("id"))
+
+
 def download_stream(channel_name, folder_name=None):
     logger.info(f"download_stream called for channel={channel_name}")
 
+    stream_info = None
+    try:
+        stream_info = get_stream_data(channel_name)
+    except Exception as e:
+        logger.warning(f"Could not fetch stream info for {channel_name}: {e}")
+    live_stream_id = stream_info.get("id") if stream_info else None
+
+    if not folder_name and live_stream_id:
+        # Same broadcast already has a folder (restart, or its VOD synced first).
+        folder_name = find_stream_folder(stream_id=live_stream_id)
+        if folder_name:
+            logger.info(f"Reusing folder {folder_name} for stream {live_stream_id}")
+
+    if not folder_name:
+        # The previous recorder process died mid-stream: carry on in its folder.
+        folder_name = find_unfinished(
+            os.path.join(BASE_DIR, "persons", channel_name, "twitch", "livestreams"),
+            RESUME_WINDOW,
+        )
+        previous_id = (
+            read_json(os.path.join(folder_name, "metadata.json")).get("stream_id")
+            if folder_name
+            else None
+        )
+        if folder_name and not same_broadcast(
+            channel_name, previous_id, live_stream_id
+        ):
+            folder_name = None
+        elif folder_name:
+            logger.info(f"Resuming unfinished recording in {folder_name}")
+
     if not folder_name:
         now_str = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
         folder_name = os.path.join(
@@ -98,23 +179,33 @@ def download_stream(channel_name, folder_name=None):
     logger.debug(f"Folder for stream: {folder_name}")
 
     metadata_path = os.path.join(folder_name, "metadata.json")
-    existing_meta = read_json(metadata_path)
+    existing_meta = MetadataStore(metadata_path)
+    journal = RecordingJournal(folder_name)
 
     start_time_iso = datetime.now(timezone.utc).isoformat()
+    if journal.started and existing_meta.get("start_time"):
+        # Same session continued: the broadcast started with the first part.
+        start_time_iso = existing_meta["start_time"]
     existing_meta.update(
         {
-            "stream_id": existing_meta.get("stream_id")
+            "stream_id": live_stream_id
+            or existing_meta.get("stream_id")
             or f"{channel_name}_{int(time.time())}",
-            "vod_id": None,
-            "title": existing_meta.get("title", f"Live Stream - {channel_name}"),
-            "created_at": start_time_iso,
-            "published_at": None,
-            "thumbnail_url": None,
-            "url": f"https://www.twitch.tv/{channel_name}",
-            "downloaded_at": None,
-            "vod_sha256": None,
-            "duration": None,
-            "duration_string": None,
+            "vod_id": existing_meta.get("vod_id"),
+            "title": existing_meta.get(
+                "title",
+                stream_info.get("title") if stream_info else None,
+            )
+            or f"Live Stream - {channel_name}",
+            # The folder may already hold the synced VOD: keep its fields.
+            "created_at": existing_meta.get("created_at") or start_time_iso,
+            "published_at": existing_meta.get("published_at"),
+            "thumbnail_url": existing_meta.get("thumbnail_url"),
+            "url": existing_meta.get("url") or f"https://www.twitch.tv/{channel_name}",
+            "downloaded_at": existing_meta.get("downloaded_at"),
+            "vod_sha256": existing_meta.get("vod_sha256"),
+            "duration": existing_meta.get("duration"),
+            "duration_string": existing_meta.get("duration_string"),
             "start_time": start_time_iso,
             "end_time": None,
             "initial_title": existing_meta.get(
@@ -123,7 +214,7 @@ def download_stream(channel_name, folder_name=None):
             "language": "en",
         }
     )
-    write_json(metadata_path, existing_meta)
+    existing_meta.flush()
 
     try:
         upsert_stream_record(
@@ -138,10 +229,11 @@ def download_stream(channel_name, folder_name=None):
     except Exception as e:
         logger.exception(f"DB error on upsert_stream_record: {e}")
 
-    token = os.getenv("ACCESS_TOKEN", "")
+    token = current_access_token() or ""
+    chat = {}
     chat_thread = threading.Thread(
         target=run_chat_logger,
-        args=(token, channel_name, folder_name, existing_meta),
+        args=(token, channel_name, folder_name, existing_meta, chat),
         daemon=True,
     )
     chat_thread.start()
@@ -154,44 +246,84 @@ def download_stream(channel_name, folder_name=None):
     )
     viewer_thread.start()
 
-    from modules.video_utils import record_live
-    import subprocess
+    live_mp4 = os.path.join(folder_name, "videos", "live.mp4")
+    thumbs_dir = os.path.join(folder_name, "thumbnails")
+    thumb_thread = threading.Thread(
+        target=monitor_live_thumbnails,
+        args=(live_mp4, thumbs_dir, is_running_flag),
+        daemon=True,
+    )
+    thumb_thread.start()
 
-    process = None
-    try:
-        process = record_live(channel_name, folder_name)
-        logger.info(
-            f"[{channel_name}] Recording started (PID={process.pid if process else 'N/A'})."
+    failed_parts = 0
+    while True:
+        part_file = journal.start_part()
+        process = None
+        ret_code = None
+        try:
+            process = record_live(channel_name, folder_name, part_file)
+            logger.info(
+                f"[{channel_name}] Recording {part_file} started "
+                f"(PID={process.pid if process else 'N/A'})."
+            )
+            ret_code = process.wait()
+            logger.info(f"[{channel_name}] Recording ended with code={ret_code}")
+        except Exception as e:
+            logger.exception(f"Error recording live stream for {channel_name}: {e}")
+        finally:
+            if process and process.poll() is None:
+                process.terminate()
+                process.wait()
+        part = journal.end_part(ret_code)
+        failed_parts = 0 if part and part["bytes"] else failed_parts + 1
+        if failed_parts >= MAX_FAILED_RESTARTS or not still_live(
+            channel_name, existing_meta["stream_id"]
+        ):
+            break
+        delay = min(RESTART_DELAY * 2**failed_parts, 60)
+        logger.warning(
+            f"[{channel_name}] Recorder exited (code={ret_code}) while the channel "
+            f"is still live; restarting in {delay:.1f}s"
         )
-        ret_code = process.wait()
-        logger.info(f"[{channel_name}] Recording ended with code={ret_code}")
-    except Exception as e:
-        logger.exception(f"Error recording live stream for {channel_name}: {e}")
-    finally:
-        if process and process.poll() is None:
-            process.terminate()
-            process.wait()
+        time.sleep(delay)
 
     is_running_flag["value"] = False
+    thumb_thread.join()
+    stop_chat_logger(chat, chat_thread)
+
+    try:
+        gaps = journal.finalize()
+    except OSError as e:
+        logger.exception(f"Error stitching recording parts in {folder_name}: {e}")
+        gaps = journal.gaps()
+    if gaps:
+        logger.info(
+            f"[{channel_name}] Recorded in {len(gaps) + 1} parts, "
+            f"{sum(g['seconds'] for g in gaps):.1f}s of gaps"
+        )
+    existing_meta.update(
+        {
+            "recording_parts": len(gaps) + 1,
+            "recording_gaps": gaps,
+            "recording_gap_seconds": round(sum(g["seconds"] for g in gaps), 3),
+        }
+    )
 
     end_time_iso = datetime.now(timezone.utc).isoformat()
-    existing_meta["end_time"] = end_time_iso
-    existing_meta["downloaded_at"] = end_time_iso
+    existing_meta.update({"end_time": end_time_iso, "downloaded_at": end_time_iso})
 
     from modules.file_utils import get_local_file_duration
 
-    live_mp4 = os.path.join(folder_name, "videos", "live.mp4")
     dur_sec = get_local_file_duration(live_mp4)
-    existing_meta["duration"] = int(dur_sec)
     h = int(dur_sec // 3600)
     m = int((dur_sec % 3600) // 60)
     s = int(dur_sec % 60)
     if h > 0:
-        existing_meta["duration_string"] = f"{h}:{m:02d}:{s:02d}"
+        duration_string = f"{h}:{m:02d}:{s:02d}"
     else:
-        existing_meta["duration_string"] = f"{m}:{s:02d}"
-
-    write_json(metadata_path, existing_meta)
+        duration_string = f"{m}:{s:02d}"
+    existing_meta.update({"duration": int(dur_sec), "duration_string": duration_string})
+    existing_meta.flush()
 
     try:
         upsert_stream_record(
@@ -206,13 +338,115 @@ def download_stream(channel_name, folder_name=None):
     except Exception as e:
         logger.exception(f"DB error final update: {e}")
 
-    chat_json = os.path.join(folder_name, "chat.live.json")
+    try:
+        generate_thumbnails(live_mp4, thumbs_dir, duration=dur_sec)
+    except Exception as e:
+        logger.exception(f"Error generating thumbnails for {live_mp4}: {e}")
+
+    chat_log = os.path.join(folder_name, "chat.live.log")
     chat_sqlite = os.path.join(folder_name, "chat.live.sqlite")
-    from modules.file_utils import process_chat_to_sqlite
+    from modules.chat_import import import_text_log, message_count
+
+    # ChatLogger fills the SQLite as chat arrives; the text log fills in when
+    # that didn't happen (e.g. the live database could not be written). No
+    # worker processes: forking this multi-threaded recorder isn't safe.
+    if os.path.exists(chat_log) and not message_count(chat_sqlite):
+        try:
+            import_text_log(chat_log, chat_sqlite, workers=1)
+        except Exception as e:
+            logger.exception(f"Error importing chat log into SQLite: {e}")
+
+    from modules.chat_replay import build_replay_bundle
+
+    if os.path.exists(chat_sqlite):
+        try:
+            build_replay_bundle(chat_sqlite)
+        except Exception as e:
+            logger.exception(f"Error building chat replay bundle: {e}")
+
+    from modules.catalog import refresh_folder
 
     try:
-        process_chat_to_sqlite(chat_json, chat_sqlite)
+        refresh_folder(folder_name)
     except Exception as e:
-        logger.exception(f"Error converting chat JSON to SQLite: {e}")
+        logger.exception(f"Error updating catalog for {folder_name}: {e}")
 
     logger.info(f"[{channel_name}] download_stream completed.")
+
+
+def watch_channels(channels, check_interval=None):
+    """
+    Record every channel in channels whenever it goes live, one thread per
+    active recording. Runs until interrupted.
+    """
+    if check_interval is None:
+        check_interval = int(os.getenv("CHECK_INTERVAL", "300"))
+    recordings = {}
+    logger.info(f"Watching {len(channels)} channels every {check_interval}s")
+    while True:
+        for channel_name, thread in list(recordings.items()):
+            if not thread.is_alive():
+                del recordings[channel_name]
+
+        for channel_name in channels:
+            if channel_name in recordings:
+                continue
+            try:
+                live = get_stream_data(channel_name)
+            except Exception as e:
+                logger.warning(f"Could not check {channel_name}: {e}")
+                continue
+            if not live:
+                continue
+            logger.info(f"[{channel_name}] is live; starting recording")
+            thread = threading.Thread(
+                target=download_stream,
+                args=(channel_name,),
+                name=f"record-{channel_name}",
+            )
+            thread.start()
+            recordings[channel_name] = thread
+
+        time.sleep(check_interval)
+
+
+def setup_logging():
+    configure_logger(
+        logger_name="download_streams",
+        log_file_name="download_streams.log",
+        console_level=logging.DEBUG,
+        file_level=logging.DEBUG,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record Twitch live streams")
+    parser.add_argument(
+        "channels",
+        nargs="*",
+        help="Record these channels now (default: watch CHANNEL_NAMES)",
+    )
+    args = parser.parse_args(argv)
+    setup_logging()
+
+    if args.channels:
+        threads = [
+            threading.Thread(target=download_stream, args=(channel,))
+            for channel in args.channels
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return
+
+    channel_str = os.getenv("CHANNEL_NAMES", "")
+    channels = [c.strip() for c in channel_str.split(",") if c.strip()]
+    if not channels:
+        logger.warning("No CHANNEL_NAMES found in .env. Exiting.")
+        return
+    watch_channels(channels)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,25 @@
 import os
-import sys
+import glob
+import shutil
 import logging
 
 from dotenv import load_dotenv
 
-LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
-os.makedirs(LOG_DIR, exist_ok=True)
+from modules.logging_setup import configure_logger
 
 logger = logging.getLogger("download_vods")
-logger.setLevel(logging.DEBUG)
-
-file_handler = logging.FileHandler(
-    os.path.join(LOG_DIR, "download_vods.log"), mode="a", encoding="utf-8"
-)
-file_handler.setLevel(logging.DEBUG)
-
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setLevel(logging.DEBUG)
-
-formatter = logging.Formatter(
-    "%(asctime)s [%(levelname)s] %(name)s - %(message)s", "%Y-%m-%d %H:%M:%S"
-)
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
-
-if not logger.handlers:
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
 
 try:
     from modules.api_utils import get_channel_id, get_vods_for_channel
-    from modules.db_utils import init_db, upsert_stream_record
-    from modules.file_utils import (
-        read_json,
-        write_json,
-        calculate_sha256,
-        get_local_file_duration,
-    )
+    from modules.db_utils import init_db, upsert_stream_record, find_stream_folder
+    from modules.file_utils import calculate_sha256, get_local_file_duration
+    from modules.metadata_store import MetadataStore
+    from modules.catalog import refresh_folder
+    from modules.blob_store import store_file
     from modules.video_utils import download_vod, download_thumbnail
+    from modules.thumbnails import generate_thumbnails
+    from modules.download_scheduler import DownloadScheduler, parse_twitch_duration
+    from modules.profiling import profiled
 except ImportError as e:
     logger.exception("Failed to import modules:")
     raise
@@ -47,8 +29,70 @@ load_dotenv()
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 PERSONS_DIR = os.path.join(BASE_DIR, "persons")
 
+# Re-downloads avoided because a VOD was found in its existing folder by id.
+sync_stats = {
+    "reused_folders": 0,
+    "bytes_saved": 0,
+    "bytes_deduplicated": 0,
+    "deferred": 0,
+    "deferred_bytes": 0,
+}
+# A download shorter than this fraction of the Twitch duration is incomplete.
+MIN_COMPLETE_RATIO = 0.95
+
+
+def resolve_vod_folder(channel_name, real_stream_id, vod_id, safe_title):
+    """
+    Existing folder for this stream/VOD (by id), else the title-based path.
+    Titles can be edited after a stream, so the path must not be rebuilt from
+    the title once a folder exists; live recordings are found by stream_id.
+    """
+    folder = find_stream_folder(real_stream_id, vod_id)
+    if folder:
+        return folder
+    livestreams_dir = os.path.join(PERSONS_DIR, channel_name, "twitch", "livestreams")
+    # Folders created before the id lookup existed all end in _<stream_id>.
+    matches = sorted(
+        glob.glob(os.path.join(glob.escape(livestreams_dir), f"*_{real_stream_id}"))
+    )
+    if matches:
+        return matches[0]
+    return os.path.join(livestreams_dir, f"{safe_title}_{real_stream_id}")
+
+
+def is_incomplete(local_duration, expected):
+    """
+    True if a download is shorter than the Twitch duration, or can't be probed
+    at all (e.g. cut off by a full disk). Without ffprobe nothing is judged.
+    """
+    if not expected:
+        return False
+    if local_duration <= 0:
+        return bool(shutil.which(os.getenv("FFPROBE_PATH", "ffprobe")))
+    return local_duration < expected * MIN_COMPLETE_RATIO
+
+
+def vod_folder(channel_name, vod):
+    """(folder the VOD belongs in, folder its title alone would give)."""
+    real_stream_id = vod.get("stream_id") or vod["id"]
+    safe_title = "".join(
+        c if c.isalnum() or c in (" ", "_", "-") else "_" for c in vod["title"]
+    )
+    title_folder = os.path.join(
+        PERSONS_DIR,
+        channel_name,
+        "twitch",
+        "livestreams",
+        f"{safe_title}_{real_stream_id}",
+    )
+    folder_name = resolve_vod_folder(
+        channel_name, real_stream_id, vod["id"], safe_title
+    )
+    return folder_name, title_folder
 
-def process_vod(channel_name, vod):
+
+@profiled
+def process_vod(channel_name, vod, scheduler=None):
     logger.debug(f"[{channel_name}] process_vod called with VOD: {vod.get('id')}")
 
     vod_id = vod["id"]
@@ -59,16 +103,11 @@ def process_vod(channel_name, vod):
     thumbnail_url = vod.get("thumbnail_url")
     vod_url = vod.get("url")
 
-    safe_title = "".join(
-        c if c.isalnum() or c in (" ", "_", "-") else "_" for c in vod_title
-    )
-    folder_name = os.path.join(
-        PERSONS_DIR,
-        channel_name,
-        "twitch",
-        "livestreams",
-        f"{safe_title}_{real_stream_id}",
-    )
+    folder_name, title_folder = vod_folder(channel_name, vod)
+    if folder_name != title_folder:
+        logger.info(
+            f"[{channel_name}] VOD {vod_id} resolved by id to existing folder {folder_name}"
+        )
     os.makedirs(folder_name, exist_ok=True)
     videos_dir = os.path.join(folder_name, "videos")
     os.makedirs(videos_dir, exist_ok=True)
@@ -81,14 +120,30 @@ def process_vod(channel_name, vod):
 
     logger.info(f"[{channel_name}] Processing VOD id={vod_id}, folder={folder_name}")
 
-    existing_meta = read_json(metadata_file)
+    existing_meta = MetadataStore(metadata_file)
 
+    expected = parse_twitch_duration(duration_str)
     if os.path.exists(vod_file):
         logger.info(f"[{channel_name}] VOD file already exists: {vod_file}")
         local_duration = get_local_file_duration(vod_file)
         logger.debug(
             f"[{channel_name}] local_duration={local_duration:.1f}s, twitch_duration_str={duration_str}"
         )
+        if is_incomplete(local_duration, expected):
+            # Left by a run from before downloads were checked; process_queue
+            # schedules it again on the next run.
+            logger.error(
+                f"[{channel_name}] Existing VOD {vod_id} is truncated "
+                f"({local_duration:.0f}s of {expected}s); moving it aside"
+            )
+            os.replace(vod_file, vod_file + ".incomplete")
+            # The re-download must be hashed (and stored) afresh.
+            existing_meta.set("vod_sha256", None)
+            existing_meta.flush()
+            return
+        if folder_name != title_folder:
+            sync_stats["reused_folders"] += 1
+            sync_stats["bytes_saved"] += os.path.getsize(vod_file)
     else:
         logger.debug(f"[{channel_name}] Downloading VOD from {vod_url}")
         try:
@@ -96,6 +151,20 @@ def process_vod(channel_name, vod):
         except Exception as e:
             logger.exception(f"[{channel_name}] Error downloading VOD {vod_id}")
             return
+        local_duration = get_local_file_duration(vod_file)
+        if is_incomplete(local_duration, expected):
+            # e.g. the disk filled up; keep it out of the "already downloaded" path
+            logger.error(
+                f"[{channel_name}] VOD {vod_id} is incomplete "
+                f"({local_duration:.0f}s of {expected}s); moving it aside"
+            )
+            os.replace(vod_file, vod_file + ".incomplete")
+            # The re-download must be hashed (and stored) afresh.
+            existing_meta.set("vod_sha256", None)
+            existing_meta.flush()
+            return
+        if scheduler:
+            scheduler.learn(channel_name, os.path.getsize(vod_file), local_duration)
 
     if thumbnail_url and not os.path.exists(thumb_file):
         logger.debug(f"[{channel_name}] Downloading thumbnail {thumbnail_url}")
@@ -104,10 +173,26 @@ def process_vod(channel_name, vod):
         except Exception as e:
             logger.exception(f"[{channel_name}] Error downloading thumbnail:")
 
-    if os.path.exists(vod_file) and "vod_sha256" not in existing_meta:
+    if os.path.exists(vod_file):
+        try:
+            generate_thumbnails(vod_file, thumb_dir)
+        except Exception as e:
+            logger.exception(f"[{channel_name}] Error generating thumbnails:")
+
+    # Live recordings carry "vod_sha256": None until their VOD lands here.
+    if os.path.exists(vod_file) and not existing_meta.get("vod_sha256"):
         logger.debug(f"[{channel_name}] Computing SHA256 for {vod_file}")
         sha = calculate_sha256(vod_file)
-        existing_meta["vod_sha256"] = sha
+        existing_meta.set("vod_sha256", sha)
+        try:
+            for path, known in ((vod_file, sha), (thumb_file, None)):
+                if os.path.exists(path):
+                    _, reclaimed = store_file(path, known)
+                    sync_stats["bytes_deduplicated"] += reclaimed
+        except OSError as e:
+            logger.warning(
+                f"[{channel_name}] Could not add {vod_id} to blob store: {e}"
+            )
 
     existing_meta.update(
         {
@@ -116,9 +201,11 @@ def process_vod(channel_name, vod):
             "title": vod_title,
             "thumbnail_url": thumbnail_url,
             "url": vod_url,
+            "duration": parse_twitch_duration(duration_str)
+            or existing_meta.get("duration"),
         }
     )
-    write_json(metadata_file, existing_meta)
+    existing_meta.flush()
 
     try:
         upsert_stream_record(
@@ -129,27 +216,34 @@ def process_vod(channel_name, vod):
             existing_meta.get("end_time"),
             vod_title,
             source="vod",
+            vod_id=vod_id,
         )
     except Exception as e:
         logger.exception(
             f"[{channel_name}] Failed upserting VOD info into DB for {vod_id}"
         )
 
+    try:
+        refresh_folder(folder_name)
+    except Exception as e:
+        logger.exception(f"[{channel_name}] Failed updating catalog for {vod_id}")
+
     logger.info(f"[{channel_name}] Finished processing VOD id={vod_id}")
 
 
-def process_channel(channel_name):
-    logger.info(f"[{channel_name}] process_channel started.")
+@profiled
+def fetch_channel_vods(channel_name):
+    logger.info(f"[{channel_name}] Fetching VOD list.")
     try:
         user_id = get_channel_id(channel_name)
     except Exception as e:
         logger.exception(f"[{channel_name}] Error looking up channel_id")
-        return
+        return []
     if not user_id:
         logger.error(
             f"[{channel_name}] Could not retrieve user_id. Channel may not exist."
         )
-        return
+        return []
 
     logger.debug(f"[{channel_name}] user_id={user_id}")
 
@@ -175,15 +269,44 @@ def process_channel(channel_name):
             break
 
     logger.info(f"[{channel_name}] Found {len(all_vods)} total VODs.")
-
-    for vod in all_vods:
+    return all_vods
+
+
+@profiled
+def process_queue(queue, scheduler):
+    """
+    Process (channel, vod) pairs in scheduler order. Once a download doesn't
+    fit on disk no new downloads start; VODs already on disk are still updated.
+    """
+    downloads_stopped = False
+    for channel_name, vod in scheduler.order(queue):
+        folder_name, _ = vod_folder(channel_name, vod)
+        needs_download = not os.path.exists(
+            os.path.join(folder_name, "videos", "vod.mp4")
+        )
+        if needs_download:
+            duration = parse_twitch_duration(vod.get("duration"))
+            if not downloads_stopped and not scheduler.admit(channel_name, duration):
+                downloads_stopped = True
+            if downloads_stopped:
+                sync_stats["deferred"] += 1
+                sync_stats["deferred_bytes"] += scheduler.estimate(
+                    channel_name, duration
+                )
+                continue
         try:
-            process_vod(channel_name, vod)
+            process_vod(channel_name, vod, scheduler)
         except Exception as e:
             logger.exception(f"[{channel_name}] Exception processing a VOD:")
 
 
-def main():
+def main(order=None):
+    configure_logger(
+        logger_name="download_vods",
+        log_file_name="download_vods.log",
+        console_level=logging.DEBUG,
+        file_level=logging.DEBUG,
+    )
     logger.info("download_vods.py started.")
     try:
         init_db()
@@ -200,8 +323,27 @@ def main():
         logger.warning("No CHANNEL_NAMES found in .env. Exiting.")
         return
 
-    for ch in channels:
-        process_channel(ch)
+    scheduler = DownloadScheduler(policy=order, channel_order=channels)
+    queue = [(ch, vod) for ch in channels for vod in fetch_channel_vods(ch)]
+    logger.info(f"Processing {len(queue)} VODs, {scheduler.policy} first.")
+    process_queue(queue, scheduler)
+
+    if sync_stats["reused_folders"]:
+        logger.info(
+            f"Stable-ID resolution avoided {sync_stats['reused_folders']} re-downloads "
+            f"({sync_stats['bytes_saved'] / 1024**3:.2f} GiB)."
+        )
+    if sync_stats["bytes_deduplicated"]:
+        logger.info(
+            f"Blob store linked duplicate files, reclaiming "
+            f"{sync_stats['bytes_deduplicated'] / 1024**3:.2f} GiB."
+        )
+
+    if sync_stats["deferred"]:
+        logger.warning(
+            f"Deferred {sync_stats['deferred']} VOD downloads "
+            f"(~{sync_stats['deferred_bytes'] / 1024**3:.1f} GiB) for lack of disk space."
+        )
 
     logger.info("download_vods.py finished. Exiting normally.")
 
@@ -2,15 +2,23 @@ import os
 import requests
 from dotenv import load_dotenv
 
-TWITCH_STREAMS_ENDPOINT = "https://api.twitch.tv/helix/streams"
-TWITCH_VIDEOS_ENDPOINT = "https://api.twitch.tv/helix/videos"
-TWITCH_USERS_ENDPOINT = "https://api.twitch.tv/helix/users"
+from .token_manager import TokenManager, current_access_token
+from .profiling import profiled
+from .helix_cache import cached_get
+
+load_dotenv()
+
+# Override with a twitch_standin.py address to run against the offline stand-in.
+TWITCH_API_BASE = os.getenv("TWITCH_API_BASE", "https://api.twitch.tv").rstrip("/")
+
+TWITCH_STREAMS_ENDPOINT = f"{TWITCH_API_BASE}/helix/streams"
+TWITCH_VIDEOS_ENDPOINT = f"{TWITCH_API_BASE}/helix/videos"
+TWITCH_USERS_ENDPOINT = f"{TWITCH_API_BASE}/helix/users"
 
 
 def get_headers():
-    load_dotenv(override=True)
     client_id = os.getenv("CLIENT_ID")
-    access_token = os.getenv("ACCESS_TOKEN")
+    access_token = current_access_token()
 
     if not client_id or not access_token:
         raise RuntimeError("Missing CLIENT_ID or ACCESS_TOKEN in environment")
@@ -18,32 +26,46 @@ def get_headers():
     return {"Client-ID": client_id, "Authorization": f"Bearer {access_token}"}
 
 
+def _helix_request(url, params, extra_headers):
+    """GET a Helix endpoint; on 401 refresh the token (single-flighted) and retry once."""
+    headers = {**get_headers(), **extra_headers}
+    resp = requests.get(url, headers=headers, params=params)
+    if resp.status_code == 401:
+        rejected = headers["Authorization"].split(" ", 1)[1]
+        if TokenManager().refresh(seen_access_token=rejected):
+            resp = requests.get(
+                url, headers={**get_headers(), **extra_headers}, params=params
+            )
+    resp.raise_for_status()
+    return resp
+
+
+@profiled
+def helix_get(url, params):
+    """GET a Helix endpoint through the shared response cache (modules/helix_cache.py)."""
+    return cached_get(url, params, lambda extra: _helix_request(url, params, extra))
+
+
 def get_stream_data(channel_name: str):
-    headers = get_headers()
     params = {"user_login": channel_name}
 
-    resp = requests.get(TWITCH_STREAMS_ENDPOINT, headers=headers, params=params)
-    resp.raise_for_status()
+    resp = helix_get(TWITCH_STREAMS_ENDPOINT, params)
     data = resp.json().get("data", [])
     return data[0] if data else None
 
 
 def get_channel_id(channel_name: str) -> str:
-    headers = get_headers()
     params = {"login": channel_name}
 
-    resp = requests.get(TWITCH_USERS_ENDPOINT, headers=headers, params=params)
-    resp.raise_for_status()
+    resp = helix_get(TWITCH_USERS_ENDPOINT, params)
     data = resp.json().get("data", [])
     return data[0]["id"] if data else None
 
 
 def get_vods_for_channel(user_id: str, after_cursor=None):
-    headers = get_headers()
     params = {"user_id": user_id, "first": 100, "type": "archive"}
     if after_cursor:
         params["after"] = after_cursor
 
-    resp = requests.get(TWITCH_VIDEOS_ENDPOINT, headers=headers, params=params)
-    resp.raise_for_status()
+    resp = helix_get(TWITCH_VIDEOS_ENDPOINT, params)
     return resp.json()
@@ -0,0 +1,341 @@
+"""
+Content-addressed blob store keyed by SHA-256.
+
+Blobs live at blobs/sha256/<ab>/<cd>/<full hash><ext>. Files in stream
+folders are hardlinked (or reflinked, see BLOB_LINK_MODE) to their blob, so
+identical VODs, thumbnails and emotes are stored once. A hardlinked file
+shares every later write with its blob and its other links, so only finished
+media is stored: videos/*.mp4 and thumbnail/sprite images. SQLite databases,
+chat logs, .tcb files and JSON are appended to or rewritten and are never
+linked. Folders still being recorded (unfinalized recording.journal) and
+files written in the last ACTIVE_SECONDS are left alone too. Use reflink on
+filesystems that support it (btrfs, XFS) for copy-on-write isolation.
+
+`python -m modules.blob_store dedup` links existing duplicates: files are
+grouped by size first, then by a hash of their first block, and only files
+that still collide are hashed in full (in parallel).
+"""
+
+import os
+import sys
+import errno
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from .db_utils import BASE_DIR
+from .file_utils import calculate_sha256, file_mode_for
+from .recording_journal import JOURNAL_NAME, RecordingJournal
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = os.path.join(BASE_DIR, "blobs", "sha256")
+PERSONS_DIR = os.path.join(BASE_DIR, "persons")
+LINK_MODE = os.getenv("BLOB_LINK_MODE", "auto")  # auto | hardlink | reflink
+MIN_DEDUP_SIZE = 4096
+PREFIX_BYTES = 64 * 1024
+FICLONE = 0x40049409
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+# Files modified this recently may still be written to.
+ACTIVE_SECONDS = 600
+
+
+def is_immutable_media(path):
+    """videos/*.mp4 and images under thumbnails/: the files safe to hardlink."""
+    parts = os.path.normpath(path).lower().split(os.sep)
+    if len(parts) >= 2 and parts[-2] == "videos" and parts[-1].endswith(".mp4"):
+        return True
+    return "thumbnails" in parts[:-1] and parts[-1].endswith(IMAGE_EXTENSIONS)
+
+
+def _recording(folder):
+    """True while folder holds an unfinished live recording session."""
+    if not os.path.exists(os.path.join(folder, JOURNAL_NAME)):
+        return False
+    journal = RecordingJournal(folder)
+    return journal.started and not journal.finalized
+
+
+def blob_path(sha256, ext=""):
+    return os.path.join(BLOB_DIR, sha256[:2], sha256[2:4], sha256 + ext)
+
+
+def _reflink(src, dst):
+    import fcntl
+
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def _link(src, dst):
+    """Create dst as a hardlink/reflink of src (dst must not exist)."""
+    if LINK_MODE in ("auto", "reflink") and sys.platform.startswith("linux"):
+        try:
+            _reflink(src, dst)
+            return "reflink"
+        except OSError:
+            if os.path.exists(dst):
+                os.remove(dst)
+            if LINK_MODE == "reflink":
+                raise
+    os.link(src, dst)
+    return "hardlink"
+
+
+def _replace_with_link(blob, path):
+    """Atomically swap path for a link to blob."""
+    fd, tmp = tempfile.mkstemp(
+        prefix=f".{os.path.basename(path)}.", dir=os.path.dirname(path)
+    )
+    os.close(fd)
+    os.remove(tmp)
+    try:
+        _link(blob, tmp)
+        shutil.copystat(path, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _create_blob(path, blob):
+    """
+    Make blob a link/reflink of path per BLOB_LINK_MODE; raises FileExistsError
+    if another process stored it first.
+    """
+    fd, tmp = tempfile.mkstemp(prefix=".", dir=os.path.dirname(blob))
+    os.close(fd)
+    os.remove(tmp)
+    try:
+        _link(path, tmp)
+        os.link(tmp, blob)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def same_file(a, b):
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+def store_file(path, sha256=None):
+    """
+    Put an existing file into the blob store and link it back in place.
+    Returns (sha256, bytes reclaimed): reclaimed is the file size when an
+    identical blob already existed, 0 otherwise. Only immutable media is
+    accepted (see is_immutable_media); anything else raises ValueError.
+    """
+    if not is_immutable_media(path):
+        raise ValueError(f"{path} is not immutable media; not storing it")
+    sha256 = sha256 or calculate_sha256(path)
+    ext = os.path.splitext(path)[1].lower()
+    blob = blob_path(sha256, ext)
+    if same_file(blob, path):
+        return sha256, 0
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    if not os.path.exists(blob):
+        try:
+            _create_blob(path, blob)
+            return sha256, 0
+        except FileExistsError:
+            pass
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # Blob store on another filesystem: keep a copy in the store only.
+            shutil.copy2(path, blob)
+            return sha256, 0
+    if os.path.getsize(blob) != os.path.getsize(path):
+        logger.error(f"Blob {blob} size differs from {path}; not linking")
+        return sha256, 0
+    size = os.path.getsize(path)
+    try:
+        _replace_with_link(blob, path)
+    except OSError as e:
+        logger.warning(f"Could not link {path} to {blob}: {e}")
+        return sha256, 0
+    return sha256, size
+
+
+def put_bytes(data, ext=""):
+    """Store bytes (e.g. an emote image); returns (sha256, blob path)."""
+    sha256 = hashlib.sha256(data).hexdigest()
+    blob = blob_path(sha256, ext)
+    if not os.path.exists(blob):
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(blob))
+        with os.fdopen(fd, "wb") as f:
+            os.fchmod(f.fileno(), file_mode_for(blob))
+            f.write(data)
+        os.replace(tmp, blob)
+    return sha256, blob
+
+
+def link_blob(sha256, path, ext=""):
+    """Materialise a stored blob at path (hardlink/reflink)."""
+    blob = blob_path(sha256, ext)
+    if os.path.exists(path):
+        if same_file(blob, path):
+            return
+        os.remove(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        _link(blob, path)
+    except OSError:
+        shutil.copy2(blob, path)
+
+
+def _prefix_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read(PREFIX_BYTES)).hexdigest()
+
+
+def _collect(roots, min_size):
+    by_size = defaultdict(list)
+    active_since = time.time() - ACTIVE_SECONDS
+    for root in roots:
+        for dirpath, dirs, names in os.walk(root):
+            if JOURNAL_NAME in names and _recording(dirpath):
+                logger.info(f"Skipping {dirpath}: still being recorded")
+                dirs[:] = []
+                continue
+            for name in names:
+                path = os.path.join(dirpath, name)
+                if name.startswith(".") or not is_immutable_media(path):
+                    continue
+                try:
+                    st = os.stat(path, follow_symlinks=False)
+                except OSError:
+                    continue
+                if st.st_mtime > active_since or not os.path.isfile(path):
+                    continue
+                if st.st_size >= min_size:
+                    by_size[st.st_size].append((path, (st.st_dev, st.st_ino)))
+    return by_size
+
+
+def dedup(roots=None, workers=4, dry_run=False, min_size=MIN_DEDUP_SIZE):
+    """
+    Link duplicate files under roots (default: persons/) through the blob store.
+    Returns a stats dict; reclaimed_bytes is what was (or would be) freed.
+    """
+    roots = roots or [PERSONS_DIR]
+    stats = {
+        "files": 0,
+        "size_candidates": 0,
+        "hashed_files": 0,
+        "hashed_bytes": 0,
+        "duplicate_groups": 0,
+        "linked_files": 0,
+        "reclaimed_bytes": 0,
+    }
+    by_size = _collect(roots, min_size)
+    stats["files"] = sum(len(v) for v in by_size.values())
+
+    # Only sizes shared by files on different inodes can hold duplicates.
+    candidates = []
+    for size, entries in by_size.items():
+        inodes = {inode for _, inode in entries}
+        if len(inodes) > 1:
+            candidates.append((size, entries))
+    stats["size_candidates"] = sum(len(e) for _, e in candidates)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        groups = []
+        for size, entries in candidates:
+            paths = [p for p, _ in entries]
+            by_prefix = defaultdict(list)
+            for entry, prefix in zip(entries, pool.map(_prefix_hash, paths)):
+                by_prefix[prefix].append(entry)
+            for group in by_prefix.values():
+                if len({inode for _, inode in group}) > 1:
+                    groups.append((size, group))
+
+        # One full hash per distinct inode.
+        to_hash = {}
+        for size, group in groups:
+            for path, inode in group:
+                to_hash.setdefault(inode, (path, size))
+        hashes = dict(
+            zip(
+                to_hash,
+                pool.map(calculate_sha256, [p for p, _ in to_hash.values()]),
+            )
+        )
+    stats["hashed_files"] = len(to_hash)
+    stats["hashed_bytes"] = sum(size for _, size in to_hash.values())
+
+    by_hash = defaultdict(list)
+    for size, group in groups:
+        for path, inode in group:
+            by_hash[hashes[inode]].append((path, inode, size))
+
+    for sha256, entries in by_hash.items():
+        inodes = {inode for _, inode, _ in entries}
+        if len(inodes) < 2:
+            continue
+        stats["duplicate_groups"] += 1
+        seen = set()
+        for path, inode, size in entries:
+            first_of_inode = inode not in seen
+            seen.add(inode)
+            if dry_run:
+                if first_of_inode and len(seen) > 1:
+                    stats["linked_files"] += 1
+                    stats["reclaimed_bytes"] += size
+                continue
+            try:
+                _, reclaimed = store_file(path, sha256)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Dedup failed for {path}: {e}")
+                continue
+            if reclaimed and first_of_inode:
+                stats["linked_files"] += 1
+                stats["reclaimed_bytes"] += reclaimed
+
+    logger.info(
+        f"Dedup {'(dry run) ' if dry_run else ''}{stats['files']} files, "
+        f"{stats['hashed_files']} hashed ({stats['hashed_bytes'] / 1024**3:.2f} GiB), "
+        f"{stats['duplicate_groups']} duplicate groups, "
+        f"{stats['reclaimed_bytes'] / 1024**3:.2f} GiB reclaimed"
+    )
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Content-addressed blob store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("dedup", help="Link duplicate files through the blob store")
+    p.add_argument("roots", nargs="*", help="Folders to scan (default: persons/)")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--dry-run", action="store_true")
+    p.add_argument("--min-size", type=int, default=MIN_DEDUP_SIZE)
+    p = sub.add_parser("store", help="Move files into the store and link them back")
+    p.add_argument("paths", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.command == "dedup":
+        stats = dedup(args.roots, args.workers, args.dry_run, args.min_size)
+        for key, value in stats.items():
+            print(f"{key}: {value}")
+    else:
+        for path in args.paths:
+            try:
+                sha256, reclaimed = store_file(path)
+            except ValueError as e:
+                logger.error(str(e))
+                continue
+            print(f"{sha256}  {path}  reclaimed={reclaimed}")
+
+
+if __name__ == "__main__":
+    main()
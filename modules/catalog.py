@@ -0,0 +1,396 @@
+"""
+Incremental catalog of the persons/ tree.
+
+metadata/catalog.db keeps one row per stream folder (with its metadata.json)
+and one row per file (size, mtime, SHA-256, duration), so the website and the
+scripts can answer "what do we have" without walking the archive. A rescan
+only re-reads folders whose signature changed: the mtimes of the folder and
+its direct subfolders (videos/, thumbnails/, ...). metadata.json is written by
+rename, so a metadata change also bumps the folder mtime. `watch` uses inotify
+(inotify_simple) when it is installed and falls back to periodic rescans.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import argparse
+
+from .db_utils import BASE_DIR
+from .file_utils import atomic_write_json, get_local_file_duration, read_json
+
+logger = logging.getLogger(__name__)
+
+PERSONS_DIR = os.path.join(BASE_DIR, "persons")
+CATALOG_PATH = os.path.join(BASE_DIR, "metadata", "catalog.db")
+CATALOG_JSON_PATH = os.path.join(BASE_DIR, "metadata", "catalog.json")
+VIDEO_EXTENSIONS = (".mp4", ".ts", ".mkv")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+POLL_INTERVAL = 300
+SETTLE_SECONDS = 5
+
+
+def get_connection(path=CATALOG_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS folders (
+            folder TEXT PRIMARY KEY,
+            channel_name TEXT,
+            signature TEXT,
+            scanned_at REAL,
+            stream_id TEXT,
+            vod_id TEXT,
+            title TEXT,
+            start_time TEXT,
+            end_time TEXT,
+            duration REAL,
+            total_bytes INTEGER,
+            thumbnail TEXT,
+            metadata_json TEXT
+        )
+    """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS files (
+            folder TEXT,
+            rel_path TEXT,
+            kind TEXT,
+            size INTEGER,
+            mtime REAL,
+            sha256 TEXT,
+            duration REAL,
+            PRIMARY KEY (folder, rel_path)
+        )
+    """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_folders_channel ON folders (channel_name)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_folders_stream ON folders (stream_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_files_sha ON files (sha256)")
+    return conn
+
+
+def iter_stream_folders(persons_dir=PERSONS_DIR):
+    """(channel_name, absolute folder path) for every stream folder."""
+    try:
+        channels = list(os.scandir(persons_dir))
+    except FileNotFoundError:
+        return
+    for channel in channels:
+        livestreams = os.path.join(channel.path, "twitch", "livestreams")
+        try:
+            entries = list(os.scandir(livestreams))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for entry in entries:
+            if entry.is_dir():
+                yield channel.name, entry.path
+
+
+def folder_signature(folder):
+    parts = [str(os.stat(folder).st_mtime_ns)]
+    for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+        if entry.is_dir():
+            parts.append(f"{entry.name}:{entry.stat().st_mtime_ns}")
+    return "|".join(parts)
+
+
+def _kind(rel_path):
+    lower = rel_path.lower()
+    if lower.endswith(VIDEO_EXTENSIONS):
+        return "video"
+    if lower.endswith(IMAGE_EXTENSIONS):
+        return "thumbnail"
+    if lower.endswith((".sqlite", ".db")):
+        return "database"
+    if ".log" in lower or lower.endswith((".tcb", ".json", ".jsonl", ".bin")):
+        return "chat" if lower.startswith("chat") else "data"
+    return "other"
+
+
+def _rel(folder, persons_dir=PERSONS_DIR):
+    return os.path.relpath(folder, persons_dir).replace(os.sep, "/")
+
+
+def scan_folder(
+    conn, channel_name, folder, probe=True, signature=None, persons_dir=PERSONS_DIR
+):
+    """(Re)catalog one stream folder, reusing hashes/durations of unchanged files."""
+    rel_folder = _rel(folder, persons_dir)
+    signature = signature or folder_signature(folder)
+    meta = read_json(os.path.join(folder, "metadata.json"))
+
+    previous = {
+        row[0]: row[1:]
+        for row in conn.execute(
+            "SELECT rel_path, size, mtime, sha256, duration FROM files WHERE folder = ?",
+            (rel_folder,),
+        )
+    }
+
+    files = []
+    total_bytes = 0
+    thumbnail = None
+    for root, _dirs, names in os.walk(folder):
+        for name in names:
+            path = os.path.join(root, name)
+            rel_path = os.path.relpath(path, folder).replace(os.sep, "/")
+            st = os.stat(path)
+            kind = _kind(rel_path)
+            sha256 = None
+            duration = None
+            old = previous.get(rel_path)
+            if old and old[0] == st.st_size and old[1] == st.st_mtime:
+                sha256, duration = old[2], old[3]
+            if kind == "video":
+                if rel_path.endswith("vod.mp4"):
+                    sha256 = sha256 or meta.get("vod_sha256")
+                if duration is None:
+                    if meta.get("duration"):
+                        duration = float(meta["duration"])
+                    elif probe:
+                        duration = get_local_file_duration(path)
+            if kind == "thumbnail" and thumbnail is None:
+                thumbnail = f"{rel_folder}/{rel_path}"
+            total_bytes += st.st_size
+            files.append(
+                (rel_folder, rel_path, kind, st.st_size, st.st_mtime, sha256, duration)
+            )
+
+    conn.execute("DELETE FROM files WHERE folder = ?", (rel_folder,))
+    conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", files)
+    durations = [f[6] for f in files if f[2] == "video" and f[6]]
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+        (
+            rel_folder,
+            channel_name,
+            signature,
+            time.time(),
+            meta.get("stream_id"),
+            meta.get("vod_id"),
+            meta.get("title"),
+            meta.get("start_time") or meta.get("created_at"),
+            meta.get("end_time"),
+            meta.get("duration") or (max(durations) if durations else None),
+            total_bytes,
+            thumbnail,
+            json.dumps(meta, ensure_ascii=False),
+        ),
+    )
+
+
+def scan(conn=None, persons_dir=PERSONS_DIR, probe=True):
+    """Incremental rescan of the whole tree. Returns (scanned, unchanged, removed)."""
+    own_conn = conn is None
+    conn = conn or get_connection()
+    known = dict(conn.execute("SELECT folder, signature FROM folders"))
+    seen = set()
+    scanned = unchanged = 0
+    for channel_name, folder in iter_stream_folders(persons_dir):
+        rel_folder = _rel(folder, persons_dir)
+        seen.add(rel_folder)
+        try:
+            signature = folder_signature(folder)
+            if known.get(rel_folder) == signature:
+                unchanged += 1
+                continue
+            scan_folder(
+                conn,
+                channel_name,
+                folder,
+                probe=probe,
+                signature=signature,
+                persons_dir=persons_dir,
+            )
+            scanned += 1
+        except OSError as e:
+            logger.warning(f"Skipping {folder}: {e}")
+            continue
+        if scanned % 500 == 0:
+            conn.commit()
+            logger.info(f"Catalog: {scanned} folders rescanned so far")
+    removed = [f for f in known if f not in seen]
+    for rel_folder in removed:
+        conn.execute("DELETE FROM folders WHERE folder = ?", (rel_folder,))
+        conn.execute("DELETE FROM files WHERE folder = ?", (rel_folder,))
+    conn.commit()
+    if own_conn:
+        conn.close()
+    logger.info(
+        f"Catalog scan: {scanned} rescanned, {unchanged} unchanged, {len(removed)} removed"
+    )
+    return scanned, unchanged, len(removed)
+
+
+def refresh_folder(folder, probe=False):
+    """Re-catalog a single folder right after a download finished writing it."""
+    channel_name = _rel(folder).split("/", 1)[0]
+    conn = get_connection()
+    try:
+        scan_folder(conn, channel_name, folder, probe=probe)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def export_json(path=CATALOG_JSON_PATH, conn=None):
+    """Single compact JSON file of all folders + files for the website."""
+    own_conn = conn is None
+    conn = conn or get_connection()
+    files = {}
+    for folder, rel_path, kind, size, sha256, duration in conn.execute(
+        "SELECT folder, rel_path, kind, size, sha256, duration FROM files"
+    ):
+        entry = {"path": rel_path, "kind": kind, "size": size}
+        if sha256:
+            entry["sha256"] = sha256
+        if duration:
+            entry["duration"] = duration
+        files.setdefault(folder, []).append(entry)
+    streams = []
+    for row in conn.execute(
+        "SELECT folder, channel_name, stream_id, vod_id, title, start_time, end_time, "
+        "duration, total_bytes, thumbnail FROM folders ORDER BY channel_name, start_time"
+    ):
+        keys = (
+            "folder",
+            "channel_name",
+            "stream_id",
+            "vod_id",
+            "title",
+            "start_time",
+            "end_time",
+            "duration",
+            "total_bytes",
+            "thumbnail",
+        )
+        stream = dict(zip(keys, row))
+        stream["files"] = files.get(stream["folder"], [])
+        streams.append(stream)
+    if own_conn:
+        conn.close()
+    atomic_write_json(path, {"generated_at": time.time(), "streams": streams})
+    return len(streams)
+
+
+def _watch_inotify(conn, persons_dir, probe):
+    from inotify_simple import INotify, flags
+
+    inotify = INotify()
+    mask = (
+        flags.CREATE
+        | flags.DELETE
+        | flags.MOVED_TO
+        | flags.MOVED_FROM
+        | flags.CLOSE_WRITE
+        | flags.DELETE_SELF
+    )
+    watches = {}
+
+    def add_watch(path):
+        try:
+            watches[inotify.add_watch(path, mask)] = path
+        except OSError as e:
+            logger.warning(f"Cannot watch {path}: {e}")
+
+    for channel in os.scandir(persons_dir):
+        livestreams = os.path.join(channel.path, "twitch", "livestreams")
+        if os.path.isdir(livestreams):
+            add_watch(livestreams)
+    for _channel, folder in iter_stream_folders(persons_dir):
+        add_watch(folder)
+        for entry in os.scandir(folder):
+            if entry.is_dir():
+                add_watch(entry.path)
+
+    logger.info(f"Catalog watching {len(watches)} directories via inotify")
+    dirty = set()
+    while True:
+        events = inotify.read(timeout=SETTLE_SECONDS * 1000 if dirty else None)
+        for event in events:
+            path = watches.get(event.wd)
+            if path is None:
+                continue
+            full = os.path.join(path, event.name) if event.name else path
+            rel = os.path.relpath(full, persons_dir).split(os.sep)
+            # <channel>/twitch/livestreams/<folder>/...
+            if len(rel) >= 4:
+                folder = os.path.join(persons_dir, *rel[:4])
+                dirty.add(folder)
+                if event.mask & flags.CREATE and os.path.isdir(full):
+                    add_watch(full)
+        if not events and dirty:
+            for folder in dirty:
+                rel_folder = _rel(folder, persons_dir)
+                channel_name = rel_folder.split("/", 1)[0]
+                if os.path.isdir(folder):
+                    try:
+                        scan_folder(
+                            conn,
+                            channel_name,
+                            folder,
+                            probe=probe,
+                            persons_dir=persons_dir,
+                        )
+                    except OSError as e:
+                        # e.g. a .part file renamed mid-walk; its event re-dirties it.
+                        logger.warning(f"Catalog could not rescan {folder}: {e}")
+                else:
+                    conn.execute("DELETE FROM folders WHERE folder = ?", (rel_folder,))
+                    conn.execute("DELETE FROM files WHERE folder = ?", (rel_folder,))
+            conn.commit()
+            export_json(conn=conn)
+            logger.info(f"Catalog updated {len(dirty)} folders")
+            dirty.clear()
+
+
+def watch(persons_dir=PERSONS_DIR, probe=True, interval=POLL_INTERVAL):
+    conn = get_connection()
+    scan(conn, persons_dir, probe=probe)
+    export_json(conn=conn)
+    try:
+        import inotify_simple  # noqa: F401
+    except ImportError:
+        logger.info(f"inotify_simple not installed; rescanning every {interval}s")
+    else:
+        _watch_inotify(conn, persons_dir, probe)
+        return
+    while True:
+        time.sleep(interval)
+        if scan(conn, persons_dir, probe=probe)[0]:
+            export_json(conn=conn)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive catalog")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("scan", help="Incremental rescan, then export catalog.json")
+    p.add_argument("--no-probe", action="store_true", help="Don't ffprobe durations")
+    p = sub.add_parser("watch", help="Keep the catalog up to date")
+    p.add_argument("--no-probe", action="store_true")
+    p.add_argument("--interval", type=int, default=POLL_INTERVAL)
+    sub.add_parser("export", help="Write metadata/catalog.json")
+    args = parser.parse_args(argv)
+
+    if args.command == "scan":
+        conn = get_connection()
+        scan(conn, probe=not args.no_probe)
+        export_json(conn=conn)
+        conn.close()
+    elif args.command == "watch":
+        watch(probe=not args.no_probe, interval=args.interval)
+    else:
+        export_json()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,587 @@
+"""
+Compact, append-only binary chat log (.tcb) with a sparse time index (.tcb.idx).
+
+Main file: 16-byte header (magic, start time in epoch ms) followed by records.
+Every record is a varint length plus payload; the first payload byte is the
+record type. User names, colours and emote ids are interned: the first time
+one is seen an intern record assigns it a small integer id, and messages refer
+to that id afterwards.
+
+    MESSAGE  varint offset_ms, varint user, varint flags,
+             [varint color] [varint bits] [varint n, n * varint emote], utf-8 text
+    USER / COLOR / EMOTE   varint id, utf-8 value
+
+The index file repeats the intern records and adds POINT records
+(offset_ms -> file position) every INDEX_EVERY_MS / INDEX_EVERY_MESSAGES, so a
+reader can load it, bisect to any moment of the stream and start decoding
+there. The index is only a cache: a missing or stale index is rebuilt from the
+main file.
+"""
+
+import os
+import mmap
+import struct
+import sqlite3
+import logging
+import argparse
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+
+from .chat_format import (
+    EMOTE_URL_TEMPLATE,
+    ROLE_NAMES,
+    emote_id_from_url,
+    format_chat_line,
+    format_rel,
+    parse_abs,
+    parse_chat_line,
+    parse_rel,
+)
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TCB\x01"
+INDEX_MAGIC = b"TCI\x01"
+HEADER = struct.Struct("<4s4xq")
+HEADER_SIZE = HEADER.size
+INDEX_SUFFIX = ".idx"
+
+REC_USER = 0x01
+REC_COLOR = 0x02
+REC_EMOTE = 0x03
+REC_MESSAGE = 0x10
+REC_POINT = 0x20
+
+# flags: low bits are roles in ROLE_NAMES order
+FLAG_COLOR = 0x10
+FLAG_BITS = 0x20
+FLAG_EMOTES = 0x40
+
+INDEX_EVERY_MS = 10_000
+INDEX_EVERY_MESSAGES = 512
+START_SAMPLE_LINES = 1000
+
+
+def _varint(n):
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _to_ms(dt):
+    return int(dt.timestamp() * 1000)
+
+
+def _iter_records(buf, pos, end):
+    """Yield (record_start, payload_start, payload_end) until a torn record."""
+    while pos < end:
+        start = pos
+        try:
+            length, pos = _read_varint(buf, pos)
+        except IndexError:
+            return
+        if length == 0 or pos + length > end:
+            return
+        yield start, pos, pos + length
+        pos += length
+
+
+class ChatBinaryReader:
+    def __init__(self, path):
+        self.path = path
+        self.users = []
+        self.colors = []
+        self.emotes = []
+        self.points = []
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < HEADER_SIZE:
+            raise ValueError(f"{path} is not a chat binary file")
+        self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.start_ms = HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a chat binary file")
+        self.size = size
+        self.end = size
+        self._load_index()
+        self._point_offsets = [p[0] for p in self.points]
+
+    @property
+    def start_time(self):
+        return datetime.fromtimestamp(self.start_ms / 1000, timezone.utc)
+
+    def _intern(self, kind, payload, start, end):
+        if kind == REC_USER:
+            table = self.users
+        elif kind == REC_COLOR:
+            table = self.colors
+        else:
+            table = self.emotes
+        ref, pos = _read_varint(payload, start)
+        if ref == len(table):
+            table.append(bytes(payload[pos:end]).decode("utf-8"))
+
+    def _load_index(self):
+        scan_from = HEADER_SIZE
+        index_path = self.path + INDEX_SUFFIX
+        try:
+            with open(index_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            data = b""
+        if len(data) >= HEADER_SIZE:
+            magic, start_ms = HEADER.unpack_from(data, 0)
+            if magic == INDEX_MAGIC and start_ms == self.start_ms:
+                for _, p, e in _iter_records(data, HEADER_SIZE, len(data)):
+                    kind = data[p]
+                    if kind == REC_POINT:
+                        offset_ms, q = _read_varint(data, p + 1)
+                        file_pos, _ = _read_varint(data, q)
+                        if file_pos >= self.size:
+                            break
+                        self.points.append((offset_ms, file_pos))
+                    else:
+                        self._intern(kind, data, p + 1, e)
+                if self.points:
+                    scan_from = self.points[-1][1]
+
+        # Pick up anything the index hasn't seen yet (crash, or no index at all).
+        last_ms = self.points[-1][0] if self.points else None
+        since = 0
+        self.end = scan_from
+        self.last_offset_ms = 0
+        for start, p, e in _iter_records(self._buf, scan_from, self.size):
+            kind = self._buf[p]
+            if kind == REC_MESSAGE:
+                offset_ms, _ = _read_varint(self._buf, p + 1)
+                if (
+                    last_ms is None
+                    or offset_ms - last_ms >= INDEX_EVERY_MS
+                    or since >= INDEX_EVERY_MESSAGES
+                ):
+                    self.points.append((offset_ms, start))
+                    last_ms = offset_ms
+                    since = 0
+                since += 1
+                self.last_offset_ms = offset_ms
+            else:
+                self._intern(kind, self._buf, p + 1, e)
+            self.end = e
+
+    def seek_position(self, offset_ms):
+        """File position of the last index point strictly before offset_ms."""
+        i = bisect_left(self._point_offsets, offset_ms) - 1
+        if i < 0:
+            return HEADER_SIZE
+        return self.points[i][1]
+
+    def _decode(self, buf, p, e):
+        offset_ms, p = _read_varint(buf, p)
+        user, p = _read_varint(buf, p)
+        flags, p = _read_varint(buf, p)
+        color = ""
+        bits = 0
+        emote_ids = []
+        if flags & FLAG_COLOR:
+            ref, p = _read_varint(buf, p)
+            color = self.colors[ref]
+        if flags & FLAG_BITS:
+            bits, p = _read_varint(buf, p)
+        if flags & FLAG_EMOTES:
+            n, p = _read_varint(buf, p)
+            for _ in range(n):
+                ref, p = _read_varint(buf, p)
+                emote_ids.append(self.emotes[ref])
+        return {
+            "offset_ms": offset_ms,
+            "user": self.users[user],
+            "text": bytes(buf[p:e]).decode("utf-8"),
+            "bits": bits,
+            "color": color,
+            "roles": [r for i, r in enumerate(ROLE_NAMES) if flags & (1 << i)],
+            "emote_ids": emote_ids,
+        }
+
+    def iter_messages(self, start_ms=0, end_ms=None):
+        """Messages with start_ms <= offset_ms < end_ms, in file order."""
+        buf = self._buf
+        for _, p, e in _iter_records(buf, self.seek_position(start_ms), self.end):
+            if buf[p] != REC_MESSAGE:
+                continue
+            offset_ms, _ = _read_varint(buf, p + 1)
+            if offset_ms < start_ms:
+                continue
+            if end_ms is not None and offset_ms >= end_ms:
+                break
+            yield self._decode(buf, p + 1, e)
+
+    def read_range(self, start_ms, end_ms):
+        return list(self.iter_messages(start_ms, end_ms))
+
+    def __iter__(self):
+        return self.iter_messages()
+
+    def close(self):
+        self._buf.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ChatBinaryWriter:
+    """
+    Appends messages to a .tcb file and its index. Re-opening an existing file
+    continues it (a torn trailing record from a crash is dropped). Offsets are
+    kept non-decreasing so the index stays sorted.
+    """
+
+    def __init__(self, path, start_time):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.users = {}
+        self.colors = {}
+        self.emotes = {}
+        self.last_point_ms = None
+        self.last_offset_ms = 0
+        self.since_point = 0
+
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE:
+            with ChatBinaryReader(path) as reader:
+                self.start_ms = reader.start_ms
+                end = reader.end
+                users, colors, emotes = reader.users, reader.colors, reader.emotes
+                points = reader.points
+                self.last_offset_ms = reader.last_offset_ms
+            self.f = open(path, "r+b")
+            self.f.truncate(end)
+            self.f.seek(end)
+            self.idx = open(self.index_path, "wb")
+            self.idx.write(HEADER.pack(INDEX_MAGIC, self.start_ms))
+            for kind, values, table in (
+                (REC_USER, users, self.users),
+                (REC_COLOR, colors, self.colors),
+                (REC_EMOTE, emotes, self.emotes),
+            ):
+                for value in values:
+                    self._add_intern(kind, table, value, main=False)
+            for offset_ms, pos in points:
+                self._write_point(offset_ms, pos)
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.start_ms = _to_ms(start_time)
+            self.f = open(path, "wb")
+            self.f.write(HEADER.pack(MAGIC, self.start_ms))
+            self.idx = open(self.index_path, "wb")
+            self.idx.write(HEADER.pack(INDEX_MAGIC, self.start_ms))
+
+    def _record(self, payload):
+        return _varint(len(payload)) + payload
+
+    def _add_intern(self, kind, table, value, main=True):
+        ref = len(table)
+        table[value] = ref
+        rec = self._record(bytes([kind]) + _varint(ref) + value.encode("utf-8"))
+        if main:
+            self.f.write(rec)
+        self.idx.write(rec)
+        return ref
+
+    def _ref(self, kind, table, value):
+        ref = table.get(value)
+        if ref is None:
+            ref = self._add_intern(kind, table, value)
+        return ref
+
+    def _write_point(self, offset_ms, pos):
+        payload = bytes([REC_POINT]) + _varint(offset_ms) + _varint(pos)
+        self.idx.write(self._record(payload))
+        self.last_point_ms = offset_ms
+        self.since_point = 0
+
+    def write_message(
+        self, offset_ms, user, text, bits=0, color="", roles=(), emote_ids=()
+    ):
+        offset_ms = max(int(offset_ms), self.last_offset_ms)
+        self.last_offset_ms = offset_ms
+        pos = self.f.tell()
+        if (
+            self.last_point_ms is None
+            or offset_ms - self.last_point_ms >= INDEX_EVERY_MS
+            or self.since_point >= INDEX_EVERY_MESSAGES
+        ):
+            self._write_point(offset_ms, pos)
+        self.since_point += 1
+
+        flags = 0
+        for i, role in enumerate(ROLE_NAMES):
+            if role in roles:
+                flags |= 1 << i
+        parts = [_varint(self._ref(REC_USER, self.users, user))]
+        extra = []
+        if color:
+            flags |= FLAG_COLOR
+            extra.append(_varint(self._ref(REC_COLOR, self.colors, color)))
+        if bits:
+            flags |= FLAG_BITS
+            extra.append(_varint(bits))
+        if emote_ids:
+            flags |= FLAG_EMOTES
+            extra.append(_varint(len(emote_ids)))
+            extra.extend(
+                _varint(self._ref(REC_EMOTE, self.emotes, e)) for e in emote_ids
+            )
+        payload = b"".join(
+            [bytes([REC_MESSAGE]), _varint(offset_ms), *parts, _varint(flags), *extra]
+        )
+        self.f.write(self._record(payload + text.encode("utf-8")))
+
+    def flush(self):
+        self.f.flush()
+        self.idx.flush()
+
+    def close(self):
+        if self.f.closed:
+            return
+        self.flush()
+        self.f.close()
+        self.idx.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _replace(path):
+    for p in (path, path + INDEX_SUFFIX):
+        if os.path.exists(p):
+            os.remove(p)
+
+
+def _estimate_start(log_path, sample=START_SAMPLE_LINES):
+    """
+    The text log only has whole-second relative times, so abs - rel overshoots
+    the real stream start by up to a second. The smallest abs - rel over the
+    first lines is the tightest estimate that keeps every rel value intact.
+    """
+    start = None
+    with open(log_path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if i >= sample:
+                break
+            entry = parse_chat_line(line)
+            if entry is None:
+                continue
+            candidate = parse_abs(entry["abs"]) - timedelta(
+                seconds=parse_rel(entry["rel"])
+            )
+            if start is None or candidate < start:
+                start = candidate
+    return start
+
+
+def text_log_to_binary(log_path, out_path, start_time=None):
+    """
+    Convert a ChatLogger text log; returns the number of messages written.
+    Pass the stream's start_time (metadata.json) when known for exact offsets.
+    """
+    _replace(out_path)
+    start = start_time or _estimate_start(log_path)
+    writer = None
+    count = 0
+    with open(log_path, "r", encoding="utf-8") as f:
+        for line in f:
+            entry = parse_chat_line(line)
+            if entry is None:
+                continue
+            abs_time = parse_abs(entry["abs"])
+            if writer is None:
+                writer = ChatBinaryWriter(out_path, start)
+            writer.write_message(
+                (abs_time - start).total_seconds() * 1000,
+                entry["user"],
+                entry["text"],
+                bits=entry["bits"],
+                color=entry["color"],
+                roles=entry["roles"],
+                emote_ids=[emote_id_from_url(u) for u in entry["stickers"]],
+            )
+            count += 1
+    if writer:
+        writer.close()
+    logger.info(f"Converted {count} chat lines {log_path} -> {out_path}")
+    return count
+
+
+def binary_to_text_log(bin_path, out_path):
+    count = 0
+    with ChatBinaryReader(bin_path) as reader, open(
+        out_path, "w", encoding="utf-8"
+    ) as out:
+        start = reader.start_time
+        for msg in reader:
+            abs_time = start + timedelta(milliseconds=msg["offset_ms"])
+            out.write(
+                format_chat_line(
+                    abs_time.isoformat(),
+                    format_rel(msg["offset_ms"] / 1000),
+                    msg["user"],
+                    msg["text"],
+                    bits=msg["bits"],
+                    color=msg["color"],
+                    roles=msg["roles"],
+                    stickers=[EMOTE_URL_TEMPLATE.format(e) for e in msg["emote_ids"]],
+                )
+            )
+            count += 1
+    return count
+
+
+def sqlite_to_binary(sqlite_path, out_path, start_time=None):
+    """
+    Convert a chat_messages table (imported VOD schema or live schema). Rows are
+    written in offset order; without an offset column the absolute timestamp is
+    used relative to the first message.
+    """
+    _replace(out_path)
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(chat_messages)")}
+        color_col = "color" if "color" in columns else "user_color"
+        offset_col = (
+            "message_sent_offset" if "message_sent_offset" in columns else "NULL"
+        )
+        rows = conn.execute(
+            f"SELECT {offset_col}, message_sent_absolute, user_name, message_body, "
+            f"bits, {color_col} FROM chat_messages "
+            f"ORDER BY {offset_col if offset_col != 'NULL' else 'rowid'}"
+        )
+        writer = None
+        count = 0
+        first_abs = None
+        for offset, abs_str, user, body, bits, color in rows:
+            try:
+                abs_time = parse_abs(abs_str) if abs_str else None
+            except ValueError:
+                abs_time = None
+            if offset is None:
+                if abs_time is None:
+                    offset = 0.0
+                else:
+                    first_abs = first_abs or abs_time
+                    offset = (abs_time - first_abs).total_seconds()
+            if writer is None:
+                if start_time is None:
+                    start_time = (
+                        abs_time - timedelta(seconds=offset)
+                        if abs_time
+                        else datetime.fromtimestamp(0, timezone.utc)
+                    )
+                writer = ChatBinaryWriter(out_path, start_time)
+            writer.write_message(
+                offset * 1000, user or "", body or "", bits=bits or 0, color=color or ""
+            )
+            count += 1
+        if writer:
+            writer.close()
+    finally:
+        conn.close()
+    return count
+
+
+def binary_to_sqlite(bin_path, sqlite_path):
+    """Load a .tcb file into the imported (VOD) chat_messages schema."""
+    from .file_utils import init_vod_chat_sqlite
+
+    init_vod_chat_sqlite(sqlite_path)
+    conn = sqlite3.connect(sqlite_path)
+    # Replaced rows must leave the chat aggregates through their delete trigger.
+    conn.execute("PRAGMA recursive_triggers = ON")
+    count = 0
+    try:
+        with ChatBinaryReader(bin_path) as reader:
+            start = reader.start_time
+            rows = []
+            for msg in reader:
+                abs_time = start + timedelta(milliseconds=msg["offset_ms"])
+                rows.append(
+                    (
+                        f"tcb_{count}",
+                        abs_time.isoformat(),
+                        msg["offset_ms"] / 1000,
+                        msg["user"],
+                        "",
+                        "",
+                        msg["text"],
+                        msg["bits"],
+                        msg["color"],
+                    )
+                )
+                count += 1
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO chat_messages (
+                    message_id, message_sent_absolute, message_sent_offset,
+                    user_name, user_id, user_logo, message_body, bits, color
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+                rows,
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Binary chat log tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("from-log", "to-log", "from-sqlite", "to-sqlite"):
+        p = sub.add_parser(name)
+        p.add_argument("src")
+        p.add_argument("dst")
+    p = sub.add_parser("range", help="Print messages between two offsets (seconds)")
+    p.add_argument("src")
+    p.add_argument("start", type=float)
+    p.add_argument("end", type=float)
+    args = parser.parse_args(argv)
+
+    if args.command == "from-log":
+        text_log_to_binary(args.src, args.dst)
+    elif args.command == "to-log":
+        binary_to_text_log(args.src, args.dst)
+    elif args.command == "from-sqlite":
+        sqlite_to_binary(args.src, args.dst)
+    elif args.command == "to-sqlite":
+        binary_to_sqlite(args.src, args.dst)
+    else:
+        with ChatBinaryReader(args.src) as reader:
+            for msg in reader.iter_messages(args.start * 1000, args.end * 1000):
+                print(
+                    f"[{format_rel(msg['offset_ms'] / 1000)}] <{msg['user']}> {msg['text']}"
+                )
+
+
+if __name__ == "__main__":
+    main()
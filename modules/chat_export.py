@@ -0,0 +1,316 @@
+"""
+Columnar (Parquet) export of chat for analytics across streams.
+
+Every stream folder's chat SQLite (live or imported VOD schema) becomes one
+Parquet file, partitioned hive-style by channel and month:
+
+    metadata/chat_parquet/channel=<name>/month=YYYY-MM/<stream folder>.parquet
+
+Rows are sorted by offset; user_name, color and stream are dictionary-encoded
+(a chat has far fewer distinct users than messages). Exports are incremental:
+_manifest.json remembers the size/mtime of each exported SQLite, so only new
+or changed streams are rewritten. Streams are exported in parallel by a
+process pool.
+
+Requires pyarrow (optional: pip install pyarrow).
+"""
+
+import os
+import glob
+import json
+import time
+import sqlite3
+import logging
+import argparse
+from collections import Counter
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+from .db_utils import BASE_DIR
+from .catalog import PERSONS_DIR, iter_stream_folders
+from .chat_stats import MINUTE_EXPR
+from .file_utils import atomic_write_json, read_json
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = os.path.join(BASE_DIR, "metadata", "chat_parquet")
+MANIFEST_FILENAME = "_manifest.json"
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise SystemExit("pyarrow is required for the chat export: pip install pyarrow")
+
+
+def chat_sqlite_for(folder):
+    """The folder's chat SQLite (largest if there are several), or None."""
+    candidates = []
+    for path in glob.glob(os.path.join(glob.escape(folder), "chat*.sqlite")):
+        try:
+            with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as conn:
+                if conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type='table' AND name='chat_messages'"
+                ).fetchone():
+                    candidates.append((os.path.getsize(path), path))
+        except sqlite3.Error:
+            continue
+    return max(candidates)[1] if candidates else None
+
+
+def _month(folder, sqlite_path):
+    meta = read_json(os.path.join(folder, "metadata.json"))
+    stamp = meta.get("start_time") or meta.get("created_at")
+    if stamp:
+        return stamp[:7]
+    return datetime.fromtimestamp(os.path.getmtime(sqlite_path), timezone.utc).strftime(
+        "%Y-%m"
+    )
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def export_stream(task):
+    """Process-pool worker: write one stream's chat as Parquet. Returns (key, rows)."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    key, sqlite_path, out_path, stream_name = task
+    conn = sqlite3.connect(f"file:{sqlite_path}?mode=ro", uri=True)
+    try:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(chat_messages)")}
+        color_col = "color" if "color" in columns else "user_color"
+        rows = conn.execute(
+            f"SELECT message_sent_absolute, message_sent_offset, user_name, {color_col}, "
+            "message_body, bits FROM chat_messages ORDER BY message_sent_offset"
+        ).fetchall()
+    finally:
+        conn.close()
+
+    sent, offsets, users, colors, bodies, bits = (
+        (list(col) for col in zip(*rows)) if rows else ([], [], [], [], [], [])
+    )
+    table = pa.table(
+        {
+            "stream": pa.array(
+                [stream_name] * len(rows), pa.string()
+            ).dictionary_encode(),
+            "sent_at": pa.array(
+                [_parse_time(v) for v in sent], pa.timestamp("ms", tz="UTC")
+            ),
+            "offset_seconds": pa.array(offsets, pa.float64()),
+            "user_name": pa.array(users, pa.string()).dictionary_encode(),
+            "color": pa.array(colors, pa.string()).dictionary_encode(),
+            "message": pa.array(bodies, pa.string()),
+            "bits": pa.array([b or 0 for b in bits], pa.int32()),
+        }
+    )
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp_path = out_path + ".tmp"
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, out_path)
+    return key, len(rows)
+
+
+def _pending(export_dir, persons_dir, manifest, force):
+    tasks = []
+    seen = set()
+    for channel_name, folder in iter_stream_folders(persons_dir):
+        sqlite_path = chat_sqlite_for(folder)
+        if not sqlite_path:
+            continue
+        key = os.path.relpath(folder, persons_dir).replace(os.sep, "/")
+        seen.add(key)
+        st = os.stat(sqlite_path)
+        entry = manifest.get(key)
+        if (
+            not force
+            and entry
+            and entry["size"] == st.st_size
+            and entry["mtime_ns"] == st.st_mtime_ns
+            and os.path.exists(os.path.join(export_dir, entry["output"]))
+        ):
+            continue
+        stream_name = os.path.basename(folder)
+        output = (
+            f"channel={channel_name}/month={_month(folder, sqlite_path)}/"
+            f"{stream_name}.parquet"
+        )
+        if entry and entry["output"] != output:
+            _remove(export_dir, entry["output"])
+        manifest[key] = {
+            "source": os.path.relpath(sqlite_path, persons_dir).replace(os.sep, "/"),
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "output": output,
+        }
+        tasks.append((key, sqlite_path, os.path.join(export_dir, output), stream_name))
+    for key in set(manifest) - seen:
+        _remove(export_dir, manifest.pop(key)["output"])
+    return tasks
+
+
+def _remove(export_dir, output):
+    try:
+        os.remove(os.path.join(export_dir, output))
+    except FileNotFoundError:
+        pass
+
+
+def export_all(
+    export_dir=EXPORT_DIR, persons_dir=PERSONS_DIR, workers=None, force=False
+):
+    """Export new/changed streams. Returns (exported streams, rows written)."""
+    _require_pyarrow()
+    manifest_path = os.path.join(export_dir, MANIFEST_FILENAME)
+    manifest = read_json(manifest_path)
+    previous = {k: dict(v) for k, v in manifest.items()}
+    tasks = _pending(export_dir, persons_dir, manifest, force)
+    if not tasks:
+        atomic_write_json(manifest_path, manifest)
+        logger.info("Chat export is up to date.")
+        return 0, 0
+
+    t0 = time.monotonic()
+    total_rows = 0
+    exported = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(export_stream, task): task[0] for task in tasks}
+        for future in futures:
+            key = futures[future]
+            try:
+                _, rows = future.result()
+            except Exception as e:
+                logger.error(f"Chat export failed for {key}: {e}")
+                # retry next run
+                if key in previous:
+                    manifest[key] = previous[key]
+                    manifest[key]["size"] = -1
+                else:
+                    manifest.pop(key, None)
+                continue
+            manifest[key]["rows"] = rows
+            total_rows += rows
+            exported += 1
+    atomic_write_json(manifest_path, manifest)
+    elapsed = time.monotonic() - t0
+    logger.info(
+        f"Exported {exported} streams ({total_rows} messages) in {elapsed:.1f}s "
+        f"to {export_dir}"
+    )
+    return exported, total_rows
+
+
+def _sqlite_aggregate(export_dir, persons_dir):
+    """Baseline: the same aggregation over every per-stream SQLite file."""
+    manifest = read_json(os.path.join(export_dir, MANIFEST_FILENAME))
+    per_minute = Counter()
+    chatters = Counter()
+    bits = Counter()
+    for key, entry in manifest.items():
+        channel = key.split("/", 1)[0]
+        conn = sqlite3.connect(
+            f"file:{os.path.join(persons_dir, entry['source'])}?mode=ro", uri=True
+        )
+        try:
+            for minute, count in conn.execute(
+                f"SELECT {MINUTE_EXPR.format('m')}, COUNT(*) "
+                "FROM chat_messages m GROUP BY 1"
+            ):
+                per_minute[(channel, minute)] += count
+            for user, count, bit_sum in conn.execute(
+                "SELECT user_name, COUNT(*), SUM(bits) FROM chat_messages GROUP BY 1"
+            ):
+                chatters[user] += count
+                bits[user] += bit_sum or 0
+        finally:
+            conn.close()
+    return per_minute, chatters, bits
+
+
+def _arrow_aggregate(export_dir, persons_dir):
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(
+        export_dir, format="parquet", partitioning="hive", exclude_invalid_files=True
+    )
+    table = dataset.to_table(
+        columns=["channel", "offset_seconds", "user_name", "bits"]
+    ).unify_dictionaries()
+    # chat_stats.MINUTE_EXPR: negative offsets count as minute 0, none as -1.
+    offsets = pc.max_element_wise(table["offset_seconds"], 0.0, skip_nulls=False)
+    table = table.append_column(
+        "minute",
+        pc.fill_null(pc.cast(pc.floor(pc.divide(offsets, 60)), "int64"), -1),
+    )
+    minutes = table.group_by(["channel", "minute"]).aggregate([("minute", "count")])
+    users = table.group_by("user_name").aggregate(
+        [("user_name", "count"), ("bits", "sum")]
+    )
+    per_minute = Counter(
+        {
+            (c, m): n
+            for c, m, n in zip(
+                minutes["channel"].to_pylist(),
+                minutes["minute"].to_pylist(),
+                minutes["minute_count"].to_pylist(),
+            )
+        }
+    )
+    names = users["user_name"].to_pylist()
+    chatters = Counter(dict(zip(names, users["user_name_count"].to_pylist())))
+    bits = Counter(dict(zip(names, users["bits_sum"].to_pylist())))
+    return per_minute, chatters, bits
+
+
+def benchmark(export_dir=EXPORT_DIR, persons_dir=PERSONS_DIR, repeat=3):
+    """
+    Messages per minute per channel, plus message and bit totals per chatter,
+    over all streams: SQLite files vs. the Parquet dataset. Returns seconds
+    (best of repeat) and whether both produced the same answer.
+    """
+    _require_pyarrow()
+    results = {}
+    answers = {}
+    for name, fn in (("sqlite", _sqlite_aggregate), ("parquet", _arrow_aggregate)):
+        best = None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            answers[name] = fn(export_dir, persons_dir)
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = round(best, 4)
+    results["same_result"] = answers["sqlite"] == answers["parquet"]
+    results["top_chatters"] = answers["parquet"][1].most_common(5)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parquet export of chat")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("export", help="Export new/changed streams")
+    p.add_argument("--workers", type=int)
+    p.add_argument("--force", action="store_true", help="Re-export everything")
+    p = sub.add_parser("bench", help="Aggregation: SQLite files vs. Parquet")
+    p.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command == "export":
+        export_all(workers=args.workers, force=args.force)
+    else:
+        print(json.dumps(benchmark(repeat=args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    main()
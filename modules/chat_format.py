@@ -0,0 +1,93 @@
+import re
+from datetime import datetime
+
+EMOTE_URL_TEMPLATE = "https://static-cdn.jtvnw.net/emoticons/v1/{}/3.0"
+ROLE_NAMES = ("MOD", "VIP", "SUB", "BROADCASTER")
+
+# [abs iso] [hh:mm:ss] <name> (bits=.., color=.., roles=.., stickers=[..]) text
+CHAT_LINE_RE = re.compile(
+    r"^\[(?P<abs>[^\]]+)\] \[(?P<rel>[^\]]+)\] <(?P<user>[^>]*)>"
+    r"(?: \((?P<extras>(?:bits|color|roles|stickers)=.*?)\))? (?P<text>.*)$"
+)
+BITS_RE = re.compile(r"bits=(\d+)")
+COLOR_RE = re.compile(r"color=(#[0-9A-Za-z]*)")
+ROLES_RE = re.compile(r"roles=([A-Z ]+?)(?:, |$)")
+STICKER_RE = re.compile(r"'([^']*)'")
+EMOTE_ID_RE = re.compile(r"/emoticons/v\d/([^/]+)/")
+
+
+def format_rel(seconds):
+    h, rem = divmod(int(seconds), 3600)
+    m, s = divmod(rem, 60)
+    return f"{h:02d}:{m:02d}:{s:02d}"
+
+
+def parse_rel(rel_str):
+    h, m, s = rel_str.split(":")
+    return int(h) * 3600 + int(m) * 60 + float(s)
+
+
+def format_chat_line(
+    abs_str, rel_str, author_name, content, bits=0, color="", roles=(), stickers=()
+):
+    """Build one ChatLogger text log line (including the trailing newline)."""
+    extras = []
+    if bits > 0:
+        extras.append(f"bits={bits}")
+    if color:
+        extras.append(f"color={color}")
+    if roles:
+        extras.append(f"roles={' '.join(roles)}")
+    if stickers:
+        extras.append(f"stickers={list(stickers)}")
+    extras_str = ""
+    if extras:
+        extras_str = f" ({', '.join(extras)})"
+    return f"[{abs_str}] [{rel_str}] <{author_name}>{extras_str} {content}\n"
+
+
+def parse_chat_line(line):
+    """
+    Parse a line written by format_chat_line back into its fields.
+    Returns None for lines that don't match the format.
+    """
+    match = CHAT_LINE_RE.match(line.rstrip("\r\n"))
+    if not match:
+        return None
+    bits = 0
+    color = ""
+    roles = []
+    stickers = []
+    extras = match.group("extras")
+    if extras:
+        m = BITS_RE.search(extras)
+        if m:
+            bits = int(m.group(1))
+        m = COLOR_RE.search(extras)
+        if m:
+            color = m.group(1)
+        m = ROLES_RE.search(extras)
+        if m:
+            roles = m.group(1).split()
+        idx = extras.find("stickers=[")
+        if idx != -1:
+            stickers = STICKER_RE.findall(extras[idx:])
+    return {
+        "abs": match.group("abs"),
+        "rel": match.group("rel"),
+        "user": match.group("user"),
+        "bits": bits,
+        "color": color,
+        "roles": roles,
+        "stickers": stickers,
+        "text": match.group("text"),
+    }
+
+
+def emote_id_from_url(url):
+    match = EMOTE_ID_RE.search(url)
+    return match.group(1) if match else url
+
+
+def parse_abs(abs_str):
+    return datetime.fromisoformat(abs_str)
@@ -0,0 +1,236 @@
+"""
+Bulk import of ChatLogger text logs (chat.*.log) into the live chat SQLite.
+
+    [2024-05-01T20:00:05.123456+00:00] [00:00:05] <name> (bits=100, color=#F0A,
+        roles=MOD SUB, stickers=['https://.../emoticons/v1/25/3.0']) text
+
+The log is split into chunks on line boundaries and the chunks are parsed in a
+process pool with the precompiled chat_format patterns. The parsed rows come
+back in file order and are loaded with executemany in one transaction.
+Indexes and the chat aggregate triggers are dropped for the load and rebuilt
+once at the end, which is much cheaper than maintaining them row by row. The
+extras become the bits, user_color, roles and emote_ids columns. Offsets are
+taken from the absolute timestamps relative to metadata.json's start_time, or
+from the estimate chat_binary uses when there is none.
+
+    python -m modules.chat_import persons/<channel>/.../chat.live.log [--workers 8]
+    python -m modules.chat_import --all        # every log without chat in SQLite
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from .chat_format import (
+    CHAT_LINE_RE,
+    BITS_RE,
+    COLOR_RE,
+    ROLES_RE,
+    STICKER_RE,
+    emote_id_from_url,
+)
+from .chat_binary import _estimate_start
+from .chat_stats import AGGREGATE_TRIGGERS, init_chat_aggregates
+from .file_utils import init_live_chat_sqlite, read_json
+from .catalog import PERSONS_DIR, iter_stream_folders
+
+logger = logging.getLogger(__name__)
+
+CHUNK_BYTES = 8 * 1024 * 1024
+LIVE_INDEXES = ("idx_user_name", "idx_message_body", "idx_message_sent_offset")
+INSERT_SQL = (
+    "INSERT INTO chat_messages (message_sent_absolute, message_sent_offset, "
+    "user_name, message_body, bits, user_color, roles, emote_ids) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def chunk_bounds(path, chunk_bytes=CHUNK_BYTES):
+    """[(start, end)] byte ranges of path that begin and end on line boundaries."""
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        while bounds[-1] + chunk_bytes < size:
+            f.seek(bounds[-1] + chunk_bytes)
+            f.readline()
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _extras(extras):
+    bits = 0
+    color = ""
+    roles = ""
+    emote_ids = ""
+    m = BITS_RE.search(extras)
+    if m:
+        bits = int(m.group(1))
+    m = COLOR_RE.search(extras)
+    if m:
+        color = m.group(1)
+    m = ROLES_RE.search(extras)
+    if m:
+        roles = m.group(1)
+    idx = extras.find("stickers=[")
+    if idx != -1:
+        emote_ids = " ".join(
+            emote_id_from_url(url) for url in STICKER_RE.findall(extras, idx)
+        )
+    return bits, color, roles, emote_ids
+
+
+def parse_chunk(task):
+    """Process-pool worker: (rows, unparsed line count) for one byte range."""
+    path, start, end, start_ts = task
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    match = CHAT_LINE_RE.match
+    fromisoformat = datetime.fromisoformat
+    rows = []
+    append = rows.append
+    skipped = 0
+    for line in data.decode("utf-8", errors="replace").splitlines():
+        m = match(line)
+        if m is None:
+            if line.strip():
+                skipped += 1
+            continue
+        abs_str, _rel, user, extras, text = m.groups()
+        bits, color, roles, emote_ids = _extras(extras) if extras else (0, "", "", "")
+        try:
+            offset = round(fromisoformat(abs_str).timestamp() - start_ts, 3)
+        except ValueError:
+            offset = None
+        append((abs_str, offset, user, text, bits, color, roles, emote_ids))
+    return rows, skipped
+
+
+def stream_start(log_path):
+    """Stream start as a datetime: metadata.json's start_time, else estimated."""
+    meta = read_json(os.path.join(os.path.dirname(log_path), "metadata.json"))
+    if meta.get("start_time"):
+        return datetime.fromisoformat(meta["start_time"])
+    return _estimate_start(log_path)
+
+
+def message_count(sqlite_path):
+    if not os.path.exists(sqlite_path):
+        return 0
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM chat_messages").fetchone()[0]
+    except sqlite3.Error:
+        return 0
+    finally:
+        conn.close()
+
+
+def import_text_log(
+    log_path, sqlite_path=None, workers=None, replace=False, chunk_bytes=CHUNK_BYTES
+):
+    """
+    Load a text log into sqlite_path (default: chat.live.sqlite next to it).
+    A database that already has messages is left alone unless replace=True.
+    Returns the import stats.
+    """
+    sqlite_path = sqlite_path or os.path.join(
+        os.path.dirname(log_path), "chat.live.sqlite"
+    )
+    t0 = time.monotonic()
+    stats = {"lines": 0, "skipped": 0, "log": log_path, "sqlite": sqlite_path}
+    init_live_chat_sqlite(sqlite_path)
+    existing = message_count(sqlite_path)
+    if existing and not replace:
+        logger.info(f"{sqlite_path} already has {existing} messages; not importing")
+        stats["seconds"] = time.monotonic() - t0
+        return stats
+
+    start = stream_start(log_path)
+    start_ts = start.timestamp() if start else 0.0
+    tasks = [(log_path, a, b, start_ts) for a, b in chunk_bounds(log_path, chunk_bytes)]
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        # The log stays the source of truth: a crash here just means re-importing.
+        conn.execute("PRAGMA synchronous = OFF")
+        for name in AGGREGATE_TRIGGERS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        for name in LIVE_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        conn.execute("DELETE FROM chat_messages")
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for rows, skipped in pool.map(parse_chunk, tasks):
+                    conn.executemany(INSERT_SQL, rows)
+                    stats["lines"] += len(rows)
+                    stats["skipped"] += skipped
+        else:
+            for task in tasks:
+                rows, skipped = parse_chunk(task)
+                conn.executemany(INSERT_SQL, rows)
+                stats["lines"] += len(rows)
+                stats["skipped"] += skipped
+        conn.commit()
+        stats["load_seconds"] = time.monotonic() - t0
+        init_chat_aggregates(conn, rebuild=True)
+    finally:
+        conn.close()
+    # Recreates the indexes dropped above.
+    init_live_chat_sqlite(sqlite_path)
+
+    stats["seconds"] = time.monotonic() - t0
+    stats["lines_per_minute"] = stats["lines"] / max(stats["seconds"], 1e-9) * 60
+    logger.info(
+        f"Imported {stats['lines']} chat lines {log_path} -> {sqlite_path} in "
+        f"{stats['seconds']:.1f}s ({stats['lines_per_minute'] / 1e6:.1f}M lines/min, "
+        f"{workers} workers); {stats['skipped']} lines unparsed"
+    )
+    return stats
+
+
+def pending_logs(persons_dir=PERSONS_DIR):
+    """chat.*.log files whose SQLite (chat.<kind>.sqlite) has no messages yet."""
+    for _channel, folder in iter_stream_folders(persons_dir):
+        for name in sorted(os.listdir(folder)):
+            if name.startswith("chat.") and name.endswith(".log"):
+                log_path = os.path.join(folder, name)
+                sqlite_path = log_path[: -len(".log")] + ".sqlite"
+                if os.path.getsize(log_path) and not message_count(sqlite_path):
+                    yield log_path, sqlite_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import ChatLogger text logs")
+    parser.add_argument("logs", nargs="*")
+    parser.add_argument("--out", help="SQLite file (single log only)")
+    parser.add_argument("--all", action="store_true", help="Every log not imported yet")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument(
+        "--replace", action="store_true", help="Replace messages already there"
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.all:
+        jobs = list(pending_logs())
+    else:
+        jobs = [(path, args.out if len(args.logs) == 1 else None) for path in args.logs]
+    if not args.all and not jobs:
+        parser.error("give log files or --all")
+    if not jobs:
+        logger.info("Nothing to import")
+    for log_path, sqlite_path in jobs:
+        import_text_log(log_path, sqlite_path, args.workers, args.replace)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Pre-built chat replay bundles for the archive website.
+
+A bundle (chat.replay.bin) cuts a stream's chat into fixed-width time buckets.
+Each bucket is stored as pre-serialised JSON objects joined by commas, and a
+table of bucket start positions sits at the front of the file. Serving
+"messages between t and t+30s" is then one slice of the file wrapped in [ ],
+with no SQL and no JSON encoding per request:
+
+    header  magic "TCR1", u32 bucket_ms, u32 bucket_count
+    table   (bucket_count + 1) * u64 absolute file positions
+    blobs   bucket payloads, back to back
+
+Message objects are {"t": offset seconds, "u": user, "c": colour, "m": text,
+"b": bits}; "b" is omitted when zero.
+"""
+
+import os
+import json
+import mmap
+import time
+import random
+import struct
+import sqlite3
+import logging
+import argparse
+import statistics
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TCR1"
+HEADER = struct.Struct("<4sII")
+BUCKET_SECONDS = 10
+BUNDLE_FILENAME = "chat.replay.bin"
+
+
+def _chat_rows(conn):
+    """(offset, user, color, text, bits) in offset order, for either chat schema."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(chat_messages)")}
+    color_col = "color" if "color" in columns else "user_color"
+    return conn.execute(
+        f"SELECT message_sent_offset, user_name, {color_col}, message_body, bits "
+        "FROM chat_messages WHERE message_sent_offset IS NOT NULL "
+        "ORDER BY message_sent_offset"
+    )
+
+
+def _encode(offset, user, color, text, bits):
+    msg = {"t": round(offset, 3), "u": user, "c": color or "", "m": text or ""}
+    if bits:
+        msg["b"] = bits
+    return json.dumps(msg, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def build_replay_bundle(sqlite_path, out_path=None, bucket_seconds=BUCKET_SECONDS):
+    """Write the replay bundle for a chat SQLite file; returns its path."""
+    if out_path is None:
+        out_path = os.path.join(os.path.dirname(sqlite_path), BUNDLE_FILENAME)
+    bucket_ms = int(bucket_seconds * 1000)
+
+    buckets = []
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        for offset, user, color, text, bits in _chat_rows(conn):
+            i = max(0, int(offset * 1000) // bucket_ms)
+            while len(buckets) <= i:
+                buckets.append([])
+            buckets[i].append(_encode(offset, user, color, text, bits))
+    finally:
+        conn.close()
+
+    blobs = [b",".join(b) for b in buckets]
+    table_size = (len(blobs) + 1) * 8
+    pos = HEADER.size + table_size
+    positions = []
+    for blob in blobs:
+        positions.append(pos)
+        pos += len(blob)
+    positions.append(pos)
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, bucket_ms, len(blobs)))
+        f.write(struct.pack(f"<{len(positions)}Q", *positions))
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, out_path)
+    logger.info(
+        f"Built chat replay bundle {out_path}: {len(blobs)} buckets of {bucket_seconds}s"
+    )
+    return out_path
+
+
+class ReplayBundle:
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.bucket_ms, self.bucket_count = HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a chat replay bundle")
+        self._positions = struct.unpack_from(
+            f"<{self.bucket_count + 1}Q", self._buf, HEADER.size
+        )
+
+    def window(self, start_seconds, duration_seconds=30):
+        """
+        JSON array (bytes) of the messages in the buckets covering
+        [start, start + duration). Edges are bucket-aligned.
+        """
+        first = max(0, int(start_seconds * 1000) // self.bucket_ms)
+        last = min(
+            self.bucket_count,
+            -(-int((start_seconds + duration_seconds) * 1000) // self.bucket_ms),
+        )
+        if first >= last:
+            return b"[]"
+        positions = self._positions
+        parts = [
+            self._buf[positions[i] : positions[i + 1]]
+            for i in range(first, last)
+            if positions[i + 1] > positions[i]
+        ]
+        return b"[" + b",".join(parts) + b"]"
+
+    def close(self):
+        self._buf.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _sql_window(conn, start_seconds, duration_seconds):
+    rows = conn.execute(
+        "SELECT message_sent_offset, user_name, user_color, message_body, bits "
+        "FROM chat_messages WHERE message_sent_offset >= ? AND message_sent_offset < ? "
+        "ORDER BY message_sent_offset",
+        (start_seconds, start_seconds + duration_seconds),
+    ).fetchall()
+    return b"[" + b",".join(_encode(*row) for row in rows) + b"]"
+
+
+def benchmark(sqlite_path, bundle_path=None, iterations=5000, window=30):
+    """
+    Compare window-fetch latency of the bundle against an indexed SQL query
+    plus JSON encoding. Returns {"bundle": {...}, "sqlite": {...}} in microseconds.
+    """
+    bundle_path = bundle_path or build_replay_bundle(sqlite_path)
+    conn = sqlite3.connect(sqlite_path)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(chat_messages)")}
+    if "user_color" not in columns:
+        conn.close()
+        raise ValueError("benchmark expects the live chat schema")
+    (max_offset,) = conn.execute(
+        "SELECT MAX(message_sent_offset) FROM chat_messages"
+    ).fetchone()
+    rng = random.Random(0)
+    starts = [rng.uniform(0, max_offset or 0) for _ in range(iterations)]
+
+    results = {}
+    with ReplayBundle(bundle_path) as bundle:
+        for name, fetch in (
+            ("bundle", lambda t: bundle.window(t, window)),
+            ("sqlite", lambda t: _sql_window(conn, t, window)),
+        ):
+            timings = []
+            for t in starts:
+                t0 = time.perf_counter()
+                fetch(t)
+                timings.append((time.perf_counter() - t0) * 1e6)
+            timings.sort()
+            results[name] = {
+                "p50_us": round(statistics.median(timings), 1),
+                "p99_us": round(timings[int(len(timings) * 0.99) - 1], 1),
+                "mean_us": round(statistics.fmean(timings), 1),
+            }
+    conn.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chat replay bundles")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("build")
+    p.add_argument("sqlite")
+    p.add_argument("--bucket-seconds", type=float, default=BUCKET_SECONDS)
+    p = sub.add_parser("window")
+    p.add_argument("bundle")
+    p.add_argument("start", type=float)
+    p.add_argument("--duration", type=float, default=30)
+    p = sub.add_parser("bench", help="Window-fetch latency vs. SQLite")
+    p.add_argument("sqlite")
+    p.add_argument("--iterations", type=int, default=5000)
+    p.add_argument("--window", type=float, default=30)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        build_replay_bundle(args.sqlite, bucket_seconds=args.bucket_seconds)
+    elif args.command == "window":
+        with ReplayBundle(args.bundle) as bundle:
+            print(bundle.window(args.start, args.duration).decode("utf-8"))
+    else:
+        for name, stats in benchmark(
+            args.sqlite, iterations=args.iterations, window=args.window
+        ).items():
+            print(f"{name:>7}: " + ", ".join(f"{k}={v}" for k, v in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
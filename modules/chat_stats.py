@@ -0,0 +1,253 @@
+"""
+Per-stream chat aggregates kept next to chat_messages in the chat SQLite.
+
+    chat_minutes  (minute, messages, bits)        one row per minute of offset
+    chat_users    (user_name, messages, bits)     one row per chatter
+    chat_totals   (messages, bits, unique_chatters, first_offset, last_offset)
+
+Triggers on chat_messages keep them current, so every ingest path (ChatLogger,
+the JSON/binary importers) updates them in the same transaction as the
+message itself, and stats queries read O(minutes + chatters) rows instead of
+scanning every message. Messages without an offset are counted in minute -1.
+
+INSERT OR REPLACE only fires the delete trigger with PRAGMA recursive_triggers
+on, which the importers that replace rows set on their connection.
+
+Databases created before the aggregates existed are filled the first time
+they are opened by init_live_chat_sqlite / init_vod_chat_sqlite, or all at
+once with:
+
+    python -m modules.chat_stats backfill
+"""
+
+import os
+import json
+import sqlite3
+import logging
+import argparse
+
+logger = logging.getLogger(__name__)
+
+MINUTE_EXPR = "IFNULL(CAST(MAX({0}.message_sent_offset, 0) / 60 AS INTEGER), -1)"
+
+SCHEMA = """
+CREATE TABLE chat_minutes (
+    minute INTEGER PRIMARY KEY,
+    messages INTEGER NOT NULL,
+    bits INTEGER NOT NULL
+);
+CREATE TABLE chat_users (
+    user_name TEXT PRIMARY KEY,
+    messages INTEGER NOT NULL,
+    bits INTEGER NOT NULL
+);
+CREATE TABLE chat_totals (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    messages INTEGER NOT NULL,
+    bits INTEGER NOT NULL,
+    unique_chatters INTEGER NOT NULL,
+    first_offset REAL,
+    last_offset REAL
+);
+CREATE INDEX idx_chat_users_messages ON chat_users (messages);
+"""
+
+BACKFILL = f"""
+INSERT INTO chat_minutes (minute, messages, bits)
+    SELECT {MINUTE_EXPR.format("m")}, COUNT(*), IFNULL(SUM(bits), 0)
+    FROM chat_messages m GROUP BY 1;
+INSERT INTO chat_users (user_name, messages, bits)
+    SELECT user_name, COUNT(*), IFNULL(SUM(bits), 0)
+    FROM chat_messages GROUP BY user_name;
+INSERT INTO chat_totals
+    SELECT 1, COUNT(*), IFNULL(SUM(bits), 0), COUNT(DISTINCT user_name),
+           MIN(message_sent_offset), MAX(message_sent_offset)
+    FROM chat_messages;
+"""
+
+# unique_chatters must be updated before the chat_users upsert/delete, so
+# everything for one row lives in a single trigger body. Like COUNT(DISTINCT)
+# in BACKFILL, a NULL user_name is not a chatter. Deletes do not narrow
+# first_offset/last_offset.
+TRIGGERS = f"""
+CREATE TRIGGER chat_aggregates_insert AFTER INSERT ON chat_messages BEGIN
+    UPDATE chat_totals SET
+        messages = messages + 1,
+        bits = bits + IFNULL(NEW.bits, 0),
+        unique_chatters = unique_chatters + (
+            NEW.user_name IS NOT NULL AND NOT EXISTS (
+                SELECT 1 FROM chat_users WHERE user_name = NEW.user_name
+            )
+        ),
+        first_offset = MIN(IFNULL(first_offset, NEW.message_sent_offset),
+                           IFNULL(NEW.message_sent_offset, first_offset)),
+        last_offset = MAX(IFNULL(last_offset, NEW.message_sent_offset),
+                          IFNULL(NEW.message_sent_offset, last_offset))
+    WHERE id = 1;
+    INSERT INTO chat_users (user_name, messages, bits)
+        VALUES (NEW.user_name, 1, IFNULL(NEW.bits, 0))
+        ON CONFLICT (user_name) DO UPDATE SET
+            messages = messages + 1, bits = bits + excluded.bits;
+    INSERT INTO chat_minutes (minute, messages, bits)
+        VALUES ({MINUTE_EXPR.format("NEW")}, 1, IFNULL(NEW.bits, 0))
+        ON CONFLICT (minute) DO UPDATE SET
+            messages = messages + 1, bits = bits + excluded.bits;
+END;
+
+CREATE TRIGGER chat_aggregates_delete AFTER DELETE ON chat_messages BEGIN
+    UPDATE chat_totals SET
+        messages = messages - 1,
+        bits = bits - IFNULL(OLD.bits, 0),
+        unique_chatters = unique_chatters - IFNULL((
+            SELECT messages = 1 FROM chat_users WHERE user_name = OLD.user_name
+        ), 0)
+    WHERE id = 1;
+    UPDATE chat_users SET
+        messages = messages - 1, bits = bits - IFNULL(OLD.bits, 0)
+    WHERE user_name IS OLD.user_name;
+    DELETE FROM chat_users WHERE user_name IS OLD.user_name AND messages <= 0;
+    UPDATE chat_minutes SET
+        messages = messages - 1, bits = bits - IFNULL(OLD.bits, 0)
+    WHERE minute = {MINUTE_EXPR.format("OLD")};
+    DELETE FROM chat_minutes
+    WHERE minute = {MINUTE_EXPR.format("OLD")} AND messages <= 0;
+END;
+"""
+
+AGGREGATE_TABLES = ("chat_minutes", "chat_users", "chat_totals")
+AGGREGATE_TRIGGERS = ("chat_aggregates_insert", "chat_aggregates_delete")
+
+
+def _trigger_sql(name):
+    start = TRIGGERS.index(f"CREATE TRIGGER {name} ")
+    return " ".join(TRIGGERS[start : TRIGGERS.index("END;", start) + 3].split())
+
+
+def has_aggregates(conn):
+    """True if the aggregate triggers exist and match the current definitions."""
+    stored = dict(
+        conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type='trigger' AND name IN (?, ?)",
+            AGGREGATE_TRIGGERS,
+        )
+    )
+    # Databases with older triggers are rebuilt by init_chat_aggregates().
+    return all(
+        " ".join((stored.get(name) or "").split()) == _trigger_sql(name)
+        for name in AGGREGATE_TRIGGERS
+    )
+
+
+def init_chat_aggregates(conn, rebuild=False):
+    """
+    Create the aggregate tables and triggers on an open chat database
+    (chat_messages must exist), filling them from the messages already there.
+    Returns True if the aggregates were (re)built.
+    """
+    if has_aggregates(conn) and not rebuild:
+        return False
+    # Executed as one script inside a transaction, so a concurrent writer
+    # never sees the triggers without the backfilled rows or vice versa.
+    drop = "".join(f"DROP TABLE IF EXISTS {t};" for t in AGGREGATE_TABLES) + "".join(
+        f"DROP TRIGGER IF EXISTS {t};" for t in AGGREGATE_TRIGGERS
+    )
+    conn.commit()
+    conn.executescript(f"BEGIN IMMEDIATE;{drop}{SCHEMA}{BACKFILL}{TRIGGERS}COMMIT;")
+    return True
+
+
+def chat_summary(conn, top=10, per_minute=True):
+    """Totals, top chatters and (optionally) per-minute buckets of one stream."""
+    row = conn.execute(
+        "SELECT messages, bits, unique_chatters, first_offset, last_offset "
+        "FROM chat_totals WHERE id = 1"
+    ).fetchone() or (0, 0, 0, None, None)
+    summary = dict(
+        zip(
+            ("messages", "bits", "unique_chatters", "first_offset", "last_offset"),
+            row,
+        )
+    )
+    summary["top_chatters"] = [
+        {"user_name": u, "messages": m, "bits": b}
+        for u, m, b in conn.execute(
+            "SELECT user_name, messages, bits FROM chat_users "
+            "ORDER BY messages DESC LIMIT ?",
+            (top,),
+        )
+    ]
+    summary["top_cheerers"] = [
+        {"user_name": u, "messages": m, "bits": b}
+        for u, m, b in conn.execute(
+            "SELECT user_name, messages, bits FROM chat_users WHERE bits > 0 "
+            "ORDER BY bits DESC LIMIT ?",
+            (top,),
+        )
+    ]
+    if per_minute:
+        summary["per_minute"] = conn.execute(
+            "SELECT minute, messages, bits FROM chat_minutes ORDER BY minute"
+        ).fetchall()
+    return summary
+
+
+def chat_summary_file(sqlite_path, top=10, per_minute=True):
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        init_chat_aggregates(conn)
+        return chat_summary(conn, top=top, per_minute=per_minute)
+    finally:
+        conn.close()
+
+
+def backfill(persons_dir=None, rebuild=False):
+    """Add aggregates to every archived chat SQLite. Returns (built, skipped)."""
+    from .catalog import PERSONS_DIR, iter_stream_folders
+
+    built = skipped = 0
+    for _channel, folder in iter_stream_folders(persons_dir or PERSONS_DIR):
+        for entry in os.scandir(folder):
+            if not (entry.name.startswith("chat") and entry.name.endswith(".sqlite")):
+                continue
+            conn = sqlite3.connect(entry.path)
+            try:
+                if not conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type='table' AND name='chat_messages'"
+                ).fetchone():
+                    continue
+                if init_chat_aggregates(conn, rebuild=rebuild):
+                    built += 1
+                    logger.info(f"Built chat aggregates for {entry.path}")
+                else:
+                    skipped += 1
+            except sqlite3.Error as e:
+                logger.error(f"Could not build chat aggregates for {entry.path}: {e}")
+            finally:
+                conn.close()
+    logger.info(f"Chat aggregates: {built} built, {skipped} already up to date.")
+    return built, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stream chat aggregates")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("backfill", help="Build aggregates for archived streams")
+    p.add_argument("--rebuild", action="store_true", help="Recompute existing ones")
+    p = sub.add_parser("show", help="Print the stats of one chat SQLite")
+    p.add_argument("sqlite_path")
+    p.add_argument("--top", type=int, default=10)
+    p.add_argument("--per-minute", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command == "backfill":
+        backfill(rebuild=args.rebuild)
+    else:
+        summary = chat_summary_file(
+            args.sqlite_path, top=args.top, per_minute=args.per_minute
+        )
+        print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -24,27 +24,48 @@ def init_db():
             start_time TEXT,
             end_time TEXT,
             title TEXT,
-            source TEXT
+            source TEXT,
+            vod_id TEXT
         );
         """
         )
+        columns = {row[1] for row in c.execute("PRAGMA table_info(streams)")}
+        if "vod_id" not in columns:
+            c.execute("ALTER TABLE streams ADD COLUMN vod_id TEXT")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_streams_vod_id ON streams (vod_id)")
         conn.commit()
 
 
 def upsert_stream_record(
-    stream_id, channel_name, folder_name, start_time, end_time, title, source
+    stream_id,
+    channel_name,
+    folder_name,
+    start_time,
+    end_time,
+    title,
+    source,
+    vod_id=None,
 ):
     """
     Insert or update the record for a given stream_id in the 'streams' table.
+    A known vod_id is kept when the update doesn't carry one.
     """
     try:
         with get_connection() as conn:
             c = conn.cursor()
             c.execute(
                 """
-            INSERT OR REPLACE INTO streams
-                (stream_id, channel_name, folder_name, start_time, end_time, title, source)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO streams
+                (stream_id, channel_name, folder_name, start_time, end_time, title, source, vod_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(stream_id) DO UPDATE SET
+                channel_name = excluded.channel_name,
+                folder_name = excluded.folder_name,
+                start_time = excluded.start_time,
+                end_time = excluded.end_time,
+                title = excluded.title,
+                source = excluded.source,
+                vod_id = COALESCE(excluded.vod_id, streams.vod_id)
             """,
                 (
                     stream_id,
@@ -54,8 +75,33 @@ def upsert_stream_record(
                     end_time,
                     title,
                     source,
+                    vod_id,
                 ),
             )
             conn.commit()
     except Exception as e:
         logger.error(f"Failed to upsert record for {stream_id}: {e}")
+
+
+def find_stream_folder(stream_id=None, vod_id=None):
+    """
+    Folder already used for this stream_id or vod_id, if it still exists on disk.
+    Looking folders up by id (rather than rebuilding the path from the title)
+    keeps renamed VODs and live recordings in the folder they started in.
+    """
+    try:
+        with get_connection() as conn:
+            rows = conn.execute(
+                """
+            SELECT folder_name FROM streams
+            WHERE (stream_id = ? AND ? IS NOT NULL) OR (vod_id = ? AND ? IS NOT NULL)
+            """,
+                (stream_id, stream_id, vod_id, vod_id),
+            ).fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Failed to look up folder for {stream_id}/{vod_id}: {e}")
+        return None
+    for (folder_name,) in rows:
+        if folder_name and os.path.isdir(folder_name):
+            return folder_name
+    return None
@@ -0,0 +1,184 @@
+"""
+Order and admit VOD downloads by estimated size and free disk space.
+
+Each VOD's size is estimated from its Twitch duration and the channel's
+average bitrate over the videos already in the catalog (size / probed
+duration), falling back to DEFAULT_BYTES_PER_SECOND. Before a download
+starts, the scheduler checks that
+
+    free space - estimated size >= DISK_MIN_FREE_GB + live reserve
+
+where the live reserve is LIVE_RESERVE_HOURS of recording for every channel
+currently being recorded (at least LIVE_RESERVE_SLOTS of them), so VOD syncs
+never eat the space a live recording needs. When the next VOD in the queue
+does not fit, no further downloads are started.
+"""
+
+import os
+import re
+import shutil
+import sqlite3
+import logging
+
+from .db_utils import DB_PATH
+from .catalog import CATALOG_PATH, PERSONS_DIR
+
+logger = logging.getLogger(__name__)
+
+# ~6 Mbit/s, Twitch "source" quality
+DEFAULT_BYTES_PER_SECOND = 750_000
+# Container overhead and bitrate variance
+SIZE_MARGIN = 1.05
+POLICIES = ("newest", "oldest", "shortest", "channels")
+
+DURATION_RE = re.compile(r"^(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?$")
+
+
+def parse_twitch_duration(value):
+    """'1h2m3s' -> 3723 seconds; 0 if unparseable."""
+    match = DURATION_RE.match(value or "")
+    if not match:
+        return 0
+    h, m, s = (int(g) if g else 0 for g in match.groups())
+    return h * 3600 + m * 60 + s
+
+
+def channel_bitrates(catalog_path=CATALOG_PATH):
+    """{channel_name: bytes per second} from catalogued videos with a duration."""
+    if not os.path.exists(catalog_path):
+        return {}
+    conn = sqlite3.connect(f"file:{catalog_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            """
+            SELECT f.channel_name, SUM(v.size), SUM(v.duration)
+            FROM files v JOIN folders f ON f.folder = v.folder
+            WHERE v.kind = 'video' AND v.duration > 60
+            GROUP BY f.channel_name
+        """
+        ).fetchall()
+    except sqlite3.Error as e:
+        logger.warning(f"Could not read bitrates from catalog: {e}")
+        return {}
+    finally:
+        conn.close()
+    return {channel: size / duration for channel, size, duration in rows if duration}
+
+
+def active_recordings(db_path=DB_PATH):
+    if not os.path.exists(db_path):
+        return []
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return [
+            row[0]
+            for row in conn.execute(
+                "SELECT channel_name FROM streams WHERE source = 'live' AND end_time IS NULL"
+            )
+        ]
+    finally:
+        conn.close()
+
+
+def free_bytes(path):
+    """Free space on the filesystem holding path (or its nearest existing parent)."""
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return shutil.disk_usage(path).free
+
+
+class DownloadScheduler:
+    def __init__(
+        self,
+        policy=None,
+        channel_order=None,
+        path=PERSONS_DIR,
+        min_free_bytes=None,
+        live_reserve_hours=None,
+        live_reserve_slots=None,
+    ):
+        """
+        :param policy: newest | oldest | shortest | channels (default VOD_ORDER or newest)
+        :param channel_order: channel names in priority order for the "channels" policy
+        :param path: any path on the archive filesystem
+        """
+        self.policy = policy or os.getenv("VOD_ORDER", "newest")
+        if self.policy not in POLICIES:
+            raise ValueError(
+                f"Unknown VOD order {self.policy!r}; use one of {POLICIES}"
+            )
+        self.channel_order = channel_order or []
+        self.path = path
+        if min_free_bytes is None:
+            min_free_bytes = float(os.getenv("DISK_MIN_FREE_GB", "20")) * 1024**3
+        self.min_free_bytes = min_free_bytes
+        self.live_reserve_hours = (
+            live_reserve_hours
+            if live_reserve_hours is not None
+            else float(os.getenv("LIVE_RESERVE_HOURS", "8"))
+        )
+        self.live_reserve_slots = (
+            live_reserve_slots
+            if live_reserve_slots is not None
+            else int(os.getenv("LIVE_RESERVE_SLOTS", "1"))
+        )
+        self.bitrates = channel_bitrates()
+
+    def bitrate(self, channel_name):
+        return self.bitrates.get(channel_name, DEFAULT_BYTES_PER_SECOND)
+
+    def estimate(self, channel_name, duration_seconds):
+        return int(duration_seconds * self.bitrate(channel_name) * SIZE_MARGIN)
+
+    def learn(self, channel_name, size, duration_seconds):
+        """Fold a finished download into the channel's bitrate."""
+        if duration_seconds > 60 and size > 0:
+            old = self.bitrates.get(channel_name)
+            new = size / duration_seconds
+            self.bitrates[channel_name] = new if old is None else (old + new) / 2
+
+    def order(self, items):
+        """
+        Sort (channel_name, vod) pairs by the policy. Ties (and the order within
+        a channel for the "channels" policy) are newest first.
+        """
+        items = sorted(items, key=lambda i: i[1].get("created_at") or "", reverse=True)
+        if self.policy == "oldest":
+            items.reverse()
+        elif self.policy == "shortest":
+            items.sort(key=lambda i: parse_twitch_duration(i[1].get("duration")))
+        elif self.policy == "channels":
+            rank = {c.lower(): n for n, c in enumerate(self.channel_order)}
+            items.sort(key=lambda i: rank.get(i[0].lower(), len(rank)))
+        return items
+
+    def live_reserve_bytes(self):
+        recording = active_recordings()
+        reserve = sum(
+            self.live_reserve_hours * 3600 * self.bitrate(ch) for ch in recording
+        )
+        missing_slots = max(0, self.live_reserve_slots - len(recording))
+        reserve += (
+            missing_slots
+            * self.live_reserve_hours
+            * 3600
+            * max(self.bitrates.values(), default=DEFAULT_BYTES_PER_SECOND)
+        )
+        return int(reserve)
+
+    def admit(self, channel_name, duration_seconds):
+        """True if a download of this length may start now."""
+        estimate = self.estimate(channel_name, duration_seconds)
+        free = free_bytes(self.path)
+        needed = self.min_free_bytes + self.live_reserve_bytes()
+        if free - estimate < needed:
+            logger.warning(
+                f"[{channel_name}] Not starting download: ~{estimate / 1024**3:.1f} GiB "
+                f"would leave {(free - estimate) / 1024**3:.1f} GiB free, "
+                f"below the {needed / 1024**3:.1f} GiB watermark (incl. live reserve)"
+            )
+            return False
+        return True
@@ -0,0 +1,269 @@
+"""
+Archive the emote images referenced by chat.
+
+Emote images go into the shared blob store (modules/blob_store.py) and
+metadata/emotes.db maps each emote ID to its blob. Each stream folder gets an
+emotes.json manifest listing the emote IDs used in its chat, so a replay can
+render them without Twitch's CDN.
+
+EmoteArchiver.observe() is called for every chat message. An in-memory LRU of
+emote IDs already resolved makes a hot emote free after its first sighting;
+first sightings are fetched in the background, a few at a time. Failed fetches
+are remembered too (emote_failures, in the LRU as (None, retry_after)) and only
+retried after NOT_FOUND_RETRY (404) or FAILED_RETRY seconds.
+"""
+
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import argparse
+from collections import OrderedDict
+
+from .db_utils import BASE_DIR
+from .blob_store import put_bytes, blob_path
+from .file_utils import atomic_write_json, read_json
+
+logger = logging.getLogger(__name__)
+
+EMOTE_DB = os.path.join(BASE_DIR, "metadata", "emotes.db")
+MANIFEST_FILENAME = "emotes.json"
+LRU_SIZE = 4096
+FETCH_CONCURRENCY = 4
+FETCH_RETRIES = 3
+NOT_FOUND_RETRY = 24 * 3600
+FAILED_RETRY = 600
+CONTENT_TYPE_EXT = {"image/png": ".png", "image/gif": ".gif", "image/webp": ".webp"}
+
+
+def emote_url(emote_id, base=None):
+    # Read lazily so TWITCH_EMOTE_BASE from .env is honoured.
+    base = base or os.getenv("TWITCH_EMOTE_BASE", "https://static-cdn.jtvnw.net")
+    return f"{base.rstrip('/')}/emoticons/v1/{emote_id}/3.0"
+
+
+def init_emote_db(db_path=EMOTE_DB):
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS emotes (
+            emote_id TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            ext TEXT NOT NULL,
+            size INTEGER,
+            fetched_at REAL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS emote_failures (
+            emote_id TEXT PRIMARY KEY,
+            status INTEGER,
+            retry_after REAL
+        )
+        """
+    )
+    conn.commit()
+    return conn
+
+
+class EmoteArchiver:
+    """
+    Must be used from a single asyncio event loop (the chat bot's).
+    """
+
+    def __init__(
+        self,
+        manifest_path=None,
+        db_path=EMOTE_DB,
+        concurrency=FETCH_CONCURRENCY,
+        lru_size=LRU_SIZE,
+        base_url=None,
+    ):
+        self.manifest_path = manifest_path
+        self.base_url = base_url
+        self.lru_size = lru_size
+        self.conn = init_emote_db(db_path)
+        self._lru = OrderedDict()  # emote_id -> (sha256, ext) or (None, retry_after)
+        self._pending = {}  # emote_id -> task
+        self._sem = asyncio.Semaphore(concurrency)
+        self._session = None
+        self.stats = {"seen": 0, "lru_hits": 0, "db_hits": 0, "fetched": 0, "failed": 0}
+
+        self.manifest = {}
+        if manifest_path:
+            self.manifest = read_json(manifest_path).get("emotes", {})
+        self._manifest_dirty = False
+
+    def _lookup(self, emote_id):
+        entry = self._lru.get(emote_id)
+        if entry is not None:
+            self._lru.move_to_end(emote_id)
+            self.stats["lru_hits"] += 1
+            return entry
+        row = self.conn.execute(
+            "SELECT sha256, ext FROM emotes WHERE emote_id = ?", (emote_id,)
+        ).fetchone()
+        if row is None:
+            row = self.conn.execute(
+                "SELECT NULL, retry_after FROM emote_failures WHERE emote_id = ?",
+                (emote_id,),
+            ).fetchone()
+        if row:
+            self.stats["db_hits"] += 1
+            self._remember(emote_id, tuple(row))
+            return self._lru[emote_id]
+        return None
+
+    def _remember(self, emote_id, entry):
+        self._lru[emote_id] = entry
+        self._lru.move_to_end(emote_id)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def observe(self, emote_ids, offset_seconds=None):
+        """Record emotes seen in one chat message; schedules first-sighting fetches."""
+        for emote_id in emote_ids:
+            self.stats["seen"] += 1
+            used = self.manifest.get(emote_id)
+            if used is None:
+                used = self.manifest[emote_id] = {
+                    "count": 0,
+                    "first_offset": offset_seconds,
+                }
+                self._manifest_dirty = True
+            used["count"] += 1
+
+            if emote_id in self._pending:
+                continue
+            entry = self._lookup(emote_id)
+            if entry is not None and entry[0] is None:
+                if entry[1] > time.time():
+                    continue
+            elif entry is not None:
+                if "sha256" not in used:
+                    used["sha256"], used["ext"] = entry
+                    self._manifest_dirty = True
+                continue
+            self._pending[emote_id] = asyncio.get_running_loop().create_task(
+                self._fetch(emote_id)
+            )
+
+    async def _fetch(self, emote_id):
+        import aiohttp
+
+        url = emote_url(emote_id, self.base_url)
+        try:
+            async with self._sem:
+                if self._session is None:
+                    self._session = aiohttp.ClientSession(
+                        timeout=aiohttp.ClientTimeout(total=30)
+                    )
+                for attempt in range(1, FETCH_RETRIES + 1):
+                    try:
+                        async with self._session.get(url) as resp:
+                            if resp.status == 404:
+                                logger.warning(f"Emote {emote_id} not found at {url}")
+                                self._failed(emote_id, 404, NOT_FOUND_RETRY)
+                                return
+                            resp.raise_for_status()
+                            data = await resp.read()
+                            ext = CONTENT_TYPE_EXT.get(resp.content_type, ".png")
+                        break
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        if attempt == FETCH_RETRIES:
+                            logger.warning(f"Failed fetching emote {emote_id}: {e}")
+                            self._failed(
+                                emote_id, getattr(e, "status", None), FAILED_RETRY
+                            )
+                            return
+                        await asyncio.sleep(attempt)
+            sha256, _ = await asyncio.to_thread(put_bytes, data, ext)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO emotes (emote_id, sha256, ext, size, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (emote_id, sha256, ext, len(data), time.time()),
+            )
+            self.conn.execute(
+                "DELETE FROM emote_failures WHERE emote_id = ?", (emote_id,)
+            )
+            self.conn.commit()
+            self._remember(emote_id, (sha256, ext))
+            self.stats["fetched"] += 1
+            used = self.manifest.get(emote_id)
+            if used is not None:
+                used["sha256"], used["ext"] = sha256, ext
+                self._manifest_dirty = True
+        finally:
+            self._pending.pop(emote_id, None)
+
+    def _failed(self, emote_id, status, retry_seconds):
+        self.stats["failed"] += 1
+        retry_after = time.time() + retry_seconds
+        self.conn.execute(
+            "INSERT OR REPLACE INTO emote_failures (emote_id, status, retry_after) "
+            "VALUES (?, ?, ?)",
+            (emote_id, status, retry_after),
+        )
+        self.conn.commit()
+        self._remember(emote_id, (None, retry_after))
+
+    def flush(self):
+        """Write the stream manifest if an emote was added or resolved."""
+        if not self.manifest_path or not self._manifest_dirty:
+            return
+        atomic_write_json(self.manifest_path, {"emotes": self.manifest})
+        self._manifest_dirty = False
+
+    async def close(self, timeout=30):
+        if self._pending:
+            await asyncio.wait(list(self._pending.values()), timeout=timeout)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self._manifest_dirty = True
+        self.flush()
+        self.conn.close()
+
+
+def archive_emote_ids(emote_ids, manifest_path=None, **kwargs):
+    """Fetch a batch of emote IDs (e.g. from an imported VOD chat)."""
+
+    async def run():
+        archiver = EmoteArchiver(manifest_path, **kwargs)
+        archiver.observe(emote_ids)
+        await archiver.close()
+        return archiver.stats
+
+    return asyncio.run(run())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Emote image cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("fetch", help="Archive emote images by ID")
+    p.add_argument("emote_ids", nargs="+")
+    p.add_argument("--manifest")
+    p = sub.add_parser("path", help="Print the stored image path of an emote")
+    p.add_argument("emote_id")
+    args = parser.parse_args(argv)
+
+    if args.command == "fetch":
+        print(archive_emote_ids(args.emote_ids, args.manifest))
+    else:
+        conn = init_emote_db()
+        row = conn.execute(
+            "SELECT sha256, ext FROM emotes WHERE emote_id = ?", (args.emote_id,)
+        ).fetchone()
+        conn.close()
+        if row is None:
+            raise SystemExit(f"Emote {args.emote_id} is not archived")
+        print(blob_path(*row))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,69 @@
 import os
 import json
+import stat
 import hashlib
 import sqlite3
 import subprocess
 import shutil
 import logging
+import tempfile
+from datetime import datetime
+
+from .chat_stats import init_chat_aggregates
+from .profiling import profiled
 
 logger = logging.getLogger(__name__)
 
+# Read once: os.umask() can only be queried by setting it, which races threads.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
 
-def write_json(filepath, data):
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+def file_mode_for(filepath):
+    """
+    Permission bits for a file about to replace filepath: the existing file's,
+    or what open() would give a new one. mkstemp() files are always 0600.
+    """
+    try:
+        return stat.S_IMODE(os.stat(filepath).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+def atomic_write_json(filepath, data, mode=None):
+    """
+    Write JSON to a temp file in the same directory, fsync it and rename it over
+    filepath, so readers see either the old or the new document, never a torn one.
+    mode (e.g. 0o600 for secrets) is set before anything is written; by default
+    the file keeps its current permissions.
+    """
+    directory = os.path.dirname(filepath)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f".{os.path.basename(filepath)}.", suffix=".tmp", dir=directory
+    )
     try:
-        with open(filepath, "w", encoding="utf-8") as f:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            os.fchmod(f.fileno(), file_mode_for(filepath) if mode is None else mode)
             json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def write_json(filepath, data):
+    try:
+        atomic_write_json(filepath, data)
     except Exception as e:
         logger.error(f"Failed to write JSON to {filepath}: {e}")
 
@@ -22,10 +72,20 @@ def read_json(filepath):
     try:
         with open(filepath, "r", encoding="utf-8") as f:
             return json.load(f)
-    except (IOError, json.JSONDecodeError):
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError as e:
+        # Keep the damaged file instead of letting the next write replace it.
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        corrupt_path = f"{filepath}.corrupt-{stamp}"
+        logger.error(f"Corrupt JSON in {filepath} ({e}); moved to {corrupt_path}")
+        os.replace(filepath, corrupt_path)
+        return {}
+    except IOError:
         return {}
 
 
+@profiled
 def calculate_sha256(filepath):
     sha = hashlib.sha256()
     with open(filepath, "rb") as f:
@@ -34,6 +94,7 @@ def calculate_sha256(filepath):
     return sha.hexdigest()
 
 
+@profiled
 def get_local_file_duration(filepath):
     if not os.path.exists(filepath):
         return 0.0
@@ -73,21 +134,7 @@ def print_progress_bar(
         print()
 
 
-def process_chat_to_sqlite(chat_json_path, sqlite_path):
-    if not os.path.exists(chat_json_path):
-        logger.warning(f"Chat JSON file not found: {chat_json_path}")
-        return
-
-    with open(chat_json_path, "r", encoding="utf-8") as f:
-        try:
-            chat_data = json.load(f)
-        except Exception as e:
-            logger.error(f"Failed to load chat JSON {chat_json_path}: {e}")
-            return
-
-    comments = chat_data.get("comments", [])
-    total_comments = len(comments)
-
+def init_vod_chat_sqlite(sqlite_path):
     os.makedirs(os.path.dirname(sqlite_path), exist_ok=True)
     conn = sqlite3.connect(sqlite_path)
     c = conn.cursor()
@@ -115,6 +162,32 @@ def process_chat_to_sqlite(chat_json_path, sqlite_path):
     c.execute(
         "CREATE INDEX IF NOT EXISTS idx_message_sent_offset ON chat_messages (message_sent_offset)"
     )
+    conn.commit()
+    init_chat_aggregates(conn)
+    conn.close()
+
+
+@profiled
+def process_chat_to_sqlite(chat_json_path, sqlite_path):
+    if not os.path.exists(chat_json_path):
+        logger.warning(f"Chat JSON file not found: {chat_json_path}")
+        return
+
+    with open(chat_json_path, "r", encoding="utf-8") as f:
+        try:
+            chat_data = json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load chat JSON {chat_json_path}: {e}")
+            return
+
+    comments = chat_data.get("comments", [])
+    total_comments = len(comments)
+
+    init_vod_chat_sqlite(sqlite_path)
+    conn = sqlite3.connect(sqlite_path)
+    # Replaced rows must leave the chat aggregates through their delete trigger.
+    conn.execute("PRAGMA recursive_triggers = ON")
+    c = conn.cursor()
 
     from .file_utils import print_progress_bar
 
@@ -169,34 +242,59 @@ def init_live_chat_sqlite(sqlite_path):
         CREATE TABLE IF NOT EXISTS chat_messages (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             message_sent_absolute TEXT,
+            message_sent_offset REAL,
             user_name TEXT,
             message_body TEXT,
             bits INTEGER,
             user_color TEXT,
-            raw_json TEXT
+            raw_json TEXT,
+            roles TEXT,
+            emote_ids TEXT
         )
     """
     )
 
+    # Databases created before these columns existed.
+    columns = {row[1] for row in c.execute("PRAGMA table_info(chat_messages)")}
+    if "message_sent_offset" not in columns:
+        c.execute("ALTER TABLE chat_messages ADD COLUMN message_sent_offset REAL")
+    for column in ("roles", "emote_ids"):
+        if column not in columns:
+            c.execute(f"ALTER TABLE chat_messages ADD COLUMN {column} TEXT")
+
     c.execute("CREATE INDEX IF NOT EXISTS idx_user_name ON chat_messages (user_name)")
     c.execute(
         "CREATE INDEX IF NOT EXISTS idx_message_body ON chat_messages (message_body)"
     )
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_message_sent_offset ON chat_messages (message_sent_offset)"
+    )
     conn.commit()
+    init_chat_aggregates(conn)
     conn.close()
 
 
-def insert_chat_message_sqlite(sqlite_path, msg_dict):
+def insert_chat_message_sqlite(sqlite_path, msg_dict, conn=None):
+    """
+    Insert one live chat message. msg_dict["offset_seconds"] is the offset from
+    stream start. Pass an open conn to batch inserts; the caller then commits.
+    """
     import json
 
-    conn = sqlite3.connect(sqlite_path)
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(sqlite_path)
     c = conn.cursor()
 
     message_sent = msg_dict.get("time_text", "")
+    message_offset = msg_dict.get("offset_seconds")
     user_name = msg_dict.get("author", {}).get("name", "UnknownUser")
     message_body = msg_dict.get("message", "")
     bits_spent = msg_dict.get("bits", 0)
     user_color = msg_dict.get("author", {}).get("color", "#FFFFFF")
+    # Space-separated, as in the text log.
+    roles = " ".join(msg_dict.get("author", {}).get("roles", ()))
+    emote_ids = " ".join(msg_dict.get("emotes", ()))
 
     raw_str = json.dumps(msg_dict, ensure_ascii=False)
 
@@ -204,14 +302,77 @@ def insert_chat_message_sqlite(sqlite_path, msg_dict):
         """
         INSERT INTO chat_messages (
             message_sent_absolute,
+            message_sent_offset,
             user_name,
             message_body,
             bits,
             user_color,
-            raw_json
-        ) VALUES (?, ?, ?, ?, ?, ?)
+            raw_json,
+            roles,
+            emote_ids
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
     """,
-        (message_sent, user_name, message_body, bits_spent, user_color, raw_str),
+        (
+            message_sent,
+            message_offset,
+            user_name,
+            message_body,
+            bits_spent,
+            user_color,
+            raw_str,
+            roles,
+            emote_ids,
+        ),
+    )
+    if own_conn:
+        conn.commit()
+        conn.close()
+
+
+def init_events_db(sqlite_path):
+    """Viewer counts and game changes sampled during a live recording."""
+    os.makedirs(os.path.dirname(sqlite_path), exist_ok=True)
+    conn = sqlite3.connect(sqlite_path)
+    c = conn.cursor()
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS viewer_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            offset_seconds REAL,
+            viewer_count INTEGER,
+            recorded_at TEXT
+        )
+    """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS chapter_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            offset_seconds REAL,
+            game_name TEXT,
+            recorded_at TEXT
+        )
+    """
     )
     conn.commit()
     conn.close()
+
+
+def insert_viewer_event(sqlite_path, offset_seconds, viewer_count):
+    with sqlite3.connect(sqlite_path) as conn:
+        conn.execute(
+            "INSERT INTO viewer_events (offset_seconds, viewer_count, recorded_at) "
+            "VALUES (?, ?, ?)",
+            (offset_seconds, viewer_count, datetime.now().astimezone().isoformat()),
+        )
+    conn.close()
+
+
+def insert_chapter_event(sqlite_path, offset_seconds, game_name):
+    with sqlite3.connect(sqlite_path) as conn:
+        conn.execute(
+            "INSERT INTO chapter_events (offset_seconds, game_name, recorded_at) "
+            "VALUES (?, ?, ?)",
+            (offset_seconds, game_name, datetime.now().astimezone().isoformat()),
+        )
+    conn.close()
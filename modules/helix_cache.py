@@ -0,0 +1,285 @@
+"""
+On-disk cache of Helix GET responses, shared by every archiver process.
+
+Responses live in metadata/helix_cache.db keyed by URL and sorted query
+parameters. Each endpoint has its own TTL (HELIX_CACHE_TTL, seconds):
+
+    users=604800    login -> id lookups practically never change
+    videos=600      VOD pages
+    streams=15      live status; only saves duplicate checks between processes
+
+A fresh entry is answered from disk. An expired one with an ETag is
+revalidated with If-None-Match; a 304 only extends it. Misses are
+single-flighted across processes with a striped lock file
+(helix_cache.lock.<n>): a process that waited re-reads the cache before
+fetching, so concurrent runs make one request per key.
+
+Hit/miss counts per endpoint are added to the cache_stats table at exit:
+
+    python -m modules.helix_cache stats
+    python -m modules.helix_cache clear [--endpoint users]
+
+HELIX_CACHE=0 turns the cache off.
+"""
+
+import os
+import json
+import time
+import atexit
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+from collections import Counter
+from urllib.parse import urlencode, urlsplit
+
+from .db_utils import BASE_DIR
+from .token_manager import TokenFileLock
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = os.path.join(BASE_DIR, "metadata", "helix_cache.db")
+DEFAULT_TTLS = {"users": 7 * 86400, "videos": 600, "streams": 15}
+LOCK_STRIPES = 64
+# Expired entries are kept this long for ETag revalidation.
+KEEP_EXPIRED = 7 * 86400
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+_state = {"initialized": False, "atexit": False}
+
+
+def enabled():
+    return os.getenv("HELIX_CACHE", "1").lower() not in ("0", "false", "no", "off")
+
+
+def ttls():
+    result = dict(DEFAULT_TTLS)
+    for item in os.getenv("HELIX_CACHE_TTL", "").split(","):
+        name, _, seconds = item.partition("=")
+        if name.strip() and seconds.strip():
+            result[name.strip()] = float(seconds)
+    return result
+
+
+def endpoint_of(url):
+    return urlsplit(url).path.rstrip("/").rsplit("/", 1)[-1]
+
+
+def cache_key(url, params):
+    items = sorted(
+        (k, str(v)) for k, vs in (params or {}).items() for v in _as_list(vs)
+    )
+    return f"{url}?{urlencode(items)}"
+
+
+def _as_list(value):
+    return value if isinstance(value, (list, tuple)) else [value]
+
+
+def _connect():
+    if not _state["initialized"]:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    conn = sqlite3.connect(CACHE_PATH, timeout=30)
+    if not _state["initialized"]:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT,
+                etag TEXT,
+                body BLOB,
+                fetched_at REAL,
+                expires_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS cache_stats (
+                endpoint TEXT,
+                outcome TEXT,
+                count INTEGER,
+                PRIMARY KEY (endpoint, outcome)
+            );
+            """
+        )
+        _state["initialized"] = True
+    return conn
+
+
+class CachedResponse:
+    """The parts of requests.Response that Helix callers use."""
+
+    status_code = 200
+
+    def __init__(self, body, etag=None):
+        self.content = body
+        self.headers = {"ETag": etag} if etag else {}
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        pass
+
+
+def _count(endpoint, outcome):
+    with _stats_lock:
+        _stats[(endpoint, outcome)] += 1
+        if not _state["atexit"]:
+            _state["atexit"] = True
+            atexit.register(flush_stats)
+
+
+def _lookup(conn, key):
+    return conn.execute(
+        "SELECT etag, body, expires_at FROM responses WHERE key = ?", (key,)
+    ).fetchone()
+
+
+def cached_get(url, params, fetch):
+    """
+    Response for url/params, from the cache or from fetch(extra_headers),
+    which must return a requests.Response.
+    """
+    endpoint = endpoint_of(url)
+    ttl = ttls().get(endpoint, 0)
+    if not enabled() or ttl <= 0:
+        _count(endpoint, "bypass")
+        return fetch({})
+
+    key = cache_key(url, params)
+    with _connect() as conn:
+        row = _lookup(conn, key)
+    if row and row[2] > time.time():
+        _count(endpoint, "hit")
+        return CachedResponse(row[1], row[0])
+
+    stripe = int(hashlib.sha1(key.encode()).hexdigest(), 16) % LOCK_STRIPES
+    with TokenFileLock(f"{CACHE_PATH}.lock.{stripe}"):
+        with _connect() as conn:
+            row = _lookup(conn, key)
+        if row and row[2] > time.time():
+            # Fetched by another process while we waited for the lock.
+            _count(endpoint, "coalesced")
+            return CachedResponse(row[1], row[0])
+
+        extra = {"If-None-Match": row[0]} if row and row[0] else {}
+        resp = fetch(extra)
+        now = time.time()
+        if resp.status_code == 304 and row:
+            _count(endpoint, "revalidated")
+            with _connect() as conn:
+                conn.execute(
+                    "UPDATE responses SET fetched_at = ?, expires_at = ? WHERE key = ?",
+                    (now, now + ttl, key),
+                )
+            return CachedResponse(row[1], row[0])
+        _count(endpoint, "miss")
+        if resp.status_code == 200:
+            with _connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        key,
+                        endpoint,
+                        resp.headers.get("ETag"),
+                        resp.content,
+                        now,
+                        now + ttl,
+                    ),
+                )
+        return resp
+
+
+def flush_stats():
+    """Add this process's counts to cache_stats (runs at exit)."""
+    with _stats_lock:
+        counts = dict(_stats)
+        _stats.clear()
+    if not counts:
+        return
+    try:
+        with _connect() as conn:
+            conn.executemany(
+                "INSERT INTO cache_stats VALUES (?, ?, ?) "
+                "ON CONFLICT (endpoint, outcome) DO UPDATE SET count = count + excluded.count",
+                [(e, o, n) for (e, o), n in counts.items()],
+            )
+            conn.execute(
+                "DELETE FROM responses WHERE expires_at < ?",
+                (time.time() - KEEP_EXPIRED,),
+            )
+    except sqlite3.Error as e:
+        logger.warning(f"Could not save Helix cache stats: {e}")
+        return
+    summary = ", ".join(
+        f"{endpoint} {ratio:.0%}" for endpoint, ratio in hit_ratios(counts).items()
+    )
+    if summary:
+        logger.info(f"Helix cache hit ratio this run: {summary}")
+
+
+def hit_ratios(counts):
+    """{endpoint: share of lookups answered without a full response}."""
+    totals = Counter()
+    served = Counter()
+    for (endpoint, outcome), n in counts.items():
+        if outcome == "bypass":
+            continue
+        totals[endpoint] += n
+        if outcome != "miss":
+            served[endpoint] += n
+    return {e: served[e] / totals[e] for e in sorted(totals) if totals[e]}
+
+
+def stats():
+    """({(endpoint, outcome): count} over all runs incl. this one, entries)."""
+    counts = Counter(_stats)
+    entries = {}
+    if os.path.exists(CACHE_PATH):
+        with _connect() as conn:
+            for endpoint, outcome, n in conn.execute("SELECT * FROM cache_stats"):
+                counts[(endpoint, outcome)] += n
+            entries = dict(
+                conn.execute(
+                    "SELECT endpoint, COUNT(*) FROM responses GROUP BY endpoint"
+                )
+            )
+    return counts, entries
+
+
+def clear(endpoint=None):
+    with _connect() as conn:
+        if endpoint:
+            conn.execute("DELETE FROM responses WHERE endpoint = ?", (endpoint,))
+        else:
+            conn.execute("DELETE FROM responses")
+            conn.execute("DELETE FROM cache_stats")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Helix response cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="Hit/miss counts and ratios per endpoint")
+    p = sub.add_parser("clear", help="Drop cached responses")
+    p.add_argument("--endpoint", help="Only this endpoint (users, videos, streams)")
+    args = parser.parse_args(argv)
+
+    if args.command == "clear":
+        clear(args.endpoint)
+        return
+    counts, entries = stats()
+    ratios = hit_ratios(counts)
+    outcomes = ("hit", "coalesced", "revalidated", "miss", "bypass")
+    print(f"{'endpoint':<10} {'entries':>8} " + " ".join(f"{o:>11}" for o in outcomes))
+    for endpoint in sorted({e for e, _ in counts} | set(entries)):
+        row = " ".join(f"{counts[(endpoint, o)]:>11}" for o in outcomes)
+        ratio = ratios.get(endpoint)
+        print(
+            f"{endpoint:<10} {entries.get(endpoint, 0):>8} {row}"
+            + (f"   {ratio:.1%} served from cache" if ratio is not None else "")
+        )
+
+
+if __name__ == "__main__":
+    main()
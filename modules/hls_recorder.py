@@ -0,0 +1,400 @@
+"""
+In-process HLS recorder, an alternative to running streamlink per channel.
+
+Polls the media playlist, fetches new segments concurrently over one pooled
+aiohttp session and appends them to the output file in playlist order. Every
+written segment and every hole in the recording goes to a JSON-lines sidecar
+next to the video (videos/live.index.jsonl):
+
+    {"seq": 812, "offset": 1503232, "size": 1501560, "duration": 2.0}
+    {"seq": 813, ..., "discontinuity": true}
+    {"gap": "window", "from_seq": 814, "to_seq": 820, "seconds": 14.0}
+
+Gap kinds: "window" (segments left the playlist before they were seen, e.g.
+after a stalled poll), "missed" (fetch failed after retries), "ad" (skipped
+Twitch ad segments).
+
+Enabled with RECORDER=native; record_live() then returns a NativeRecording
+with the same wait/poll/terminate interface as the streamlink Popen. Without
+TWITCH_HLS_BASE, streamlink is still used once to resolve the playlist URL
+(`--stream-url`), but no longer copies the video.
+
+    python -m modules.hls_recorder <channel|playlist url> <out.ts>
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import threading
+import subprocess
+from urllib.parse import urljoin
+
+logger = logging.getLogger(__name__)
+
+CONCURRENCY = int(os.getenv("HLS_CONCURRENCY", "4"))
+SEGMENT_RETRIES = 3
+# Give up once the playlist has been unavailable this long (stream ended).
+OFFLINE_TIMEOUT = float(os.getenv("HLS_OFFLINE_TIMEOUT", "30"))
+
+
+def parse_playlist(text, base_url):
+    """
+    (media sequence info, segments, variants). A master playlist has no
+    segments and its variants as [(bandwidth, url)].
+    """
+    info = {"target_duration": None, "ended": False}
+    segments = []
+    variants = []
+    seq = 0
+    duration = None
+    title = ""
+    discontinuity = False
+    bandwidth = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            seq = int(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-TARGETDURATION:"):
+            info["target_duration"] = float(line.split(":", 1)[1])
+        elif line.startswith("#EXTINF:"):
+            duration, _, title = line[8:].partition(",")
+            duration = float(duration)
+        elif line == "#EXT-X-DISCONTINUITY":
+            discontinuity = True
+        elif line == "#EXT-X-ENDLIST":
+            info["ended"] = True
+        elif line.startswith("#EXT-X-STREAM-INF:"):
+            bandwidth = 0
+            for attr in line.split(":", 1)[1].split(","):
+                if attr.startswith("BANDWIDTH="):
+                    bandwidth = int(attr.split("=", 1)[1])
+        elif not line.startswith("#"):
+            url = urljoin(base_url, line)
+            if bandwidth is not None:
+                variants.append((bandwidth, url))
+                bandwidth = None
+                continue
+            segments.append(
+                {
+                    "seq": seq,
+                    "url": url,
+                    "duration": duration or 0.0,
+                    "title": title,
+                    "discontinuity": discontinuity,
+                }
+            )
+            seq += 1
+            duration = None
+            title = ""
+            discontinuity = False
+    return info, segments, variants
+
+
+def _is_ad(segment):
+    # Twitch marks stitched ads with a non-"live" EXTINF title ("Amazon|...").
+    return segment["title"].startswith("Amazon")
+
+
+def playlist_url(channel_name):
+    hls_base = os.getenv("TWITCH_HLS_BASE", "").rstrip("/")
+    if hls_base:
+        return f"{hls_base}/{channel_name}/index.m3u8"
+    from .token_manager import current_access_token
+
+    env = os.environ.copy()
+    env["TWITCH_OAUTH_TOKEN"] = current_access_token() or ""
+    out = subprocess.run(
+        ["streamlink", "--stream-url", f"twitch.tv/{channel_name}", "best"],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    return out.stdout.strip()
+
+
+class HlsRecorder:
+    def __init__(self, url, out_path, index_path=None, concurrency=CONCURRENCY):
+        self.url = url
+        self.out_path = out_path
+        self.index_path = index_path or os.path.splitext(out_path)[0] + ".index.jsonl"
+        self.concurrency = concurrency
+        self.stop_event = asyncio.Event()
+        # Set in run() once aiohttp is imported; ServerDisconnectedError,
+        # ClientPayloadError etc. are not OSErrors.
+        self.fetch_errors = (OSError, asyncio.TimeoutError)
+        self.stats = {
+            "segments": 0,
+            "bytes": 0,
+            "seconds": 0.0,
+            "discontinuities": 0,
+            "retries": 0,
+            "gaps": 0,
+            "gap_seconds": 0.0,
+            "playlist_polls": 0,
+        }
+
+    async def _get(self, session, url):
+        async with session.get(url) as resp:
+            if resp.status != 200:
+                raise OSError(f"HTTP {resp.status} for {url}")
+            return await resp.read()
+
+    async def _fetch_segment(self, session, semaphore, segment):
+        async with semaphore:
+            for attempt in range(SEGMENT_RETRIES):
+                try:
+                    return await self._get(session, segment["url"])
+                except self.fetch_errors as e:
+                    logger.debug(f"Segment {segment['seq']} attempt {attempt + 1}: {e}")
+                    if attempt + 1 < SEGMENT_RETRIES:
+                        self.stats["retries"] += 1
+                        await asyncio.sleep(0.5 * (attempt + 1))
+            return None
+
+    async def _resolve(self, session):
+        """Follow a master playlist to its highest-bandwidth variant."""
+        text = (await self._get(session, self.url)).decode()
+        _, _, variants = parse_playlist(text, self.url)
+        if variants:
+            self.url = max(variants)[1]
+            logger.info(f"Recording variant {self.url}")
+
+    def _gap(self, index, kind, from_seq, to_seq, seconds):
+        self.stats["gaps"] += 1
+        self.stats["gap_seconds"] += seconds
+        entry = {"gap": kind, "from_seq": from_seq, "to_seq": to_seq}
+        entry["seconds"] = round(seconds, 3)
+        index.write(json.dumps(entry) + "\n")
+        logger.warning(
+            f"HLS gap ({kind}) seq {from_seq}-{to_seq}, ~{seconds:.1f}s lost: {self.out_path}"
+        )
+
+    async def _writer(self, queue):
+        """Append fetched segments in playlist order and index them."""
+        with open(self.out_path, "ab") as out, open(
+            self.index_path, "a", encoding="utf-8"
+        ) as index:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                if item[0] == "gap":
+                    self._gap(index, *item[1:])
+                    continue
+                segment, task = item[1], item[2]
+                try:
+                    data = await task
+                except Exception as e:
+                    logger.warning(f"Segment {segment['seq']} failed: {e!r}")
+                    data = None
+                if data is None:
+                    self._gap(
+                        index,
+                        "missed",
+                        segment["seq"],
+                        segment["seq"],
+                        segment["duration"],
+                    )
+                    continue
+                entry = {
+                    "seq": segment["seq"],
+                    "offset": out.tell(),
+                    "size": len(data),
+                    "duration": segment["duration"],
+                }
+                if segment["discontinuity"]:
+                    entry["discontinuity"] = True
+                    self.stats["discontinuities"] += 1
+                out.write(data)
+                out.flush()
+                index.write(json.dumps(entry) + "\n")
+                self.stats["segments"] += 1
+                self.stats["bytes"] += len(data)
+                self.stats["seconds"] += segment["duration"]
+
+    async def run(self):
+        import aiohttp
+
+        self.fetch_errors = (OSError, asyncio.TimeoutError, aiohttp.ClientError)
+        os.makedirs(os.path.dirname(os.path.abspath(self.out_path)), exist_ok=True)
+        timeout = aiohttp.ClientTimeout(total=30, sock_connect=10)
+        connector = aiohttp.TCPConnector(limit=self.concurrency + 1)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # Bounded so a slow disk holds up fetching instead of buffering the stream.
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        started = time.monotonic()
+        async with aiohttp.ClientSession(
+            timeout=timeout, connector=connector
+        ) as session:
+            writer = asyncio.create_task(self._writer(queue))
+            try:
+                await self._poll(session, semaphore, queue, writer)
+            finally:
+                if writer.done():
+                    # The writer died: drop queued fetches; awaiting it re-raises.
+                    while not queue.empty():
+                        item = queue.get_nowait()
+                        if item[0] == "segment":
+                            item[2].cancel()
+                else:
+                    await queue.put(None)
+                await writer
+        self.stats["wall_seconds"] = time.monotonic() - started
+        logger.info(
+            f"HLS recording finished: {self.stats['segments']} segments, "
+            f"{self.stats['bytes'] / 1024**2:.1f} MiB, {self.stats['seconds']:.0f}s of "
+            f"video, {self.stats['gaps']} gaps ({self.stats['gap_seconds']:.1f}s), "
+            f"{self.stats['retries']} retries -> {self.out_path}"
+        )
+        return self.stats
+
+    async def _put(self, queue, item, writer):
+        """queue.put() that gives up (returns False) if the writer has died."""
+        put = asyncio.ensure_future(queue.put(item))
+        await asyncio.wait({put, writer}, return_when=asyncio.FIRST_COMPLETED)
+        if put.done():
+            return True
+        put.cancel()
+        return False
+
+    async def _poll(self, session, semaphore, queue, writer):
+        next_seq = None
+        failing_since = None
+        try:
+            await self._resolve(session)
+        except self.fetch_errors as e:
+            logger.warning(f"Could not load playlist {self.url}: {e}")
+        while not self.stop_event.is_set() and not writer.done():
+            interval = 2.0
+            try:
+                text = (await self._get(session, self.url)).decode()
+                failing_since = None
+            except self.fetch_errors as e:
+                now = time.monotonic()
+                failing_since = failing_since or now
+                if now - failing_since >= OFFLINE_TIMEOUT:
+                    logger.info(f"Playlist unavailable for {OFFLINE_TIMEOUT:.0f}s: {e}")
+                    return
+                text = None
+            if text is not None:
+                self.stats["playlist_polls"] += 1
+                info, segments, _ = parse_playlist(text, self.url)
+                if info["target_duration"]:
+                    interval = max(info["target_duration"] / 2, 0.5)
+                if segments and next_seq is not None and segments[0]["seq"] > next_seq:
+                    missing = segments[0]["seq"] - next_seq
+                    gap = (
+                        "gap",
+                        "window",
+                        next_seq,
+                        segments[0]["seq"] - 1,
+                        missing * (info["target_duration"] or 0),
+                    )
+                    if not await self._put(queue, gap, writer):
+                        return
+                for segment in segments:
+                    if next_seq is not None and segment["seq"] < next_seq:
+                        continue
+                    next_seq = segment["seq"] + 1
+                    if _is_ad(segment):
+                        gap = (
+                            "gap",
+                            "ad",
+                            segment["seq"],
+                            segment["seq"],
+                            segment["duration"],
+                        )
+                        if not await self._put(queue, gap, writer):
+                            return
+                        continue
+                    task = asyncio.create_task(
+                        self._fetch_segment(session, semaphore, segment)
+                    )
+                    if not await self._put(queue, ("segment", segment, task), writer):
+                        task.cancel()
+                        return
+                if info["ended"]:
+                    return
+            try:
+                await asyncio.wait_for(self.stop_event.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+class NativeRecording:
+    """HlsRecorder on its own thread and event loop, used like a Popen."""
+
+    def __init__(self, url, out_path):
+        self.recorder = None
+        self.loop = None
+        self.returncode = None
+        self.pid = os.getpid()
+        self._started = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, args=(url, out_path), name="hls-recorder", daemon=True
+        )
+        self.thread.start()
+        self._started.wait()
+
+    def _run(self, url, out_path):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.recorder = HlsRecorder(url, out_path)
+            self._started.set()
+            self.loop.run_until_complete(self.recorder.run())
+            self.returncode = 0
+        except Exception:
+            logger.exception(f"HLS recorder failed for {out_path}")
+            self.returncode = 1
+        finally:
+            self._started.set()
+            self.loop.close()
+
+    def poll(self):
+        return None if self.thread.is_alive() else self.returncode
+
+    def wait(self, timeout=None):
+        self.thread.join(timeout)
+        return self.poll()
+
+    def terminate(self):
+        if self.recorder and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.recorder.stop_event.set)
+
+    kill = terminate
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record an HLS stream natively")
+    parser.add_argument("source", help="Channel name or media/master playlist URL")
+    parser.add_argument("out", help="Output .ts file (index written alongside)")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    url = args.source if "://" in args.source else playlist_url(args.source)
+    recorder = HlsRecorder(url, args.out, concurrency=args.concurrency)
+    cpu0 = time.process_time()
+    try:
+        stats = asyncio.run(recorder.run())
+    except KeyboardInterrupt:
+        stats = recorder.stats
+    import resource
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    stats["cpu_seconds"] = round(time.process_time() - cpu0, 3)
+    stats["max_rss_mib"] = round(usage.ru_maxrss / 1024, 1)
+    json.dump(stats, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""
+Re-verify stored SHA-256 hashes across the archive.
+
+Checked files: every videos/vod.mp4 against the vod_sha256 in its
+metadata.json, and every blob under blobs/sha256/ against its own name.
+Results go to the integrity table of the metadata DB; each run is logged in
+integrity_runs.
+
+A file is hashed when it is new, its size or mtime changed since it was last
+verified, or its last verification is older than the window (default
+VERIFY_WINDOW_DAYS=30). Stale files are taken oldest first, up to a per-run
+byte budget of 1/window of the archive, so a daily run spreads a full
+re-verification over the window instead of re-reading everything at once.
+
+Hashing runs in a process pool with large sequential reads. Total read
+throughput is capped (VERIFY_MAX_MBPS MiB/s, default 200, split evenly across
+the workers) so a verify pass does not starve a live recording of disk
+bandwidth, and pages read are dropped from the page cache afterwards.
+
+    python -m modules.integrity verify [--workers 4] [--max-mbps 200] [--all]
+    python -m modules.integrity report
+"""
+
+import os
+import time
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .db_utils import get_connection
+from .blob_store import BLOB_DIR
+from .catalog import PERSONS_DIR, iter_stream_folders
+from .file_utils import read_json
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 8 * 1024 * 1024
+
+
+def init_integrity_db():
+    with get_connection() as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS integrity (
+                path TEXT PRIMARY KEY,
+                expected_sha256 TEXT,
+                actual_sha256 TEXT,
+                size INTEGER,
+                mtime REAL,
+                status TEXT,
+                verified_at REAL,
+                error TEXT
+            )
+        """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_integrity_status ON integrity (status)"
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS integrity_runs (
+                started_at REAL,
+                seconds REAL,
+                files INTEGER,
+                bytes INTEGER,
+                gb_per_s REAL,
+                mismatches INTEGER,
+                missing INTEGER,
+                errors INTEGER
+            )
+        """
+        )
+        conn.commit()
+
+
+def expected_hashes(persons_dir=PERSONS_DIR, blob_dir=BLOB_DIR):
+    """{path: expected sha256} for every file with a recorded hash."""
+    expected = {}
+    for _channel, folder in iter_stream_folders(persons_dir):
+        sha = read_json(os.path.join(folder, "metadata.json")).get("vod_sha256")
+        if sha:
+            expected[os.path.join(folder, "videos", "vod.mp4")] = sha
+    for dirpath, _dirs, names in os.walk(blob_dir):
+        for name in names:
+            sha = name.split(".", 1)[0]
+            if len(sha) == 64 and not name.startswith("."):
+                expected[os.path.join(dirpath, name)] = sha
+    return expected
+
+
+def _worker_init():
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+
+
+def hash_file(path, max_bytes_per_second=None):
+    """Process-pool worker: (path, sha256, bytes, seconds)."""
+    sha = hashlib.sha256()
+    buf = bytearray(READ_SIZE)
+    view = memoryview(buf)
+    done = 0
+    t0 = time.monotonic()
+    with open(path, "rb", buffering=0) as f:
+        fd = f.fileno()
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            sha.update(view[:n])
+            if hasattr(os, "posix_fadvise"):
+                # Don't push a live recording's pages out of the cache.
+                os.posix_fadvise(fd, done, n, os.POSIX_FADV_DONTNEED)
+            done += n
+            if max_bytes_per_second:
+                ahead = done / max_bytes_per_second - (time.monotonic() - t0)
+                if ahead > 0:
+                    time.sleep(ahead)
+    return path, sha.hexdigest(), done, time.monotonic() - t0
+
+
+def plan(expected, known, window_days, budget_bytes=None, verify_all=False):
+    """
+    Paths to hash this run: new/changed files first, then stale ones oldest
+    first until budget_bytes. Also returns the missing paths.
+    """
+    now = time.time()
+    window = window_days * 86400
+    changed, stale, missing = [], [], []
+    total_bytes = 0
+    for path in expected:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            missing.append(path)
+            continue
+        total_bytes += st.st_size
+        row = known.get(path)
+        if verify_all or row is None or (row[0], row[1]) != (st.st_size, st.st_mtime):
+            changed.append((path, st.st_size))
+        elif now - (row[2] or 0) >= window:
+            stale.append((row[2] or 0, path, st.st_size))
+
+    if budget_bytes is None:
+        budget_bytes = total_bytes / max(window_days, 1)
+    todo = list(changed)
+    spent = 0
+    for _verified_at, path, size in sorted(stale):
+        if spent >= budget_bytes:
+            break
+        todo.append((path, size))
+        spent += size
+    return todo, missing, total_bytes
+
+
+def verify(
+    workers=4,
+    max_mbps=None,
+    window_days=None,
+    budget_gb=None,
+    verify_all=False,
+    persons_dir=PERSONS_DIR,
+    blob_dir=BLOB_DIR,
+):
+    """Verify due files; returns the run stats (also stored in integrity_runs)."""
+    init_integrity_db()
+    if max_mbps is None:
+        max_mbps = float(os.getenv("VERIFY_MAX_MBPS", "200"))
+    if window_days is None:
+        window_days = float(os.getenv("VERIFY_WINDOW_DAYS", "30"))
+    expected = expected_hashes(persons_dir, blob_dir)
+    with get_connection() as conn:
+        known = {
+            path: (size, mtime, verified_at)
+            for path, size, mtime, verified_at in conn.execute(
+                "SELECT path, size, mtime, verified_at FROM integrity WHERE status = 'ok'"
+            )
+        }
+
+    # Hardlinked files (VODs in the blob store) are read once.
+    by_inode = {}
+    todo, missing, total_bytes = plan(
+        expected,
+        known,
+        window_days,
+        budget_bytes=budget_gb * 1024**3 if budget_gb is not None else None,
+        verify_all=verify_all,
+    )
+    for path, size in todo:
+        st = os.stat(path)
+        by_inode.setdefault((st.st_dev, st.st_ino), []).append(path)
+
+    stats = {
+        "started_at": time.time(),
+        "files": 0,
+        "bytes": 0,
+        "mismatches": 0,
+        "missing": len(missing),
+        "errors": 0,
+        "archive_bytes": total_bytes,
+    }
+    per_worker = max_mbps * 1024**2 / workers if max_mbps else None
+    t0 = time.monotonic()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_worker_init) as pool:
+        futures = {
+            pool.submit(hash_file, paths[0], per_worker): paths
+            for paths in by_inode.values()
+        }
+        for future in as_completed(futures):
+            paths = futures[future]
+            now = time.time()
+            try:
+                _, actual, size, _seconds = future.result()
+            except OSError as e:
+                stats["errors"] += len(paths)
+                for path in paths:
+                    logger.error(f"Could not verify {path}: {e}")
+                    results.append(
+                        (path, expected[path], None, None, None, "error", now, str(e))
+                    )
+                continue
+            stats["bytes"] += size
+            for path in paths:
+                st = os.stat(path)
+                status = "ok" if actual == expected[path] else "mismatch"
+                if status == "mismatch":
+                    stats["mismatches"] += 1
+                    logger.error(
+                        f"SHA-256 mismatch: {path} is {actual}, expected {expected[path]}"
+                    )
+                stats["files"] += 1
+                results.append(
+                    (
+                        path,
+                        expected[path],
+                        actual,
+                        st.st_size,
+                        st.st_mtime,
+                        status,
+                        now,
+                        None,
+                    )
+                )
+    stats["seconds"] = time.monotonic() - t0
+    stats["gb_per_s"] = stats["bytes"] / 1e9 / max(stats["seconds"], 1e-9)
+
+    for path in missing:
+        logger.error(f"Missing file with recorded hash: {path}")
+        results.append(
+            (path, expected[path], None, None, None, "missing", time.time(), None)
+        )
+    with get_connection() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO integrity VALUES (?, ?, ?, ?, ?, ?, ?, ?)", results
+        )
+        conn.execute(
+            "INSERT INTO integrity_runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                stats["started_at"],
+                stats["seconds"],
+                stats["files"],
+                stats["bytes"],
+                stats["gb_per_s"],
+                stats["mismatches"],
+                stats["missing"],
+                stats["errors"],
+            ),
+        )
+        conn.commit()
+
+    logger.info(
+        f"Verified {stats['files']} files ({stats['bytes'] / 1024**3:.2f} GiB of "
+        f"{total_bytes / 1024**3:.2f} GiB) in {stats['seconds']:.1f}s, "
+        f"{stats['gb_per_s']:.2f} GB/s; {stats['mismatches']} mismatches, "
+        f"{stats['missing']} missing, {stats['errors']} errors"
+    )
+    return stats
+
+
+def report():
+    init_integrity_db()
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT status, path, expected_sha256, actual_sha256, verified_at "
+            "FROM integrity WHERE status != 'ok' ORDER BY verified_at DESC"
+        ).fetchall()
+        counts = dict(
+            conn.execute("SELECT status, COUNT(*) FROM integrity GROUP BY status")
+        )
+    return counts, rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive integrity verifier")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("verify", help="Hash files that are due")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--max-mbps", type=float, help="Read cap in MiB/s, 0 = none")
+    p.add_argument("--window-days", type=float)
+    p.add_argument("--budget-gb", type=float, help="Stale bytes to re-verify this run")
+    p.add_argument("--all", action="store_true", help="Verify everything now")
+    sub.add_parser("report", help="List mismatched, missing and unreadable files")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command == "verify":
+        stats = verify(
+            workers=args.workers,
+            max_mbps=args.max_mbps,
+            window_days=args.window_days,
+            budget_gb=args.budget_gb,
+            verify_all=args.all,
+        )
+        return 1 if stats["mismatches"] or stats["missing"] or stats["errors"] else 0
+    counts, rows = report()
+    print(", ".join(f"{status}: {n}" for status, n in sorted(counts.items())))
+    for status, path, expected, actual, verified_at in rows:
+        print(f"{status:<9} {path}")
+        if actual:
+            print(f"          expected {expected}\n          actual   {actual}")
+    return 1 if rows else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
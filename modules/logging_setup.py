@@ -1,6 +1,174 @@
+"""
+Logging for the archiver's entry points.
+
+configure_logger() puts a QueueHandler on the script's logger (and, for the
+first script configured in a process, on the "modules" package logger), so
+logging calls on hot paths - the asyncio chat loop, yt-dlp/streamlink output
+readers - only enqueue the record. A QueueListener thread formats it and
+writes the console and the file.
+
+Environment:
+    LOG_ROTATE        size (default) | time | none
+    LOG_ROTATE_MB     size-based rotation threshold (and for LOG_COMPRESSED)
+    LOG_ROTATE_HOURS  time-based rotation interval (and for LOG_COMPRESSED)
+    LOG_BACKUPS       rotated files to keep (default 5)
+    LOG_COMPRESSED=1  seekable .gz archives instead (see seekable_archive.py)
+    LOG_FORMAT=json   JSON lines in the log file (console stays text)
+    LOG_SAMPLE        DEBUG sampling per logger, e.g.
+                      "modules.video_utils=20/s,twitchio=0.1": at most 20
+                      records per second, or keep one record in ten
+"""
+
 import os
+import json
+import time
+import queue
+import atexit
 import logging
+import threading
+from datetime import datetime
 from logging import FileHandler, StreamHandler, Formatter
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
+
+from .seekable_archive import SeekableArchiveHandler
+
+# LOG_COMPRESSED=1 writes logs as seekable .gz archives (see seekable_archive.py)
+# rotated every LOG_ROTATE_MB megabytes / LOG_ROTATE_HOURS hours.
+LOG_ROTATE_MB = float(os.getenv("LOG_ROTATE_MB", "64"))
+LOG_ROTATE_HOURS = float(os.getenv("LOG_ROTATE_HOURS", "24"))
+DEFAULT_LOG_SAMPLE = "modules.video_utils=20/s"
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(name)s - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_listeners = []
+_modules_routed = False
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(Formatter):
+    """One JSON object per line; extra= fields are included as keys."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = value if _jsonable(value) else repr(value)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def _jsonable(value):
+    return isinstance(value, (str, int, float, bool, type(None), list, dict))
+
+
+class DebugSampler(logging.Filter):
+    """
+    Thins out DEBUG records of noisy loggers before they are queued. Rules map
+    a logger name (and its children) to either a rate limit ("20/s") or the
+    fraction of records to keep ("0.1", deterministic: every 10th).
+    """
+
+    def __init__(self, spec):
+        super().__init__()
+        self.rules = parse_sample_spec(spec)
+        self.dropped = {}
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def _rule(self, name):
+        while name:
+            if name in self.rules:
+                return name
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or not self.rules:
+            return True
+        key = self._rule(record.name)
+        if key is None:
+            return True
+        kind, value = self.rules[key]
+        with self._lock:
+            if kind == "rate":
+                now = time.monotonic()
+                window, count = self._state.get(key, (now, 0))
+                if now - window >= 1.0:
+                    window, count = now, 0
+                keep = count < value
+                self._state[key] = (window, count + 1)
+            else:
+                count = self._state.get(key, 0)
+                keep = count % value == 0
+                self._state[key] = count + 1
+            if not keep:
+                self.dropped[key] = self.dropped.get(key, 0) + 1
+        return keep
+
+
+def parse_sample_spec(spec):
+    """'a=20/s,b=0.1' -> {"a": ("rate", 20.0), "b": ("every", 10)}"""
+    rules = {}
+    for part in (spec or "").split(","):
+        if "=" not in part:
+            continue
+        name, value = (s.strip() for s in part.split("=", 1))
+        try:
+            if value.endswith("/s"):
+                rules[name] = ("rate", float(value[:-2]))
+            elif float(value) <= 0:
+                rules[name] = ("rate", 0)
+            else:
+                rules[name] = ("every", max(1, round(1 / float(value))))
+        except ValueError:
+            logging.getLogger(__name__).warning(f"Ignoring LOG_SAMPLE rule {part!r}")
+    return rules
+
+
+def _file_handler(file_path, compressed):
+    rotate_mb = float(os.getenv("LOG_ROTATE_MB", LOG_ROTATE_MB))
+    rotate_hours = float(os.getenv("LOG_ROTATE_HOURS", LOG_ROTATE_HOURS))
+    if compressed:
+        return SeekableArchiveHandler(
+            file_path,
+            rotate_bytes=int(rotate_mb * 1024 * 1024),
+            rotate_seconds=rotate_hours * 3600,
+        )
+    mode = os.getenv("LOG_ROTATE", "size").lower()
+    backups = int(os.getenv("LOG_BACKUPS", "5"))
+    if mode == "time":
+        return TimedRotatingFileHandler(
+            file_path,
+            when="S",
+            interval=max(1, int(rotate_hours * 3600)),
+            backupCount=backups,
+            encoding="utf-8",
+        )
+    if mode == "size":
+        return RotatingFileHandler(
+            file_path,
+            maxBytes=int(rotate_mb * 1024 * 1024),
+            backupCount=backups,
+            encoding="utf-8",
+        )
+    return FileHandler(file_path, mode="a", encoding="utf-8")
 
 
 def configure_logger(
@@ -8,30 +176,80 @@ def configure_logger(
     log_file_name: str,
     console_level=logging.INFO,
     file_level=logging.DEBUG,
+    compressed=None,
 ) -> logging.Logger:
+    global _modules_routed
+
     logger = logging.getLogger(logger_name)
     logger.setLevel(logging.DEBUG)
+    if any(isinstance(h, QueueHandler) for h in logger.handlers):
+        return logger
 
     log_dir = os.path.join(os.path.dirname(__file__), "..", "logs")
     os.makedirs(log_dir, exist_ok=True)
 
     file_path = os.path.join(log_dir, log_file_name)
 
-    fh = FileHandler(file_path, mode="a", encoding="utf-8")
+    if compressed is None:
+        compressed = os.getenv("LOG_COMPRESSED", "").lower() in ("1", "true", "yes")
+    fh = _file_handler(file_path, compressed)
     fh.setLevel(file_level)
 
     ch = StreamHandler()
     ch.setLevel(console_level)
-
-    formatter = Formatter(
-        fmt="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
+    # Library DEBUG output (e.g. yt-dlp lines) only goes to the file.
+    ch.addFilter(
+        lambda r: r.levelno >= logging.INFO or not r.name.startswith("modules.")
     )
-    fh.setFormatter(formatter)
+
+    formatter = Formatter(fmt=TEXT_FORMAT, datefmt=DATE_FORMAT)
+    if os.getenv("LOG_FORMAT", "").lower() == "json":
+        fh.setFormatter(JsonFormatter())
+    else:
+        fh.setFormatter(formatter)
     ch.setFormatter(formatter)
 
-    if not logger.handlers:
-        logger.addHandler(fh)
-        logger.addHandler(ch)
+    qh = QueueHandler(queue.SimpleQueue())
+    qh.addFilter(DebugSampler(os.getenv("LOG_SAMPLE", DEFAULT_LOG_SAMPLE)))
+    listener = QueueListener(qh.queue, fh, ch, respect_handler_level=True)
+    listener.start()
+    loggers = [logger]
+
+    # Library modules log under "modules.*"; the first script to configure
+    # logging in a process receives them.
+    if not _modules_routed:
+        modules_logger = logging.getLogger("modules")
+        modules_logger.setLevel(logging.DEBUG)
+        loggers.append(modules_logger)
+        _modules_routed = True
+    for target in loggers:
+        target.addHandler(qh)
+    _listeners.append((listener, qh, loggers))
 
     return logger
+
+
+@atexit.register
+def shutdown_logging():
+    """Drain the queues and close the files (also runs at exit)."""
+    global _modules_routed
+
+    while _listeners:
+        listener, qh, loggers = _listeners.pop()
+        for target in loggers:
+            target.removeHandler(qh)
+        listener.stop()
+        for sampler in qh.filters:
+            for name, count in getattr(sampler, "dropped", {}).items():
+                record = logging.makeLogRecord(
+                    {
+                        "name": __name__,
+                        "levelno": logging.INFO,
+                        "levelname": "INFO",
+                        "msg": f"LOG_SAMPLE dropped {count} DEBUG records from {name}",
+                    }
+                )
+                listener.handlers[0].handle(record)
+        for handler in listener.handlers:
+            handler.close()
+    _modules_routed = False
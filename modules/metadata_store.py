@@ -0,0 +1,147 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+from .file_utils import atomic_write_json, read_json
+
+logger = logging.getLogger(__name__)
+
+DEBOUNCE_SECONDS = 2.0
+# Older metadata.json files kept the folded sequence number in the document.
+LEGACY_SEQ_KEY = "_events_applied"
+
+
+class MetadataStore:
+    """
+    metadata.json with atomic, debounced writes.
+
+    update()/set() change the in-memory document and schedule one atomic
+    rewrite (temp file + fsync + rename) debounce_seconds later, so a burst of
+    updates costs a single write. append_event() records list entries such as
+    title_changes by appending one line to metadata.events.jsonl instead of
+    rewriting the document; events are folded into metadata.json on the next
+    rewrite. Each event carries a sequence number. Before a rewrite that
+    folds events in, metadata.events.state records the last sequence number
+    and the SHA-256 of the document about to be written; events up to that
+    number are only skipped on replay if metadata.json is that document, so a
+    crash anywhere between the files neither loses nor repeats an event.
+    """
+
+    def __init__(self, path, initial=None, debounce_seconds=DEBOUNCE_SECONDS):
+        self.path = path
+        self.events_path = os.path.splitext(path)[0] + ".events.jsonl"
+        self.state_path = os.path.splitext(path)[0] + ".events.state"
+        self.debounce_seconds = debounce_seconds
+        self._lock = threading.RLock()
+        self._timer = None
+        self._dirty = False
+
+        self.data = read_json(path)
+        state = read_json(self.state_path)
+        applied = self.data.pop(LEGACY_SEQ_KEY, None)
+        if applied is not None:
+            self._dirty = True
+        elif state.get("sha256") and state["sha256"] == _file_sha256(path):
+            applied = state["seq"]
+        if initial:
+            self.data.update(initial)
+        # Sequence numbers keep growing across runs, so the state stays valid.
+        self._seq = max(state.get("seq", 0), applied or 0)
+        self._replay_events(applied or 0)
+
+    def _replay_events(self, applied):
+        try:
+            with open(self.events_path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                # torn last line from a crash
+                break
+            self._seq = max(self._seq, event["seq"])
+            if event["seq"] <= applied:
+                continue
+            self.data.setdefault(event["key"], []).append(event["value"])
+            self._dirty = True
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self.data.get(key, default)
+
+    def __getitem__(self, key):
+        with self._lock:
+            return self.data[key]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.data
+
+    def set(self, key, value):
+        self.update({key: value})
+
+    def update(self, values):
+        with self._lock:
+            self.data.update(values)
+            self._mark_dirty()
+
+    def append_event(self, key, value):
+        """Append value to the list at key without rewriting metadata.json."""
+        with self._lock:
+            self._seq += 1
+            record = {"seq": self._seq, "key": key, "value": value}
+            os.makedirs(os.path.dirname(self.events_path), exist_ok=True)
+            with open(self.events_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.data.setdefault(key, []).append(value)
+
+    def _mark_dirty(self):
+        self._dirty = True
+        if self._timer is None:
+            self._timer = threading.Timer(self.debounce_seconds, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Write metadata.json now (folding in pending events)."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            has_events = os.path.exists(self.events_path)
+            if not self._dirty and not has_events:
+                return
+            if has_events:
+                # Same serialisation as atomic_write_json.
+                payload = json.dumps(self.data, indent=2).encode("utf-8")
+                atomic_write_json(
+                    self.state_path,
+                    {"seq": self._seq, "sha256": hashlib.sha256(payload).hexdigest()},
+                )
+            atomic_write_json(self.path, self.data)
+            if has_events:
+                os.remove(self.events_path)
+            self._dirty = False
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _file_sha256(path):
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
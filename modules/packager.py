@@ -0,0 +1,457 @@
+"""
+Package stream folders for long-term storage (e.g. Archive.org).
+
+Each stream folder (video, thumbnails, chat databases and logs,
+metadata.json) becomes one item, <channel>_<folder>, either
+
+    tar:     packages/<item>.tar, a PAX tar with <item>/<file> members;
+             <item>.tar.fingerprint records its member list so an
+             unchanged folder is not rewritten
+    upload:  one PUT per file into the item via Archive.org's S3-like API
+             (IA_S3_URL, IA_ACCESS_KEY/IA_SECRET_KEY), or the tar as a
+             single file with --tar
+
+File data is never copied through Python: tar members and upload bodies are
+written with sendfile (socket.sendfile falls back to send() on TLS). Every
+item gets a <item>_sha256.txt manifest (sha256sum format), built from the
+vod_sha256 in metadata.json and the hashes in the catalog and integrity
+tables; only files without a known hash for their current size/mtime are
+hashed. Folders are packaged in parallel; folders still being recorded are
+skipped.
+
+    python -m modules.packager tar [--out DIR] [--workers 4] [folder ...]
+    python -m modules.packager upload [--tar] [--workers 4] [folder ...]
+
+Point IA_S3_URL at twitch_standin.py (http://127.0.0.1:8710/ia) to test
+uploads offline.
+"""
+
+import os
+import re
+import time
+import errno
+import hashlib
+import sqlite3
+import tarfile
+import logging
+import argparse
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from .db_utils import BASE_DIR, DB_PATH
+from .catalog import CATALOG_PATH, PERSONS_DIR, iter_stream_folders, _rel
+from .file_utils import calculate_sha256, read_json
+
+logger = logging.getLogger(__name__)
+
+PACKAGE_DIR = os.path.join(BASE_DIR, "packages")
+SKIP_SUFFIXES = (".tmp", ".part", ".incomplete", ".lock")
+IDENTIFIER_RE = re.compile(r"[^A-Za-z0-9._-]")
+
+
+def item_identifier(channel_name, folder):
+    prefix = os.getenv("IA_ITEM_PREFIX", "")
+    name = f"{prefix}{channel_name}_{os.path.basename(folder.rstrip(os.sep))}"
+    return IDENTIFIER_RE.sub("_", name)[:100]
+
+
+def package_files(folder):
+    """[{"rel_path", "path", "size", "mtime"}] for the files of a stream folder."""
+    files = []
+    for root, dirs, names in os.walk(folder):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(names):
+            if name.startswith(".") or name.endswith(SKIP_SUFFIXES):
+                continue
+            if ".corrupt-" in name:
+                continue
+            path = os.path.join(root, name)
+            st = os.stat(path)
+            files.append(
+                {
+                    "rel_path": os.path.relpath(path, folder).replace(os.sep, "/"),
+                    "path": path,
+                    "size": st.st_size,
+                    "mtime": st.st_mtime,
+                }
+            )
+    return files
+
+
+def _stored_hashes(folder):
+    """{rel_path: (size, mtime, sha256)} from the catalog and integrity tables."""
+    known = {}
+    if os.path.exists(CATALOG_PATH):
+        conn = sqlite3.connect(f"file:{CATALOG_PATH}?mode=ro", uri=True)
+        try:
+            for rel_path, size, mtime, sha in conn.execute(
+                "SELECT rel_path, size, mtime, sha256 FROM files "
+                "WHERE folder = ? AND sha256 IS NOT NULL",
+                (_rel(folder),),
+            ):
+                known[rel_path] = (size, mtime, sha)
+        except sqlite3.Error:
+            pass
+        finally:
+            conn.close()
+    if os.path.exists(DB_PATH):
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+        prefix = os.path.join(folder, "")
+        try:
+            for path, size, mtime, sha in conn.execute(
+                "SELECT path, size, mtime, actual_sha256 FROM integrity "
+                "WHERE status = 'ok' AND substr(path, 1, ?) = ?",
+                (len(prefix), prefix),
+            ):
+                known[os.path.relpath(path, folder).replace(os.sep, "/")] = (
+                    size,
+                    mtime,
+                    sha,
+                )
+        except sqlite3.Error:
+            pass
+        finally:
+            conn.close()
+    return known
+
+
+def checksum_manifest(folder, files):
+    """
+    Fill in files[i]["sha256"]; returns (reused bytes, hashed bytes). vod.mp4
+    uses vod_sha256, other files a stored hash if size and mtime still match.
+    """
+    vod_sha256 = read_json(os.path.join(folder, "metadata.json")).get("vod_sha256")
+    known = _stored_hashes(folder)
+    reused = hashed = 0
+    for entry in files:
+        stored = known.get(entry["rel_path"])
+        if entry["rel_path"] == "videos/vod.mp4" and vod_sha256:
+            entry["sha256"] = vod_sha256
+        elif stored and (stored[0], stored[1]) == (entry["size"], entry["mtime"]):
+            entry["sha256"] = stored[2]
+        else:
+            entry["sha256"] = calculate_sha256(entry["path"])
+            hashed += entry["size"]
+            continue
+        reused += entry["size"]
+    return reused, hashed
+
+
+def manifest_bytes(files):
+    return "".join(f"{e['sha256']}  {e['rel_path']}\n" for e in files).encode()
+
+
+def tar_fingerprint(files, manifest):
+    """sha256 of the tar's member list (path, size, mtime) and manifest."""
+    h = hashlib.sha256(manifest)
+    for e in files:
+        h.update(f"{e['rel_path']}\0{e['size']}\0{int(e['mtime'])}\n".encode())
+    return h.hexdigest()
+
+
+class FileSink:
+    def __init__(self, f):
+        self.f = f
+        self.fd = f.fileno()
+
+    def write(self, data):
+        self.f.write(data)
+
+    def sendfile(self, path, size):
+        self.f.flush()
+        with open(path, "rb") as src:
+            offset = 0
+            try:
+                while offset < size:
+                    sent = os.sendfile(self.fd, src.fileno(), offset, size - offset)
+                    if sent == 0:
+                        raise OSError(f"{path} shrank while packaging")
+                    offset += sent
+            except OSError as e:
+                if offset or e.errno not in (
+                    errno.EINVAL,
+                    errno.ENOSYS,
+                    errno.EOPNOTSUPP,
+                ):
+                    raise
+                # sendfile between these files isn't supported here
+                self._copy(src, size)
+        self.f.seek(0, os.SEEK_END)
+
+    def _copy(self, src, size):
+        while size:
+            chunk = src.read(min(size, 1024 * 1024))
+            if not chunk:
+                raise OSError(f"{src.name} shrank while packaging")
+            self.f.write(chunk)
+            size -= len(chunk)
+
+
+class SocketSink:
+    def __init__(self, sock):
+        self.sock = sock
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+    def sendfile(self, path, size):
+        with open(path, "rb") as src:
+            if size and self.sock.sendfile(src, 0, size) != size:
+                raise OSError(f"{path} shrank while packaging")
+
+
+def tar_layout(item, files, manifest):
+    """([(header, entry or manifest bytes, padding)], total tar size)."""
+    parts = []
+    total = 0
+    # The manifest takes the newest file's mtime so the same folder always
+    # gives the same tar.
+    newest = max((e["mtime"] for e in files), default=0)
+    members = [(f"{item}_sha256.txt", manifest, len(manifest), newest)]
+    members += [(e["rel_path"], e, e["size"], e["mtime"]) for e in files]
+    for rel_path, payload, size, mtime in members:
+        info = tarfile.TarInfo(f"{item}/{rel_path}")
+        info.size = size
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        header = info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+        padding = -size % tarfile.BLOCKSIZE
+        parts.append((header, payload, padding))
+        total += len(header) + size + padding
+    total += 2 * tarfile.BLOCKSIZE
+    total += -total % tarfile.RECORDSIZE
+    return parts, total
+
+
+def write_tar(sink, parts, total):
+    written = 0
+    for header, payload, padding in parts:
+        sink.write(header)
+        if isinstance(payload, bytes):
+            sink.write(payload)
+            size = len(payload)
+        else:
+            sink.sendfile(payload["path"], payload["size"])
+            size = payload["size"]
+        sink.write(b"\0" * padding)
+        written += len(header) + size + padding
+    sink.write(b"\0" * (total - written))
+
+
+def _ia_headers(item, channel_name, folder, size_hint):
+    meta = read_json(os.path.join(folder, "metadata.json"))
+    headers = {
+        "authorization": f"LOW {os.getenv('IA_ACCESS_KEY', '')}:{os.getenv('IA_SECRET_KEY', '')}",
+        "x-amz-auto-make-bucket": "1",
+        "x-archive-size-hint": str(size_hint),
+        "x-archive-meta-mediatype": "movies",
+        "x-archive-meta-creator": channel_name,
+    }
+    if os.getenv("IA_COLLECTION"):
+        headers["x-archive-meta-collection"] = os.getenv("IA_COLLECTION")
+    if meta.get("title"):
+        headers["x-archive-meta-title"] = urllib.parse.quote(meta["title"])
+    start = meta.get("start_time") or meta.get("created_at")
+    if start:
+        headers["x-archive-meta-date"] = start[:10]
+    return headers
+
+
+def _put(item, name, headers, length, send_body):
+    base = os.getenv("IA_S3_URL", "https://s3.us.archive.org").rstrip("/")
+    url = urllib.parse.urlsplit(f"{base}/{item}/{urllib.parse.quote(name)}")
+    conn_cls = (
+        http.client.HTTPSConnection
+        if url.scheme == "https"
+        else http.client.HTTPConnection
+    )
+    conn = conn_cls(url.hostname, url.port, timeout=300)
+    try:
+        conn.putrequest("PUT", url.path, skip_accept_encoding=True)
+        for key, value in headers.items():
+            conn.putheader(key, value)
+        conn.putheader("Content-Length", str(length))
+        conn.endheaders()
+        send_body(SocketSink(conn.sock))
+        resp = conn.getresponse()
+        body = resp.read()
+        if resp.status >= 300:
+            raise OSError(
+                f"Upload of {item}/{name} failed: HTTP {resp.status} {body[:200]!r}"
+            )
+    finally:
+        conn.close()
+
+
+def package_folder(channel_name, folder, mode="tar", out_dir=PACKAGE_DIR, force=False):
+    """Package one stream folder; returns its stats."""
+    t0 = time.monotonic()
+    item = item_identifier(channel_name, folder)
+    files = package_files(folder)
+    reused, hashed = checksum_manifest(folder, files)
+    manifest = manifest_bytes(files)
+    stats = {
+        "item": item,
+        "files": len(files),
+        "bytes": sum(e["size"] for e in files),
+        "reused_hash_bytes": reused,
+        "hashed_bytes": hashed,
+        "skipped": False,
+    }
+
+    if mode == "tar" or mode == "upload-tar":
+        parts, total = tar_layout(item, files, manifest)
+        stats["bytes"] = total
+        if mode == "tar":
+            out_path = os.path.join(out_dir, f"{item}.tar")
+            stats["output"] = out_path
+            # Size alone is not enough: tar padding hides most size changes.
+            fingerprint_path = out_path + ".fingerprint"
+            fingerprint = tar_fingerprint(files, manifest)
+            if not force and os.path.exists(out_path):
+                try:
+                    with open(fingerprint_path) as f:
+                        current = f.read().strip() == fingerprint
+                except FileNotFoundError:
+                    current = False
+                if current and os.path.getsize(out_path) == total:
+                    stats["skipped"] = True
+                    return stats
+            os.makedirs(out_dir, exist_ok=True)
+            tmp_path = out_path + ".part"
+            with open(tmp_path, "wb") as f:
+                write_tar(FileSink(f), parts, total)
+            os.replace(tmp_path, out_path)
+            # Written after the tar, so a crash in between only forces a rewrite.
+            with open(fingerprint_path, "w") as f:
+                f.write(fingerprint + "\n")
+        else:
+            headers = _ia_headers(item, channel_name, folder, total)
+            headers["Content-Type"] = "application/x-tar"
+            _put(
+                item,
+                f"{item}.tar",
+                headers,
+                total,
+                lambda sink: write_tar(sink, parts, total),
+            )
+    else:
+        headers = _ia_headers(item, channel_name, folder, stats["bytes"])
+        _put(
+            item,
+            f"{item}_sha256.txt",
+            headers,
+            len(manifest),
+            lambda sink: sink.write(manifest),
+        )
+        # Item metadata is set by the first request; later ones only add files.
+        headers = {"authorization": headers["authorization"]}
+        for entry in files:
+            _put(
+                item,
+                entry["rel_path"],
+                headers,
+                entry["size"],
+                lambda sink, e=entry: sink.sendfile(e["path"], e["size"]),
+            )
+    stats["seconds"] = time.monotonic() - t0
+    return stats
+
+
+def recording_folders():
+    """Folders of live recordings that haven't finished yet."""
+    if not os.path.exists(DB_PATH):
+        return set()
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    try:
+        return {
+            os.path.abspath(row[0])
+            for row in conn.execute(
+                "SELECT folder_name FROM streams "
+                "WHERE source = 'live' AND end_time IS NULL AND folder_name IS NOT NULL"
+            )
+        }
+    except sqlite3.Error:
+        return set()
+    finally:
+        conn.close()
+
+
+def _channel_of(folder):
+    # persons/<channel>/twitch/livestreams/<folder>
+    return os.path.basename(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(folder))))
+    )
+
+
+def package_all(folders=None, mode="tar", out_dir=PACKAGE_DIR, workers=4, force=False):
+    """Package folders (default: all); returns (stats per item, failed folders)."""
+    if folders:
+        targets = [(_channel_of(f), os.path.abspath(f)) for f in folders]
+    else:
+        targets = list(iter_stream_folders(PERSONS_DIR))
+    busy = recording_folders()
+    results = []
+    failed = []
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for channel_name, folder in targets:
+            if os.path.abspath(folder) in busy:
+                logger.info(f"Skipping {folder}: still recording")
+                continue
+            future = pool.submit(
+                package_folder, channel_name, folder, mode, out_dir, force
+            )
+            futures[future] = folder
+        for future, folder in futures.items():
+            try:
+                stats = future.result()
+            except Exception as e:
+                logger.error(f"Packaging {folder} failed: {e}")
+                failed.append(folder)
+                continue
+            results.append(stats)
+            if not stats["skipped"]:
+                logger.info(
+                    f"Packaged {stats['item']}: {stats['files']} files, "
+                    f"{stats['bytes'] / 1024**2:.1f} MiB in {stats['seconds']:.1f}s "
+                    f"({stats['hashed_bytes'] / 1024**2:.1f} MiB hashed, "
+                    f"{stats['reused_hash_bytes'] / 1024**2:.1f} MiB of hashes reused)"
+                )
+    elapsed = time.monotonic() - t0
+    done = [s for s in results if not s["skipped"]]
+    total = sum(s["bytes"] for s in done)
+    logger.info(
+        f"{len(done)} items packaged, {len(results) - len(done)} up to date, "
+        f"{len(failed)} failed, {total / 1024**2:.1f} MiB in {elapsed:.1f}s "
+        f"({total / 1024**2 / max(elapsed, 1e-9):.1f} MiB/s)"
+    )
+    return results, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Package stream folders")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("tar", help="Write packages/<item>.tar per folder")
+    p.add_argument("--out", default=PACKAGE_DIR)
+    p.add_argument("--force", action="store_true", help="Rewrite existing tars")
+    p = sub.add_parser("upload", help="Upload items to IA_S3_URL")
+    p.add_argument("--tar", action="store_true", help="Upload one tar per item")
+    for p in sub.choices.values():
+        p.add_argument("folders", nargs="*", help="Default: every stream folder")
+        p.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command == "tar":
+        _, failed = package_all(args.folders, "tar", args.out, args.workers, args.force)
+    else:
+        mode = "upload-tar" if args.tar else "upload"
+        _, failed = package_all(args.folders, mode, workers=args.workers)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
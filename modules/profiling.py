@@ -0,0 +1,259 @@
+"""
+Opt-in profiling of the archiver's pipeline stages.
+
+    PROFILE=spans                     timing spans around the main stages
+    PROFILE=spans,cprofile,sample,tracemalloc   (or PROFILE=all)
+    python archiver.py --profile all vods
+
+Stages are marked with @profiled (or `with span("name"):`). When PROFILE is
+unset at import time @profiled returns the function unchanged, so there is
+no overhead at all; span() then costs one global lookup.
+
+At exit a report is written to logs/profile/<script>-<time>/:
+    summary.txt     per-stage calls, total/self time, mean and max
+    spans.folded    nested stages, self time in microseconds
+    cprofile.prof   (cprofile) pstats dump of the main thread; top 40 in summary
+    samples.folded  (sample) stacks of all threads every PROFILE_INTERVAL_MS
+    tracemalloc.txt (tracemalloc) top allocation sites by growth since start
+
+*.folded files are in the collapsed-stack format read by flamegraph.pl and
+speedscope.
+"""
+
+import os
+import sys
+import time
+import atexit
+import inspect
+import threading
+import functools
+import contextlib
+import contextvars
+from collections import Counter
+from datetime import datetime
+
+MODES = ("spans", "cprofile", "sample", "tracemalloc")
+PROFILE_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "logs", "profile")
+)
+
+
+def _modes(value):
+    modes = {m.strip().lower() for m in (value or "").split(",") if m.strip()}
+    if modes & {"1", "true", "yes", "on"}:
+        modes = {"spans"}
+    if "all" in modes:
+        modes = set(MODES)
+    if modes:
+        # Spans are always collected when profiling is on.
+        modes.add("spans")
+    return modes & set(MODES)
+
+
+ACTIVE = _modes(os.getenv("PROFILE"))
+
+_current = contextvars.ContextVar("profiling_span", default=None)
+_stats = {}
+_stats_lock = threading.Lock()
+_state = {"started": None, "cprofile": None, "sampler": None, "snapshot": None}
+
+
+class _Frame:
+    __slots__ = ("path", "child")
+
+    def __init__(self, path):
+        self.path = path
+        self.child = 0.0
+
+
+def _record(path, elapsed, self_time):
+    with _stats_lock:
+        entry = _stats.get(path)
+        if entry is None:
+            _stats[path] = [1, elapsed, self_time, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] += self_time
+            if elapsed > entry[3]:
+                entry[3] = elapsed
+
+
+@contextlib.contextmanager
+def _span(name):
+    parent = _current.get()
+    frame = _Frame(parent.path + (name,) if parent else (name,))
+    token = _current.set(frame)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        _current.reset(token)
+        if parent:
+            parent.child += elapsed
+        _record(frame.path, elapsed, elapsed - frame.child)
+
+
+def span(name):
+    """Context manager timing a block as stage `name` (no-op when off)."""
+    if not ACTIVE:
+        return contextlib.nullcontext()
+    return _span(name)
+
+
+def profiled(fn=None, *, name=None):
+    """Decorator timing every call of fn as a stage (identity when off)."""
+    if fn is None:
+        return functools.partial(profiled, name=name)
+    if not ACTIVE:
+        return fn
+    stage = name or fn.__qualname__
+    if inspect.iscoroutinefunction(fn):
+
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            with _span(stage):
+                return await fn(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _span(stage):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+class StackSampler(threading.Thread):
+    """Collects the stacks of all other threads every `interval` seconds."""
+
+    def __init__(self, interval):
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.interval = interval
+        self.samples = Counter()
+        self.stop_event = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}:"
+                        f"{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+
+def start():
+    """Start the profilers selected by PROFILE; the report is written at exit."""
+    if not ACTIVE or _state["started"]:
+        return
+    _state["started"] = time.perf_counter()
+    if "cprofile" in ACTIVE:
+        import cProfile
+
+        _state["cprofile"] = cProfile.Profile()
+        _state["cprofile"].enable()
+    if "sample" in ACTIVE:
+        interval = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+        _state["sampler"] = StackSampler(interval)
+        _state["sampler"].start()
+    if "tracemalloc" in ACTIVE:
+        import tracemalloc
+
+        tracemalloc.start(int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "1")))
+        _state["snapshot"] = tracemalloc.take_snapshot()
+    atexit.register(write_report)
+
+
+def summary_lines():
+    by_stage = {}
+    for path, (calls, total, self_time, longest) in _stats.items():
+        entry = by_stage.setdefault(path[-1], [0, 0.0, 0.0, 0.0])
+        entry[0] += calls
+        # Recursive stages would otherwise be counted twice.
+        if path[-1] not in path[:-1]:
+            entry[1] += total
+        entry[2] += self_time
+        entry[3] = max(entry[3], longest)
+    lines = [
+        f"{'stage':<40} {'calls':>8} {'total s':>10} {'self s':>10} "
+        f"{'mean ms':>10} {'max ms':>10}"
+    ]
+    for stage, (calls, total, self_time, longest) in sorted(
+        by_stage.items(), key=lambda kv: kv[1][1], reverse=True
+    ):
+        lines.append(
+            f"{stage:<40} {calls:>8} {total:>10.3f} {self_time:>10.3f} "
+            f"{total / calls * 1000:>10.2f} {longest * 1000:>10.2f}"
+        )
+    return lines
+
+
+def write_report(out_dir=None):
+    if not _state["started"]:
+        return None
+    wall = time.perf_counter() - _state["started"]
+    script = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+    out_dir = out_dir or os.path.join(
+        PROFILE_DIR, f"{script}-{datetime.now():%Y%m%dT%H%M%S}"
+    )
+    os.makedirs(out_dir, exist_ok=True)
+
+    lines = [f"wall time {wall:.3f}s, modes: {','.join(sorted(ACTIVE))}", ""]
+    lines += summary_lines()
+    with _stats_lock:
+        folded = [
+            f"{';'.join(path)} {int(self_time * 1e6)}"
+            for path, (_c, _t, self_time, _m) in sorted(_stats.items())
+        ]
+    with open(os.path.join(out_dir, "spans.folded"), "w", encoding="utf-8") as f:
+        f.write("\n".join(folded) + "\n")
+
+    if _state["cprofile"]:
+        import io
+        import pstats
+
+        profiler = _state["cprofile"]
+        profiler.disable()
+        profiler.dump_stats(os.path.join(out_dir, "cprofile.prof"))
+        buf = io.StringIO()
+        pstats.Stats(profiler, stream=buf).sort_stats("cumulative").print_stats(40)
+        lines += ["", "cProfile (main thread, by cumulative time):", buf.getvalue()]
+
+    if _state["sampler"]:
+        sampler = _state["sampler"]
+        sampler.stop_event.set()
+        sampler.join()
+        with open(os.path.join(out_dir, "samples.folded"), "w", encoding="utf-8") as f:
+            for stack, count in sampler.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+    if _state["snapshot"]:
+        import tracemalloc
+
+        stats = tracemalloc.take_snapshot().compare_to(_state["snapshot"], "lineno")
+        tracemalloc.stop()
+        with open(os.path.join(out_dir, "tracemalloc.txt"), "w", encoding="utf-8") as f:
+            for stat in stats[:50]:
+                f.write(f"{stat}\n")
+
+    with open(os.path.join(out_dir, "summary.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    _state["started"] = None
+    print("\n".join(summary_lines()), file=sys.stderr)
+    print(f"Profile written to {out_dir}", file=sys.stderr)
+    return out_dir
+
+
+start()
@@ -0,0 +1,235 @@
+"""
+Session journal for live recordings: <folder>/recording.journal.
+
+One JSON object per line, appended and fsynced as the recording goes:
+
+    {"event": "part_start", "part": 0, "file": "videos/live.mp4", "t": ...}
+    {"event": "part_end", "part": 0, "code": 1, "bytes": 81234944, "t": ...}
+    {"event": "part_start", "part": 1, "file": "videos/live.part1.mp4", "t": ...}
+    ...
+    {"event": "part_stitched", "part": 1, "offset": 81234944, "index_bytes": 0, ...}
+    {"event": "finalized", "t": ...}
+
+When the recorder dies mid-stream download_stream starts the next part in the
+same folder; when the whole process died, the next run finds the unfinished
+journal and carries on from there. finalize() stitches the parts into
+videos/live.mp4 (MPEG-TS, so parts are concatenated after dropping a torn
+last packet) and returns the gaps between them for metadata.json. Each part
+is journaled with the offset it is copied to before the copy starts, so a
+stitch interrupted by a crash is redone from there instead of appended twice.
+"""
+
+import os
+import json
+import time
+import glob
+import logging
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_NAME = "recording.journal"
+TS_PACKET_SIZE = 188
+
+
+def part_file(part):
+    return "videos/live.mp4" if part == 0 else f"videos/live.part{part}.mp4"
+
+
+def _index_file(video_file):
+    return os.path.splitext(video_file)[0] + ".index.jsonl"
+
+
+class RecordingJournal:
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, JOURNAL_NAME)
+        self.events = []
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self.events.append(json.loads(line))
+                    except ValueError:
+                        # Torn last line from a crash.
+                        break
+
+    def _append(self, event, **fields):
+        entry = {"event": event, **fields, "t": fields.get("t", time.time())}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.events.append(entry)
+        return entry
+
+    @property
+    def finalized(self):
+        # A finalized session that went on recording is unfinished again.
+        return bool(self.events) and self.events[-1]["event"] == "finalized"
+
+    @property
+    def started(self):
+        return any(e["event"] == "part_start" for e in self.events)
+
+    def parts(self):
+        """[{"part", "file", "start", "end", "code", "bytes"}] in order."""
+        parts = {}
+        for e in self.events:
+            if e["event"] == "part_start":
+                parts[e["part"]] = {
+                    "part": e["part"],
+                    "file": e["file"],
+                    "start": e["t"],
+                    "end": None,
+                    "code": None,
+                    "bytes": None,
+                }
+            elif e["event"] == "part_end" and e["part"] in parts:
+                parts[e["part"]].update(end=e["t"], code=e["code"], bytes=e["bytes"])
+        return [parts[n] for n in sorted(parts)]
+
+    def start_part(self):
+        """Journal the next part; returns its path relative to the folder."""
+        parts = self.parts()
+        if parts and parts[-1]["end"] is None:
+            # The process died during this part: it ended when it was last written.
+            last = parts[-1]
+            path = os.path.join(self.folder, last["file"])
+            exists = os.path.exists(path)
+            self.end_part(
+                None,
+                t=os.path.getmtime(path) if exists else last["start"],
+            )
+        number = parts[-1]["part"] + 1 if parts else 0
+        self._append("part_start", part=number, file=part_file(number))
+        return part_file(number)
+
+    def end_part(self, code, t=None):
+        parts = self.parts()
+        if not parts or parts[-1]["end"] is not None:
+            return None
+        path = os.path.join(self.folder, parts[-1]["file"])
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        fields = {"part": parts[-1]["part"], "code": code, "bytes": size}
+        if t is not None:
+            fields["t"] = t
+        return self._append("part_end", **fields)
+
+    def gaps(self):
+        """[{"before_part", "offset", "seconds"}]: wall time between parts."""
+        parts = [p for p in self.parts() if p["bytes"] or p["end"] is None]
+        if not parts:
+            return []
+        first = parts[0]["start"]
+        gaps = []
+        for prev, part in zip(parts, parts[1:]):
+            end = prev["end"] or part["start"]
+            gaps.append(
+                {
+                    "before_part": part["part"],
+                    "offset": round(end - first, 3),
+                    "seconds": round(max(part["start"] - end, 0), 3),
+                }
+            )
+        return gaps
+
+    def stitch(self, gaps=()):
+        """Append parts 1..n to videos/live.mp4 (and merge their HLS indexes)."""
+        base = os.path.join(self.folder, part_file(0))
+        later = [p for p in self.parts() if p["part"] > 0]
+        if not later:
+            return base
+        gap_before = {g["before_part"]: g["seconds"] for g in gaps}
+        stitched = {e["part"]: e for e in self.events if e["event"] == "part_stitched"}
+        base_index = _index_file(base)
+        # Not O_APPEND: sendfile() refuses to write to append-mode files.
+        fd = os.open(base, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            # A killed recorder can leave half a TS packet at the end.
+            size = os.fstat(fd).st_size
+            os.ftruncate(fd, size - size % TS_PACKET_SIZE)
+            for part in later:
+                path = os.path.join(self.folder, part["file"])
+                if not os.path.exists(path):
+                    continue
+                # A part is removed once stitched, so a journaled part that is
+                # still here was interrupted: cut back to where it started.
+                done = stitched.get(part["part"])
+                if done is None:
+                    offset = os.lseek(fd, 0, os.SEEK_END)
+                    index_bytes = (
+                        os.path.getsize(base_index) if os.path.exists(base_index) else 0
+                    )
+                    self._append(
+                        "part_stitched",
+                        part=part["part"],
+                        offset=offset,
+                        index_bytes=index_bytes,
+                    )
+                else:
+                    offset = done["offset"]
+                    os.ftruncate(fd, offset)
+                    os.lseek(fd, offset, os.SEEK_SET)
+                    # Only when the part's index was not merged completely.
+                    if os.path.exists(_index_file(path)) and os.path.exists(base_index):
+                        os.truncate(base_index, done["index_bytes"])
+                size = os.path.getsize(path)
+                size -= size % TS_PACKET_SIZE
+                with open(path, "rb") as src:
+                    copied = 0
+                    while copied < size:
+                        n = os.sendfile(fd, src.fileno(), copied, size - copied)
+                        if n == 0:
+                            raise OSError(f"{path} shrank while stitching")
+                        copied += n
+                self._merge_index(
+                    base, path, offset, part, gap_before.get(part["part"])
+                )
+                os.remove(path)
+        finally:
+            os.close(fd)
+        return base
+
+    def _merge_index(self, base, path, offset, part, gap_seconds):
+        index = _index_file(path)
+        if not os.path.exists(index):
+            return
+        with open(_index_file(base), "a", encoding="utf-8") as out:
+            if gap_seconds is not None:
+                entry = {"gap": "restart", "part": part["part"], "seconds": gap_seconds}
+                out.write(json.dumps(entry) + "\n")
+            with open(index, encoding="utf-8") as src:
+                for line in src:
+                    entry = json.loads(line)
+                    if "offset" in entry:
+                        entry["offset"] += offset
+                    out.write(json.dumps(entry) + "\n")
+        os.remove(index)
+
+    def finalize(self):
+        """Stitch the parts, journal the end; returns the gaps between parts."""
+        self.end_part(None)
+        gaps = self.gaps()
+        self.stitch(gaps)
+        self._append("finalized", parts=len(self.parts()))
+        return gaps
+
+
+def find_unfinished(channel_dir, max_age):
+    """Most recent folder under channel_dir with an unfinalized journal."""
+    now = time.time()
+    candidates = []
+    for path in glob.glob(os.path.join(glob.escape(channel_dir), "*", JOURNAL_NAME)):
+        folder = os.path.dirname(path)
+        journal = RecordingJournal(folder)
+        if journal.finalized or not journal.started:
+            continue
+        # The journal is only written between parts; the video shows the crash.
+        last_file = os.path.join(folder, journal.parts()[-1]["file"])
+        last_write = max(
+            os.path.getmtime(path),
+            os.path.getmtime(last_file) if os.path.exists(last_file) else 0,
+        )
+        if now - last_write <= max_age:
+            candidates.append((last_write, folder))
+    return max(candidates)[1] if candidates else None
@@ -0,0 +1,349 @@
+"""
+Seekable compressed text archives for chat logs and the archiver's own logs.
+
+Lines are buffered into frames; each frame is written as an independent gzip
+member, so the file is still a normal .gz (zcat/gunzip read it whole) while a
+reader can decompress single frames. Every frame gets a line in the JSON-lines
+index next to it (<file>.idx) with its byte range and first/last timestamp, so
+a time-range query only decompresses the frames that overlap it.
+
+Files rotate by size or age: <base>.<UTC start>.gz, <base>.<UTC start>.gz.idx
+"""
+
+import os
+import re
+import glob
+import gzip
+import json
+import time
+import zlib
+import logging
+import argparse
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = ".idx"
+FRAME_BYTES = 1024 * 1024
+FRAME_SECONDS = 60
+COMPRESS_LEVEL = 6
+
+CHAT_TS_RE = re.compile(r"^\[(\d{4}-\d\d-\d\dT[^\]]+)\]")
+LOG_TS_RE = re.compile(r"^(\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d(?:[.,]\d+)?)")
+
+
+def line_timestamp(line):
+    """Epoch seconds for a chat or log line, or None if it has no timestamp."""
+    match = CHAT_TS_RE.match(line)
+    if match:
+        try:
+            return datetime.fromisoformat(match.group(1)).timestamp()
+        except ValueError:
+            return None
+    match = LOG_TS_RE.match(line)
+    if match:
+        try:
+            dt = datetime.fromisoformat(match.group(1).replace(",", "."))
+        except ValueError:
+            return None
+        # logging_setup writes local time without an offset
+        return dt.timestamp()
+    return None
+
+
+def _stamp(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+class SeekableArchiveWriter:
+    """
+    Appends timestamped lines to <base>.<start>.gz in independently
+    decompressible frames. A frame is closed when it reaches frame_bytes of
+    text or spans frame_seconds; a file is rotated when it reaches
+    rotate_bytes compressed or is rotate_seconds old. Lines still buffered
+    when the process dies are lost, so keep frames small for chat.
+    """
+
+    def __init__(
+        self,
+        base_path,
+        frame_bytes=FRAME_BYTES,
+        frame_seconds=FRAME_SECONDS,
+        rotate_bytes=None,
+        rotate_seconds=None,
+    ):
+        self.base_path = base_path
+        self.frame_bytes = frame_bytes
+        self.frame_seconds = frame_seconds
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self._buf = []
+        self._buf_size = 0
+        self._first_ts = None
+        self._last_ts = None
+        self._file = None
+        self._index = None
+        self._opened_at = None
+        self.path = None
+        os.makedirs(os.path.dirname(os.path.abspath(base_path)), exist_ok=True)
+
+    def _open(self, ts):
+        path = f"{self.base_path}.{_stamp(ts)}.gz"
+        n = 1
+        while os.path.exists(path):
+            path = f"{self.base_path}.{_stamp(ts)}-{n}.gz"
+            n += 1
+        self.path = path
+        self._file = open(path, "ab")
+        self._index = open(path + INDEX_SUFFIX, "a", encoding="utf-8")
+        self._opened_at = ts
+
+    def _rotate_due(self, ts):
+        if self._file is None:
+            return True
+        if self.rotate_bytes and self._file.tell() >= self.rotate_bytes:
+            return True
+        if self.rotate_seconds and ts - self._opened_at >= self.rotate_seconds:
+            return True
+        return False
+
+    def write_line(self, line, ts=None):
+        if ts is None:
+            ts = time.time()
+        if not line.endswith("\n"):
+            line += "\n"
+        if self._buf and (
+            self._buf_size >= self.frame_bytes
+            or ts - self._first_ts >= self.frame_seconds
+        ):
+            self.flush_frame()
+        if self._first_ts is None:
+            self._first_ts = ts
+        self._last_ts = max(ts, self._last_ts or ts)
+        data = line.encode("utf-8")
+        self._buf.append(data)
+        self._buf_size += len(data)
+
+    def flush_frame(self):
+        if not self._buf:
+            return
+        if self._rotate_due(self._first_ts):
+            self._close_files()
+            self._open(self._first_ts)
+        raw = b"".join(self._buf)
+        frame = gzip.compress(raw, compresslevel=COMPRESS_LEVEL, mtime=0)
+        offset = self._file.tell()
+        self._file.write(frame)
+        self._file.flush()
+        entry = {
+            "offset": offset,
+            "length": len(frame),
+            "first_ts": self._first_ts,
+            "last_ts": self._last_ts,
+            "lines": len(self._buf),
+            "raw_bytes": len(raw),
+        }
+        self._index.write(json.dumps(entry) + "\n")
+        self._index.flush()
+        self._buf = []
+        self._buf_size = 0
+        self._first_ts = None
+        self._last_ts = None
+
+    def _close_files(self):
+        if self._file:
+            self._file.close()
+            self._index.close()
+            self._file = None
+            self._index = None
+
+    def close(self):
+        self.flush_frame()
+        self._close_files()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def rebuild_index(path, timestamp=line_timestamp):
+    """Recreate <path>.idx by walking the gzip members of an archive."""
+    entries = []
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset < len(data):
+        d = zlib.decompressobj(wbits=31)
+        raw = d.decompress(data[offset:])
+        if not d.eof:
+            logger.warning(f"Truncated frame at {offset} in {path}; ignoring tail")
+            break
+        length = len(data) - offset - len(d.unused_data)
+        stamps = [
+            ts
+            for ts in (timestamp(l) for l in raw.decode("utf-8").splitlines())
+            if ts is not None
+        ]
+        entries.append(
+            {
+                "offset": offset,
+                "length": length,
+                "first_ts": min(stamps) if stamps else None,
+                "last_ts": max(stamps) if stamps else None,
+                "lines": raw.count(b"\n"),
+                "raw_bytes": len(raw),
+            }
+        )
+        offset += length
+    with open(path + INDEX_SUFFIX, "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+    return entries
+
+
+def load_index(path):
+    entries = []
+    try:
+        with open(path + INDEX_SUFFIX, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+    except FileNotFoundError:
+        return rebuild_index(path)
+    size = os.path.getsize(path)
+    return [e for e in entries if e["offset"] + e["length"] <= size]
+
+
+def archive_files(base_path):
+    return sorted(glob.glob(glob.escape(base_path) + ".*.gz"))
+
+
+def read_range(base_path, start_ts=None, end_ts=None, timestamp=line_timestamp):
+    """
+    Yield the lines with start_ts <= timestamp < end_ts across all rotated
+    archives of base_path. Only frames overlapping the range are decompressed;
+    lines without a timestamp follow the line before them.
+    """
+    for path in archive_files(base_path):
+        frames = [
+            e
+            for e in load_index(path)
+            if e["first_ts"] is None
+            or (
+                (end_ts is None or e["first_ts"] < end_ts)
+                and (start_ts is None or e["last_ts"] >= start_ts)
+            )
+        ]
+        if not frames:
+            continue
+        with open(path, "rb") as f:
+            for entry in frames:
+                f.seek(entry["offset"])
+                raw = gzip.decompress(f.read(entry["length"]))
+                keep = False
+                for line in raw.decode("utf-8").splitlines():
+                    ts = timestamp(line)
+                    if ts is not None:
+                        keep = (start_ts is None or ts >= start_ts) and (
+                            end_ts is None or ts < end_ts
+                        )
+                    if keep:
+                        yield line
+
+
+def compress_file(src_path, base_path=None, **writer_kwargs):
+    """Re-pack a plain chat or log file into a seekable archive."""
+    base_path = base_path or src_path
+    count = 0
+    last_ts = None
+    with SeekableArchiveWriter(base_path, **writer_kwargs) as writer, open(
+        src_path, "r", encoding="utf-8"
+    ) as f:
+        for line in f:
+            ts = line_timestamp(line)
+            if ts is None:
+                ts = last_ts if last_ts is not None else os.path.getmtime(src_path)
+            last_ts = ts
+            writer.write_line(line, ts)
+            count += 1
+    logger.info(f"Compressed {count} lines from {src_path} into {base_path}.*.gz")
+    return count
+
+
+class SeekableArchiveHandler(logging.Handler):
+    """logging handler writing formatted records into a SeekableArchiveWriter."""
+
+    def __init__(self, base_path, **writer_kwargs):
+        super().__init__()
+        self.writer = SeekableArchiveWriter(base_path, **writer_kwargs)
+
+    def emit(self, record):
+        try:
+            self.acquire()
+            try:
+                self.writer.write_line(self.format(record), record.created)
+            finally:
+                self.release()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            self.writer.flush_frame()
+        finally:
+            self.release()
+
+    def close(self):
+        self.acquire()
+        try:
+            self.writer.close()
+        finally:
+            self.release()
+        super().close()
+
+
+def _parse_when(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        dt = datetime.fromisoformat(value)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seekable compressed archives")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("compress", help="Pack a plain chat/log file")
+    p.add_argument("src")
+    p.add_argument("--rotate-mb", type=float)
+    p = sub.add_parser("range", help="Print lines in a time range")
+    p.add_argument("base", help="Archive base path, e.g. persons/.../chat.live.log")
+    p.add_argument("--start", help="ISO time or epoch seconds")
+    p.add_argument("--end", help="ISO time or epoch seconds")
+    p = sub.add_parser("reindex")
+    p.add_argument("archive")
+    args = parser.parse_args(argv)
+
+    if args.command == "compress":
+        rotate = int(args.rotate_mb * 1024 * 1024) if args.rotate_mb else None
+        compress_file(args.src, rotate_bytes=rotate)
+    elif args.command == "range":
+        for line in read_range(
+            args.base, _parse_when(args.start), _parse_when(args.end)
+        ):
+            print(line)
+    else:
+        rebuild_index(args.archive)
+
+
+if __name__ == "__main__":
+    main()
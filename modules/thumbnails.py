@@ -0,0 +1,289 @@
+"""
+Preview thumbnails and seek-preview sprite sheets from recordings.
+
+One ffmpeg process decodes only the keyframes of a time range (-skip_frame
+nokey), samples a frame every SPRITE_INTERVAL seconds and splits it into two
+outputs: tiled sprite sheets and a full-size thumbnail every THUMB_INTERVAL
+seconds. Layout inside the stream folder:
+
+    thumbnails/thumb_000900.jpg       frame at 900 s
+    thumbnails/sprites/sheet_0000.jpg SPRITE_COLS x SPRITE_ROWS tiles
+    thumbnails/sprites.vtt            WebVTT cues: sprites/sheet_0000.jpg#xywh=...
+    thumbnails/thumbnails.json        progress, so live and resumed runs continue
+
+Ranges are processed in whole sprite sheets, which lets a live recording be
+handled incrementally while it is still being written.
+"""
+
+import os
+import glob
+import time
+import shutil
+import logging
+import argparse
+import subprocess
+
+from .file_utils import atomic_write_json, read_json, get_local_file_duration
+
+logger = logging.getLogger(__name__)
+
+SPRITE_INTERVAL = 10
+SPRITE_COLS = 10
+SPRITE_ROWS = 10
+SPRITE_WIDTH = 160
+THUMB_WIDTH = 640
+# Live: stay this far behind the end of the growing recording.
+LIVE_MARGIN_SECONDS = 30
+STATE_FILENAME = "thumbnails.json"
+
+
+def _ffmpeg():
+    return os.getenv("FFMPEG_PATH") or "ffmpeg"
+
+
+def _ffprobe():
+    return os.getenv("FFPROBE_PATH") or "ffprobe"
+
+
+def thumb_interval():
+    return int(os.getenv("THUMB_INTERVAL", "900"))
+
+
+def _run_timed(cmd):
+    """
+    Run cmd like subprocess.run(check=True); returns the CPU seconds of that
+    process alone (wait4), not of every child of this process. 0.0 on Windows.
+    """
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    with proc.stderr:
+        stderr = proc.stderr.read()
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        cpu = usage.ru_utime + usage.ru_stime
+    else:
+        proc.wait()
+        cpu = 0.0
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr)
+    return cpu
+
+
+def _image_size(path):
+    result = subprocess.run(
+        [
+            _ffprobe(),
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "stream=width,height",
+            "-of",
+            "csv=p=0",
+            path,
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+        text=True,
+    )
+    width, height = result.stdout.strip().split(",")[:2]
+    return int(width), int(height)
+
+
+def extract_range(src, out_dir, start, duration, interval):
+    """
+    Run one ffmpeg pass over [start, start + duration). start must be a
+    multiple of the sprite sheet span. Returns per-run stats.
+    """
+    per_sheet = SPRITE_COLS * SPRITE_ROWS
+    first_frame = int(round(start / SPRITE_INTERVAL))
+    first_sheet = first_frame // per_sheet
+    every = max(1, round(interval / SPRITE_INTERVAL))
+    # First sampled frame (absolute index) that is also a thumbnail.
+    first_thumb = -(-first_frame // every) * every
+
+    sprite_dir = os.path.join(out_dir, "sprites")
+    tmp_dir = os.path.join(out_dir, f".tmp-{first_frame}")
+    os.makedirs(sprite_dir, exist_ok=True)
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    graph = (
+        f"[0:v]fps=1/{SPRITE_INTERVAL},split=2[f][s];"
+        f"[f]select='eq(mod(n+{first_frame},{every}),0)',"
+        f"scale={THUMB_WIDTH}:-2[thumb];"
+        f"[s]scale={SPRITE_WIDTH}:-2,tile={SPRITE_COLS}x{SPRITE_ROWS}[sheet]"
+    )
+    cmd = [
+        _ffmpeg(),
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-nostdin",
+        "-y",
+        "-skip_frame",
+        "nokey",
+        "-ss",
+        f"{start:.3f}",
+        "-t",
+        f"{duration:.3f}",
+        "-i",
+        src,
+        "-filter_complex",
+        graph,
+        "-map",
+        "[thumb]",
+        "-fps_mode",
+        "passthrough",
+        "-q:v",
+        "3",
+        os.path.join(tmp_dir, "%06d.jpg"),
+        "-map",
+        "[sheet]",
+        "-fps_mode",
+        "passthrough",
+        "-q:v",
+        "5",
+        "-start_number",
+        str(first_sheet),
+        os.path.join(sprite_dir, "sheet_%04d.jpg"),
+    ]
+    logger.debug(f"Running ffmpeg thumbnail pass: {cmd}")
+
+    t0 = time.monotonic()
+    try:
+        cpu = _run_timed(cmd)
+        wall = time.monotonic() - t0
+
+        thumbs = sorted(glob.glob(os.path.join(tmp_dir, "*.jpg")))
+        for n, path in enumerate(thumbs):
+            seconds = (first_thumb + n * every) * SPRITE_INTERVAL
+            os.replace(path, os.path.join(out_dir, f"thumb_{seconds:06d}.jpg"))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    frames = int(-(-duration // SPRITE_INTERVAL))
+    return {"frames": frames, "thumbs": len(thumbs), "wall": wall, "cpu": cpu}
+
+
+def write_vtt(out_dir, state):
+    """sprites.vtt covering everything processed so far."""
+    per_sheet = SPRITE_COLS * SPRITE_ROWS
+    w, h = state["tile_width"], state["tile_height"]
+    end = state["done_until"]
+    lines = ["WEBVTT", ""]
+    i = 0
+    while i * SPRITE_INTERVAL < end:
+        t0 = i * SPRITE_INTERVAL
+        t1 = min(t0 + SPRITE_INTERVAL, end)
+        pos = i % per_sheet
+        x = (pos % SPRITE_COLS) * w
+        y = (pos // SPRITE_COLS) * h
+        lines.append(f"{_vtt_time(t0)} --> {_vtt_time(t1)}")
+        lines.append(f"sprites/sheet_{i // per_sheet:04d}.jpg#xywh={x},{y},{w},{h}")
+        lines.append("")
+        i += 1
+    tmp_path = os.path.join(out_dir, "sprites.vtt.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+    os.replace(tmp_path, os.path.join(out_dir, "sprites.vtt"))
+
+
+def _vtt_time(seconds):
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
+    return f"{int(h):02d}:{int(m):02d}:{s:06.3f}"
+
+
+def generate_thumbnails(src, out_dir=None, live=False, duration=None):
+    """
+    Process the part of src not handled yet. With live=True only whole sprite
+    sheets older than LIVE_MARGIN_SECONDS are processed; call again with
+    live=False once the recording has finished to do the remainder.
+    Returns the updated state, or None if there was nothing to do.
+    """
+    if not shutil.which(_ffmpeg()):
+        logger.error("ffmpeg not found. Skipping thumbnails.")
+        return None
+    out_dir = out_dir or os.path.join(
+        os.path.dirname(os.path.dirname(src)), "thumbnails"
+    )
+    os.makedirs(out_dir, exist_ok=True)
+    state_path = os.path.join(out_dir, STATE_FILENAME)
+    state = read_json(state_path)
+    done = state.get("done_until", 0)
+
+    if duration is None:
+        duration = get_local_file_duration(src)
+    span = SPRITE_COLS * SPRITE_ROWS * SPRITE_INTERVAL
+    if live:
+        end = (duration - LIVE_MARGIN_SECONDS) // span * span
+    else:
+        end = duration
+    if state.get("complete") or end <= done:
+        return None
+
+    interval = thumb_interval()
+    run = extract_range(src, out_dir, done, end - done, interval)
+
+    if "tile_height" not in state:
+        first_sheet = os.path.join(out_dir, "sprites", "sheet_0000.jpg")
+        width, height = _image_size(first_sheet)
+        state["tile_width"] = width // SPRITE_COLS
+        state["tile_height"] = height // SPRITE_ROWS
+    state["done_until"] = end
+    state["complete"] = not live
+    state["thumb_interval"] = interval
+    state["sprite_interval"] = SPRITE_INTERVAL
+    totals = state.setdefault(
+        "totals", {"video_seconds": 0.0, "frames": 0, "wall": 0.0, "cpu": 0.0}
+    )
+    totals["video_seconds"] += end - done
+    totals["frames"] += run["frames"]
+    totals["wall"] += run["wall"]
+    totals["cpu"] += run["cpu"]
+    write_vtt(out_dir, state)
+    atomic_write_json(state_path, state)
+
+    hours = (end - done) / 3600
+    logger.info(
+        f"Thumbnails {src} [{done:.0f}s-{end:.0f}s]: {run['thumbs']} thumbs, "
+        f"{run['frames'] / max(run['wall'], 1e-6):.1f} frames/s, "
+        f"{run['cpu'] / max(hours, 1e-6):.1f} CPU s per hour of video"
+    )
+    return state
+
+
+def monitor_live_thumbnails(src, out_dir, is_running_flag, interval=60):
+    """Keep thumbnails of a growing recording up to date, then finish it."""
+    while is_running_flag["value"]:
+        try:
+            if os.path.exists(src):
+                generate_thumbnails(src, out_dir, live=True)
+        except Exception as e:
+            logger.exception(f"Live thumbnail pass failed for {src}: {e}")
+        for _ in range(interval):
+            if not is_running_flag["value"]:
+                break
+            time.sleep(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Thumbnails and sprite sheets")
+    parser.add_argument("video")
+    parser.add_argument("--out", help="Output folder (default: <stream>/thumbnails)")
+    parser.add_argument("--live", action="store_true", help="Only finished sheets")
+    args = parser.parse_args(argv)
+    state = generate_thumbnails(args.video, args.out, live=args.live)
+    if state:
+        totals = state["totals"]
+        print(
+            f"{totals['frames'] / max(totals['wall'], 1e-6):.1f} frames/s, "
+            f"{totals['cpu'] / max(totals['video_seconds'] / 3600, 1e-6):.1f} "
+            "CPU s per hour of video"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+OAuth token lifecycle shared by every archiver process.
+
+The current token lives in metadata/token.json (access/refresh token and the
+absolute expiry). refresh_env.py runs a TokenManager that sleeps until shortly
+before expires_at and refreshes then, instead of validating on a fixed
+interval. Other processes call current_access_token(), which re-reads
+token.json only when the file changes (one stat per call, no .env parsing),
+so a refresh reaches them without a restart.
+
+Refreshes are single-flighted across processes with an exclusive lock on
+token.json.lock: whoever gets the lock re-reads the file and only refreshes if
+nobody else already has. Twitch may rotate refresh tokens, so two concurrent
+refreshes with the same refresh token would otherwise invalidate each other.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+from .db_utils import BASE_DIR
+from .file_utils import atomic_write_json
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TOKEN_FILE = os.path.join(BASE_DIR, "metadata", "token.json")
+# Refresh this many seconds before the token expires.
+REFRESH_MARGIN = 600
+RETRY_DELAYS = (15, 30, 60, 120, 300)
+
+_cache = {"path": None, "stamp": None, "data": {}}
+_cache_lock = threading.Lock()
+
+
+def _id_base():
+    return os.getenv("TWITCH_ID_BASE", "https://id.twitch.tv").rstrip("/")
+
+
+class TokenFileLock:
+    """Exclusive advisory lock held while a process refreshes the token."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, "a")
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+def read_token_state(path=TOKEN_FILE):
+    """Contents of token.json, re-parsed only when the file has changed."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return {}
+    # token.json is replaced atomically, so a new inode also means a new token.
+    stamp = (st.st_ino, st.st_mtime_ns)
+    with _cache_lock:
+        if _cache["path"] != path or _cache["stamp"] != stamp:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Could not read {path}: {e}")
+                return _cache["data"] if _cache["path"] == path else {}
+            _cache.update(path=path, stamp=stamp, data=data)
+        return _cache["data"]
+
+
+def current_access_token(path=TOKEN_FILE):
+    return read_token_state(path).get("access_token") or os.getenv("ACCESS_TOKEN")
+
+
+def validate_token(access_token):
+    """Twitch /oauth2/validate response, or None if the token is invalid."""
+    import requests
+
+    try:
+        resp = requests.get(
+            f"{_id_base()}/oauth2/validate",
+            headers={"Authorization": f"OAuth {access_token}"},
+            timeout=15,
+        )
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error validating token: {e}")
+        return None
+    if resp.status_code != 200:
+        logger.warning(f"Token validation failed: HTTP {resp.status_code}")
+        return None
+    return resp.json()
+
+
+class TokenManager:
+    def __init__(self, env_file=None, path=TOKEN_FILE, margin=REFRESH_MARGIN):
+        """
+        :param env_file: .env to keep in sync (ACCESS_TOKEN / REFRESH_TOKEN), or None
+        :param path: shared token state file
+        :param margin: seconds before expiry at which to refresh
+        """
+        self.env_file = env_file
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.margin = margin
+
+    def state(self):
+        return read_token_state(self.path)
+
+    def store(self, token_data, access_token=None, refresh_token=None):
+        """Persist a token response (refresh/authorization_code or validate)."""
+        state = dict(self.state())
+        state["access_token"] = (
+            token_data.get("access_token") or access_token or state.get("access_token")
+        )
+        state["refresh_token"] = (
+            token_data.get("refresh_token")
+            or refresh_token
+            or state.get("refresh_token")
+        )
+        if token_data.get("expires_in") is not None:
+            state["expires_at"] = time.time() + token_data["expires_in"]
+        if token_data.get("scopes") is not None:
+            state["scopes"] = token_data["scopes"]
+        state["updated_at"] = time.time()
+        atomic_write_json(self.path, state, mode=0o600)
+
+        os.environ["ACCESS_TOKEN"] = state["access_token"] or ""
+        if state["refresh_token"]:
+            os.environ["REFRESH_TOKEN"] = state["refresh_token"]
+        if self.env_file:
+            from dotenv import set_key
+
+            # Still written for processes started with the old .env workflow.
+            set_key(self.env_file, "ACCESS_TOKEN", state["access_token"] or "")
+            if state["refresh_token"]:
+                set_key(self.env_file, "REFRESH_TOKEN", state["refresh_token"])
+        return state
+
+    def _needs_refresh(self, state, seen_access_token):
+        if not state.get("access_token"):
+            return True
+        if seen_access_token and state["access_token"] != seen_access_token:
+            # Another process refreshed while we waited for the lock.
+            return False
+        if seen_access_token:
+            return True
+        return state.get("expires_at", 0) - time.time() <= self.margin
+
+    def refresh(self, seen_access_token=None):
+        """
+        Refresh unless another process already did. Pass the token that was
+        rejected (e.g. after a 401) as seen_access_token to force a refresh of
+        exactly that token. Returns the current state, or None on failure.
+        """
+        import requests
+
+        with TokenFileLock(self.lock_path):
+            state = self.state()
+            if not self._needs_refresh(state, seen_access_token):
+                logger.debug("Token already refreshed by another process.")
+                return state
+
+            refresh_token = state.get("refresh_token") or os.getenv("REFRESH_TOKEN")
+            if not refresh_token:
+                logger.error("No refresh token available.")
+                return None
+            logger.info("Refreshing access token via refresh_token...")
+            try:
+                resp = requests.post(
+                    f"{_id_base()}/oauth2/token",
+                    data={
+                        "grant_type": "refresh_token",
+                        "refresh_token": refresh_token,
+                        "client_id": os.getenv("CLIENT_ID"),
+                        "client_secret": os.getenv("CLIENT_SECRET"),
+                    },
+                    timeout=15,
+                )
+                resp.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Failed to refresh access token: {e}")
+                return None
+            token_data = resp.json()
+            state = self.store(token_data, refresh_token=refresh_token)
+            logger.info(
+                f"Refreshed access token; expires in {token_data.get('expires_in', '???')} sec."
+            )
+            return state
+
+    def bootstrap(self, access_token=None, refresh_token=None):
+        """Make sure token.json has an expiry, validating the token once if needed."""
+        state = self.state()
+        if state.get("access_token") and state.get("expires_at"):
+            return state
+        access_token = access_token or state.get("access_token")
+        refresh_token = refresh_token or state.get("refresh_token")
+        if access_token:
+            data = validate_token(access_token)
+            if data:
+                return self.store(
+                    data, access_token=access_token, refresh_token=refresh_token
+                )
+        if refresh_token:
+            self.store({}, access_token=access_token, refresh_token=refresh_token)
+            return self.refresh(seen_access_token=access_token)
+        return None
+
+    def run(self, stop_event=None):
+        """Refresh shortly before each expiry until stop_event is set."""
+        stop_event = stop_event or threading.Event()
+        failures = 0
+        while not stop_event.is_set():
+            state = self.state()
+            due = state.get("expires_at", 0) - self.margin
+            wait = due - time.time()
+            if wait > 0:
+                logger.info(f"Next token refresh in {int(wait)} seconds.")
+                # Wake up early to notice tokens refreshed by other processes.
+                stop_event.wait(min(wait, 3600))
+                continue
+            if self.refresh() is not None:
+                failures = 0
+                continue
+            delay = RETRY_DELAYS[min(failures, len(RETRY_DELAYS) - 1)]
+            failures += 1
+            logger.warning(f"Token refresh failed; retrying in {delay} seconds.")
+            stop_event.wait(delay)
@@ -3,23 +3,40 @@ import subprocess
 import re
 import logging
 import shutil
-from tqdm import tqdm
+
+from .token_manager import current_access_token
+from .profiling import profiled
 
 logger = logging.getLogger(__name__)
 
 
-def record_live(channel_name, output_folder):
-    videos_path = os.path.join(output_folder, "videos")
-    os.makedirs(videos_path, exist_ok=True)
-    out_path = os.path.join(videos_path, "live.mp4")
+def record_live(channel_name, output_folder, file_name="videos/live.mp4"):
+    out_path = os.path.join(output_folder, file_name)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+
+    if os.getenv("RECORDER", "streamlink").lower() == "native":
+        from .hls_recorder import NativeRecording, playlist_url
+
+        logger.info(
+            f"Recording live stream from {channel_name} -> {out_path} (native HLS)"
+        )
+        return NativeRecording(playlist_url(channel_name), out_path)
 
     env = os.environ.copy()
-    env["TWITCH_OAUTH_TOKEN"] = os.getenv("ACCESS_TOKEN", "")
+    env["TWITCH_OAUTH_TOKEN"] = current_access_token() or ""
+
+    # TWITCH_HLS_BASE (e.g. http://127.0.0.1:8710/hls) points the recorder at
+    # twitch_standin.py instead of twitch.tv.
+    hls_base = os.getenv("TWITCH_HLS_BASE", "").rstrip("/")
+    if hls_base:
+        source = f"hls://{hls_base}/{channel_name}/index.m3u8"
+    else:
+        source = f"twitch.tv/{channel_name}"
 
     cmd = [
         "streamlink",
         "--twitch-disable-ads",
-        f"twitch.tv/{channel_name}",
+        source,
         "best",
         "--stdout",
     ]
@@ -31,7 +48,10 @@ def record_live(channel_name, output_folder):
     return process
 
 
+@profiled
 def download_vod(vod_url, vod_path):
+    from tqdm import tqdm
+
     os.makedirs(os.path.dirname(vod_path), exist_ok=True)
     logger.info(f"Downloading VOD: {vod_url}")
     cmd = [
@@ -1,27 +1,19 @@
 import os
-import time
 import requests
 import logging
-from logging import FileHandler, StreamHandler, Formatter
-from dotenv import load_dotenv, set_key
+from dotenv import load_dotenv
 
-LOG_FILE = os.path.join(os.path.dirname(__file__), "logs/refresh_env.log")
+from modules.logging_setup import configure_logger
+from modules.token_manager import TokenManager
+
+# Handlers are attached in main(), so importing this module has no side effects.
 logger = logging.getLogger("refresh_env")
-logger.setLevel(logging.DEBUG)
-file_handler = FileHandler(LOG_FILE, mode="a", encoding="utf-8")
-file_handler.setLevel(logging.DEBUG)
-console_handler = StreamHandler()
-console_handler.setLevel(logging.INFO)
-formatter = Formatter("%(asctime)s - %(levelname)s - %(message)s", "%Y-%m-%d %H:%M:%S")
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
 
 ENV_FILE = os.path.join(os.path.dirname(__file__), ".env")
-VALIDATE_URL = "https://id.twitch.tv/oauth2/validate"
-REFRESH_URL = "https://id.twitch.tv/oauth2/token"
-CHECK_INTERVAL = 300
+load_dotenv(ENV_FILE)
+TWITCH_ID_BASE = os.getenv("TWITCH_ID_BASE", "https://id.twitch.tv").rstrip("/")
+REFRESH_URL = f"{TWITCH_ID_BASE}/oauth2/token"
+# Refresh this many seconds before the token expires.
 REFRESH_THRESHOLD = 600
 REQUIRED_SCOPES = ["chat:read", "chat:edit", "user_subscriptions"]
 
@@ -39,65 +31,9 @@ def load_env_vars():
     return env_data
 
 
-def validate_token(access_token, client_id):
-    headers = {"Authorization": f"Bearer {access_token}", "Client-ID": client_id}
-    try:
-        resp = requests.get(VALIDATE_URL, headers=headers)
-        if resp.status_code == 200:
-            data = resp.json()
-            logger.debug(f"Raw token validation response: {data}")
-            logger.info(
-                f"Token valid. Expires in {data.get('expires_in', '???')} sec. "
-                f"Login: {data.get('login')}"
-            )
-            return data
-        else:
-            logger.warning(
-                f"Token validation failed: HTTP {resp.status_code} - {resp.text}"
-            )
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error validating token: {e}")
-    return None
-
-
-def refresh_access_token(client_id, client_secret, refresh_token):
-    logger.info("Refreshing access token via refresh_token...")
-    data = {
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token,
-        "client_id": client_id,
-        "client_secret": client_secret,
-    }
-    try:
-        resp = requests.post(REFRESH_URL, data=data)
-        if resp.status_code != 200:
-            logger.warning(
-                f"Refresh token request failed: HTTP {resp.status_code} - {resp.text}"
-            )
-            resp.raise_for_status()
-        token_data = resp.json()
-        new_access = token_data.get("access_token")
-        new_refresh = token_data.get("refresh_token")
-
-        if new_access:
-            current_access = os.getenv("ACCESS_TOKEN")
-            if new_access != current_access:
-                set_key(ENV_FILE, "ACCESS_TOKEN", new_access)
-                os.environ["ACCESS_TOKEN"] = new_access
-        if new_refresh:
-            current_refresh = os.getenv("REFRESH_TOKEN")
-            if new_refresh != current_refresh:
-                set_key(ENV_FILE, "REFRESH_TOKEN", new_refresh)
-                os.environ["REFRESH_TOKEN"] = new_refresh
-
-        logger.info("Successfully refreshed access token.")
-        return token_data
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to refresh access token: {e}")
-    return None
-
-
-def initial_authorization(client_id, client_secret, authorization_code, redirect_uri):
+def initial_authorization(
+    manager, client_id, client_secret, authorization_code, redirect_uri
+):
     logger.info(
         "No refresh token found. Attempting initial authorization using AUTHORIZATION_CODE..."
     )
@@ -116,15 +52,7 @@ def initial_authorization(client_id, client_secret, authorization_code, redirect
             )
             resp.raise_for_status()
         token_data = resp.json()
-        new_access = token_data.get("access_token")
-        new_refresh = token_data.get("refresh_token")
-
-        if new_access:
-            set_key(ENV_FILE, "ACCESS_TOKEN", new_access)
-            os.environ["ACCESS_TOKEN"] = new_access
-        if new_refresh:
-            set_key(ENV_FILE, "REFRESH_TOKEN", new_refresh)
-            os.environ["REFRESH_TOKEN"] = new_refresh
+        manager.store(token_data)
 
         logger.info("Initial authorization successful. Tokens have been updated.")
         return token_data
@@ -146,6 +74,12 @@ def log_scopes(token_data):
 
 
 def main():
+    configure_logger(
+        logger_name="refresh_env",
+        log_file_name="refresh_env.log",
+        console_level=logging.INFO,
+        file_level=logging.DEBUG,
+    )
     env = load_env_vars()
     client_id = env["CLIENT_ID"]
     client_secret = env["CLIENT_SECRET"]
@@ -158,62 +92,26 @@ def main():
         logger.critical("CLIENT_ID or CLIENT_SECRET missing. Exiting.")
         return
 
-    if not refresh_token:
+    manager = TokenManager(ENV_FILE, margin=REFRESH_THRESHOLD)
+    state = manager.state()
+    if not refresh_token and not state.get("refresh_token"):
         if authorization_code and redirect_uri:
             logger.info("No refresh token found, but authorization code is available.")
             token_data = initial_authorization(
-                client_id, client_secret, authorization_code, redirect_uri
+                manager, client_id, client_secret, authorization_code, redirect_uri
             )
         else:
             logger.warning("No refresh token or AUTHORIZATION_CODE provided.")
             token_data = None
     else:
-        if not access_token:
-            logger.warning(
-                "No ACCESS_TOKEN in .env. Attempting refresh via refresh token."
-            )
-            token_data = refresh_access_token(client_id, client_secret, refresh_token)
-        else:
-            token_data = validate_token(access_token, client_id)
-            if not token_data or token_data.get("expires_in", 0) < REFRESH_THRESHOLD:
-                logger.info("Token invalid or expiring soon. Refreshing...")
-                token_data = refresh_access_token(
-                    client_id, client_secret, refresh_token
-                )
-            else:
-                logger.info("Initial token OK.")
+        token_data = manager.bootstrap(access_token, refresh_token)
 
     if token_data:
         log_scopes(token_data)
     else:
         logger.warning("No valid token data obtained on startup.")
 
-    while True:
-        time.sleep(CHECK_INTERVAL)
-        env = load_env_vars()
-        client_id = env["CLIENT_ID"]
-        client_secret = env["CLIENT_SECRET"]
-        access_token = env["ACCESS_TOKEN"]
-        refresh_token = env["REFRESH_TOKEN"]
-
-        if not access_token:
-            logger.warning("ACCESS_TOKEN missing; attempting refresh anyway.")
-            token_data = refresh_access_token(client_id, client_secret, refresh_token)
-            continue
-
-        token_data = validate_token(access_token, client_id)
-        if not token_data:
-            logger.info("Token invalid. Attempting refresh...")
-            token_data = refresh_access_token(client_id, client_secret, refresh_token)
-        else:
-            expires_in = token_data.get("expires_in", 0)
-            if expires_in < REFRESH_THRESHOLD:
-                logger.info(f"Token expiring soon ({expires_in}s). Refreshing...")
-                token_data = refresh_access_token(
-                    client_id, client_secret, refresh_token
-                )
-            else:
-                logger.info(f"Token OK. Next check in {CHECK_INTERVAL} seconds.")
+    manager.run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,793 @@
+"""
+Offline stand-in for the Twitch services the archiver talks to: Helix
+(users / streams / videos), OAuth (token / validate), IRC chat over websocket
+HLS live/VOD playlists and emote images.
+
+Channels are named standin_0000, standin_0001, ... and go live and offline on a
+deterministic per-channel schedule, so hundreds of channels can be simulated on
+one machine:
+
+    python twitch_standin.py --channels 500 --chat-rate 5 --port 8710
+
+Point the archiver at it through .env (see env_example.txt):
+
+    TWITCH_API_BASE=http://127.0.0.1:8710
+    TWITCH_ID_BASE=http://127.0.0.1:8710
+    TWITCH_IRC_URL=ws://127.0.0.1:8710/irc
+    TWITCH_HLS_BASE=http://127.0.0.1:8710/hls
+    TWITCH_EMOTE_BASE=http://127.0.0.1:8710
+"""
+
+import os
+import json
+import math
+import time
+import uuid
+import random
+import zlib
+import base64
+import asyncio
+import hashlib
+import logging
+import secrets
+import struct
+import argparse
+from collections import Counter
+from datetime import datetime, timezone
+
+from aiohttp import web, WSMsgType
+
+from modules.logging_setup import configure_logger
+
+logger = configure_logger(
+    logger_name="twitch_standin",
+    log_file_name="twitch_standin.log",
+    console_level=logging.INFO,
+    file_level=logging.INFO,
+)
+
+GAMES = [
+    ("509658", "Just Chatting"),
+    ("27471", "Minecraft"),
+    ("21779", "League of Legends"),
+    ("33214", "Fortnite"),
+    ("512710", "Call of Duty: Warzone"),
+    ("26936", "Music"),
+]
+WORDS = "hello gg lol pog nice wow hype clip that based true no way lets go".split()
+EMOTES = [("25", "Kappa"), ("88", "PogChamp"), ("354", "4Head"), ("1902", "Keepo")]
+
+TS_PACKET_SIZE = 188
+NULL_PACKET = b"\x47\x1f\xff\x10" + b"\xff" * (TS_PACKET_SIZE - 4)
+# Tiny 1x1 JPEG - enough for the thumbnail download paths.
+TINY_JPEG = base64.b64decode(
+    "/9j/4AAQSkZJRgABAQEASABIAAD/2wBDAP//////////////////////////////////////"
+    "////////////////////////////////////////////////wAALCAABAAEBAREA/8QAFAAB"
+    "AAAAAAAAAAAAAAAAAAAACf/EABQQAQAAAAAAAAAAAAAAAAAAAAD/2gAIAQEAAD8AKp//2Q=="
+)
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _twitch_duration(seconds):
+    h, rem = divmod(int(seconds), 3600)
+    m, s = divmod(rem, 60)
+    if h:
+        return f"{h}h{m}m{s}s"
+    if m:
+        return f"{m}m{s}s"
+    return f"{s}s"
+
+
+def _encode_cursor(offset):
+    return base64.urlsafe_b64encode(json.dumps({"o": offset}).encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode()))["o"])
+    except Exception:
+        return 0
+
+
+class Channel:
+    """
+    A simulated broadcaster. Live/offline state is a pure function of time:
+    each channel repeats a (live, offline) cycle with its own period and phase.
+    """
+
+    def __init__(self, index, seed, live_minutes, offline_minutes):
+        rng = random.Random(seed * 1_000_003 + index)
+        self.index = index
+        self.login = f"standin_{index:04d}"
+        self.user_id = str(100000 + index)
+        base_period = (live_minutes + offline_minutes) * 60
+        self.period = base_period * rng.uniform(0.75, 1.25)
+        self.live_for = self.period * live_minutes / (live_minutes + offline_minutes)
+        self.phase = rng.uniform(0, self.period)
+        self.base_viewers = rng.randint(5, 5000)
+
+    def cycle(self, now):
+        return int((now + self.phase) // self.period)
+
+    def cycle_start(self, cycle):
+        return cycle * self.period - self.phase
+
+    def is_live(self, now):
+        return (now + self.phase) % self.period < self.live_for
+
+    def stream_id(self, cycle):
+        return str(int(self.user_id) * 10**8 + cycle)
+
+    def game(self, cycle, elapsed):
+        # Switch category roughly once an hour so chapter tracking has work to do.
+        return GAMES[(cycle + int(elapsed // 3600)) % len(GAMES)]
+
+    def title(self, cycle):
+        return f"{self.login} stream #{cycle} | !socials"
+
+    def stream_info(self, now):
+        cycle = self.cycle(now)
+        started = self.cycle_start(cycle)
+        elapsed = now - started
+        game_id, game_name = self.game(cycle, elapsed)
+        wobble = 1 + 0.2 * math.sin(elapsed / 300 + self.index)
+        return {
+            "id": self.stream_id(cycle),
+            "user_id": self.user_id,
+            "user_login": self.login,
+            "user_name": self.login,
+            "game_id": game_id,
+            "game_name": game_name,
+            "type": "live",
+            "title": self.title(cycle),
+            "tags": ["English"],
+            "viewer_count": int(self.base_viewers * wobble),
+            "started_at": _iso(started),
+            "language": "en",
+            "thumbnail_url": "",
+            "is_mature": False,
+        }
+
+    def vods(self, now, count, public_url):
+        """Archive VODs for the last `count` finished broadcasts, newest first."""
+        current = self.cycle(now)
+        first = current if not self.is_live(now) else current - 1
+        vods = []
+        for cycle in range(first, first - count, -1):
+            started = self.cycle_start(cycle)
+            stream_id = self.stream_id(cycle)
+            vod_id = f"9{stream_id}"
+            vods.append(
+                {
+                    "id": vod_id,
+                    "stream_id": stream_id,
+                    "user_id": self.user_id,
+                    "user_login": self.login,
+                    "user_name": self.login,
+                    "title": self.title(cycle),
+                    "description": "",
+                    "created_at": _iso(started),
+                    "published_at": _iso(started),
+                    "url": f"{public_url}/vods/{vod_id}/index.m3u8",
+                    "thumbnail_url": f"{public_url}/thumbs/{vod_id}-%{{width}}x%{{height}}.jpg",
+                    "viewable": "public",
+                    "view_count": self.base_viewers * 3,
+                    "language": "en",
+                    "type": "archive",
+                    "duration": _twitch_duration(self.live_for),
+                    "muted_segments": None,
+                }
+            )
+        return vods
+
+    def user_info(self):
+        return {
+            "id": self.user_id,
+            "login": self.login,
+            "display_name": self.login,
+            "type": "",
+            "broadcaster_type": "affiliate",
+            "description": f"Stand-in channel {self.index}",
+            "profile_image_url": "",
+            "offline_image_url": "",
+            "view_count": 0,
+            "created_at": "2020-01-01T00:00:00Z",
+        }
+
+
+class StandinState:
+    def __init__(self, args):
+        self.args = args
+        self.public_url = (args.public_url or f"http://{args.host}:{args.port}").rstrip(
+            "/"
+        )
+        self.channels = [
+            Channel(i, args.seed, args.live_minutes, args.offline_minutes)
+            for i in range(args.channels)
+        ]
+        self.by_login = {c.login: c for c in self.channels}
+        self.by_id = {c.user_id: c for c in self.channels}
+
+        # access_token -> {"expires_at", "client_id", "login", "scopes"}
+        self.tokens = {}
+        # refresh_token -> client_id
+        self.refresh_tokens = {}
+        for token in args.static_token:
+            self.tokens[token] = self._token_record(args.client_id, expires_at=None)
+
+        self.counters = Counter()
+        self.started = time.time()
+        # item -> {file name: {"size", "sha256", "meta"}} (packager uploads)
+        self.uploads = {}
+
+        segment_size = int(args.segment_kbps * 1000 / 8 * args.segment_duration)
+        self.segment_packets = max(2, segment_size // TS_PACKET_SIZE)
+        self.segment_template = None
+        if args.segment_file:
+            with open(args.segment_file, "rb") as f:
+                self.segment_template = f.read()
+
+    def _token_record(self, client_id, expires_at):
+        return {
+            "expires_at": expires_at,
+            "client_id": client_id,
+            "login": self.args.login,
+            "user_id": "1",
+            "scopes": self.args.scopes.split(),
+        }
+
+    def issue_token(self, client_id, refresh=None):
+        access = secrets.token_hex(15)
+        refresh = refresh or secrets.token_hex(25)
+        self.tokens[access] = self._token_record(
+            client_id, time.time() + self.args.token_ttl
+        )
+        self.refresh_tokens[refresh] = client_id
+        return access, refresh
+
+    def check_token(self, token):
+        """Return the token record, or None when unknown / expired."""
+        if not token:
+            return None
+        record = self.tokens.get(token)
+        if record is None:
+            if self.args.accept_any_token:
+                return self._token_record(self.args.client_id, expires_at=None)
+            return None
+        if record["expires_at"] is not None and record["expires_at"] < time.time():
+            return None
+        return record
+
+    def segment_bytes(self, key):
+        if self.segment_template is not None:
+            return self.segment_template
+        # One tagged packet so every segment hashes differently, then padding.
+        tag = hashlib.sha256(key.encode()).digest()
+        first = b"\x47\x1f\xff\x10" + (tag * 6)[: TS_PACKET_SIZE - 4]
+        return first + NULL_PACKET * (self.segment_packets - 1)
+
+
+def _bearer(request):
+    auth = request.headers.get("Authorization", "")
+    parts = auth.split(None, 1)
+    if len(parts) == 2 and parts[0].lower() in ("bearer", "oauth"):
+        return parts[1].strip()
+    return None
+
+
+def _error(status, message):
+    return web.json_response({"status": status, "message": message}, status=status)
+
+
+def _json(request, payload):
+    """JSON response with an ETag; answers If-None-Match with 304."""
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    headers = {"ETag": etag, "Ratelimit-Limit": "800", "Ratelimit-Remaining": "799"}
+    if request.headers.get("If-None-Match") == etag:
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, content_type="application/json", headers=headers)
+
+
+@web.middleware
+async def count_requests(request, handler):
+    state = request.app["state"]
+    route = request.match_info.route.resource
+    state.counters[f"route:{route.canonical if route else request.path}"] += 1
+    return await handler(request)
+
+
+@web.middleware
+async def require_helix_auth(request, handler):
+    if request.path.startswith("/helix/"):
+        state = request.app["state"]
+        if state.check_token(_bearer(request)) is None:
+            state.counters["helix_401"] += 1
+            return _error(401, "Invalid OAuth token")
+    return await handler(request)
+
+
+def _page(request, items):
+    first = min(int(request.query.get("first", 20)), 100)
+    offset = _decode_cursor(request.query["after"]) if "after" in request.query else 0
+    page = items[offset : offset + first]
+    pagination = {}
+    if offset + first < len(items):
+        pagination["cursor"] = _encode_cursor(offset + first)
+    return {"data": page, "pagination": pagination}
+
+
+async def helix_users(request):
+    state = request.app["state"]
+    found = []
+    for login in request.query.getall("login", []):
+        if login.lower() in state.by_login:
+            found.append(state.by_login[login.lower()])
+    for user_id in request.query.getall("id", []):
+        if user_id in state.by_id:
+            found.append(state.by_id[user_id])
+    return _json(request, {"data": [c.user_info() for c in found]})
+
+
+async def helix_streams(request):
+    state = request.app["state"]
+    now = time.time()
+    wanted = [
+        state.by_login[login.lower()]
+        for login in request.query.getall("user_login", [])
+        if login.lower() in state.by_login
+    ] + [
+        state.by_id[user_id]
+        for user_id in request.query.getall("user_id", [])
+        if user_id in state.by_id
+    ]
+    if (
+        not wanted
+        and "user_login" not in request.query
+        and "user_id" not in request.query
+    ):
+        wanted = state.channels
+    live = [c.stream_info(now) for c in wanted if c.is_live(now)]
+    return _json(request, _page(request, live))
+
+
+async def helix_videos(request):
+    state = request.app["state"]
+    channel = state.by_id.get(request.query.get("user_id", ""))
+    if channel is None:
+        return _error(400, "Missing or unknown user_id")
+    vods = channel.vods(time.time(), state.args.vods_per_channel, state.public_url)
+    return _json(request, _page(request, vods))
+
+
+async def oauth_token(request):
+    state = request.app["state"]
+    form = await request.post()
+    grant = form.get("grant_type")
+    client_id = form.get("client_id") or state.args.client_id
+
+    keep_refresh = None
+    if grant == "refresh_token":
+        refresh = form.get("refresh_token", "")
+        if refresh not in state.refresh_tokens and not state.args.accept_any_token:
+            state.counters["refresh_rejected"] += 1
+            return _error(400, "Invalid refresh token")
+        if state.args.rotate_refresh_tokens:
+            # A used refresh token is dead, like a client racing another client.
+            state.refresh_tokens.pop(refresh, None)
+        else:
+            keep_refresh = refresh
+        state.counters["refresh_ok"] += 1
+    elif grant not in ("authorization_code", "client_credentials"):
+        return _error(400, f"Unsupported grant_type {grant}")
+
+    access, refresh = state.issue_token(client_id, keep_refresh)
+    return web.json_response(
+        {
+            "access_token": access,
+            "refresh_token": refresh,
+            "expires_in": state.args.token_ttl,
+            "scope": state.args.scopes.split(),
+            "token_type": "bearer",
+        }
+    )
+
+
+async def oauth_validate(request):
+    state = request.app["state"]
+    record = state.check_token(_bearer(request))
+    if record is None:
+        state.counters["validate_401"] += 1
+        return _error(401, "invalid access token")
+    expires_in = (
+        int(record["expires_at"] - time.time())
+        if record["expires_at"] is not None
+        else 10**6
+    )
+    return web.json_response(
+        {
+            "client_id": record["client_id"],
+            "login": record["login"],
+            "scopes": record["scopes"],
+            "user_id": record["user_id"],
+            "expires_in": expires_in,
+        }
+    )
+
+
+def _media_playlist(state, key, first_seq, last_seq, ended):
+    seg = state.args.segment_duration
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{math.ceil(seg)}",
+        f"#EXT-X-MEDIA-SEQUENCE:{first_seq}",
+    ]
+    every = state.args.discontinuity_every
+    for seq in range(first_seq, last_seq + 1):
+        if every and seq and seq % every == 0:
+            lines.append("#EXT-X-DISCONTINUITY")
+        lines.append(f"#EXTINF:{seg:.3f},live")
+        lines.append(f"{key}/{seq}.ts")
+    if ended:
+        lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+async def hls_live_playlist(request):
+    state = request.app["state"]
+    channel = state.by_login.get(request.match_info["login"].lower())
+    now = time.time()
+    if channel is None or not channel.is_live(now):
+        return web.Response(status=404, text="offline")
+    cycle = channel.cycle(now)
+    elapsed = now - channel.cycle_start(cycle)
+    last_done = int(elapsed // state.args.segment_duration) - 1
+    if last_done < 0:
+        return web.Response(status=404, text="starting")
+    first = max(0, last_done - state.args.playlist_window + 1)
+    body = _media_playlist(state, channel.stream_id(cycle), first, last_done, False)
+    return web.Response(text=body, content_type="application/vnd.apple.mpegurl")
+
+
+async def hls_segment(request):
+    state = request.app["state"]
+    key = f"{request.match_info['key']}/{request.match_info['seq']}"
+    if state.args.drop_rate and random.random() < state.args.drop_rate:
+        state.counters["segments_dropped"] += 1
+        return web.Response(status=503)
+    data = state.segment_bytes(key)
+    state.counters["segment_bytes"] += len(data)
+    return web.Response(body=data, content_type="video/mp2t")
+
+
+async def vod_playlist(request):
+    state = request.app["state"]
+    vod_id = request.match_info["vod_id"]
+    count = max(1, int(state.args.vod_minutes * 60 // state.args.segment_duration))
+    body = _media_playlist(state, vod_id, 0, count - 1, True)
+    return web.Response(text=body, content_type="application/vnd.apple.mpegurl")
+
+
+async def thumbnail(request):
+    return web.Response(body=TINY_JPEG, content_type="image/jpeg")
+
+
+def _png_chunk(kind, data):
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(kind + data))
+    )
+
+
+def emote_png(emote_id, size=28):
+    """Solid-colour PNG whose colour is derived from the emote id."""
+    r, g, b = hashlib.sha256(emote_id.encode()).digest()[:3]
+    row = b"\x00" + bytes((r, g, b)) * size
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+        + _png_chunk(b"IDAT", zlib.compress(row * size))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+async def emote_image(request):
+    emote_id = request.match_info["emote_id"]
+    if not emote_id.replace("_", "").isalnum():
+        raise web.HTTPNotFound()
+    return web.Response(body=emote_png(emote_id), content_type="image/png")
+
+
+async def ia_upload(request):
+    """Archive.org S3-style PUT /ia/<item>/<file>: hashes the body, keeps no data."""
+    state = request.app["state"]
+    if not request.headers.get("authorization", "").startswith("LOW "):
+        return web.Response(status=403, text="missing LOW authorization")
+    item = request.match_info["item"]
+    name = request.match_info["name"]
+    if item not in state.uploads and not request.headers.get("x-amz-auto-make-bucket"):
+        return web.Response(status=404, text="no such bucket")
+    files = state.uploads.setdefault(item, {})
+    sha = hashlib.sha256()
+    size = 0
+    async for chunk in request.content.iter_chunked(1024 * 1024):
+        sha.update(chunk)
+        size += len(chunk)
+    files[name] = {
+        "size": size,
+        "sha256": sha.hexdigest(),
+        "meta": {
+            k.lower(): v
+            for k, v in request.headers.items()
+            if k.lower().startswith("x-archive-meta-")
+        },
+    }
+    state.counters["ia_uploads"] += 1
+    state.counters["ia_upload_bytes"] += size
+    return web.Response(status=200, headers={"ETag": f'"{sha.hexdigest()}"'})
+
+
+async def ia_uploads(request):
+    return web.json_response(request.app["state"].uploads)
+
+
+async def stats(request):
+    state = request.app["state"]
+    now = time.time()
+    return web.json_response(
+        {
+            "uptime": round(now - state.started, 1),
+            "channels": len(state.channels),
+            "live_channels": sum(c.is_live(now) for c in state.channels),
+            "irc_connections": len(request.app["irc_clients"]),
+            "counters": dict(state.counters),
+        }
+    )
+
+
+class IrcClient:
+    def __init__(self, ws):
+        self.ws = ws
+        self.nick = "justinfan"
+        self.channels = set()
+        self.authed = False
+
+
+def _privmsg(channel, rng):
+    user = f"chatter{rng.randint(1, 2000)}"
+    words = [rng.choice(WORDS) for _ in range(rng.randint(1, 8))]
+    emotes = ""
+    if rng.random() < 0.3:
+        emote_id, emote_name = rng.choice(EMOTES)
+        emotes = f"{emote_id}:0-{len(emote_name) - 1}"
+        words.insert(0, emote_name)
+    tags = {
+        "badge-info": "",
+        "badges": "subscriber/0" if rng.random() < 0.2 else "",
+        "color": f"#{rng.randint(0, 0xFFFFFF):06X}" if rng.random() < 0.8 else "",
+        "display-name": user,
+        "emotes": emotes,
+        "first-msg": "0",
+        "flags": "",
+        "id": str(uuid.uuid4()),
+        "mod": "1" if rng.random() < 0.02 else "0",
+        "room-id": channel.user_id,
+        "subscriber": "1" if rng.random() < 0.2 else "0",
+        "tmi-sent-ts": str(int(time.time() * 1000)),
+        "turbo": "0",
+        "user-id": str(rng.randint(10**6, 10**7)),
+        "user-type": "",
+        "vip": "1" if rng.random() < 0.01 else "0",
+    }
+    if rng.random() < 0.01:
+        tags["bits"] = str(rng.choice((1, 100, 500)))
+        words.append(f"Cheer{tags['bits']}")
+    tag_str = ";".join(f"{k}={v}" for k, v in tags.items())
+    return (
+        f"@{tag_str} :{user}!{user}@{user}.tmi.twitch.tv "
+        f"PRIVMSG #{channel.login} :{' '.join(words)}"
+    )
+
+
+async def _irc_send(client, *lines):
+    await client.ws.send_str("\r\n".join(lines) + "\r\n")
+
+
+async def _irc_handle_line(state, client, line):
+    if line.startswith("@"):
+        line = line.split(" ", 1)[1] if " " in line else ""
+    command, _, rest = line.partition(" ")
+    command = command.upper()
+
+    if command == "PASS":
+        token = rest.strip()
+        if token.lower().startswith("oauth:"):
+            token = token[6:]
+        client.authed = state.check_token(token) is not None
+    elif command == "NICK":
+        client.nick = rest.strip().lower()
+        if not client.authed and not client.nick.startswith("justinfan"):
+            await _irc_send(
+                client, ":tmi.twitch.tv NOTICE * :Login authentication failed"
+            )
+            await client.ws.close()
+            return
+        nick = client.nick
+        await _irc_send(
+            client,
+            f":tmi.twitch.tv 001 {nick} :Welcome, GLHF!",
+            f":tmi.twitch.tv 002 {nick} :Your host is tmi.twitch.tv",
+            f":tmi.twitch.tv 003 {nick} :This server is rather new",
+            f":tmi.twitch.tv 004 {nick} :-",
+            f":tmi.twitch.tv 375 {nick} :-",
+            f":tmi.twitch.tv 372 {nick} :You are in a maze of twisty passages.",
+            f":tmi.twitch.tv 376 {nick} :>",
+        )
+    elif command == "CAP":
+        caps = rest.split(":", 1)[1] if ":" in rest else ""
+        await _irc_send(client, f":tmi.twitch.tv CAP * ACK :{caps}")
+    elif command == "JOIN":
+        for name in rest.strip().split(","):
+            login = name.strip().lstrip("#").lower()
+            channel = state.by_login.get(login)
+            room_id = channel.user_id if channel else "0"
+            client.channels.add(login)
+            nick = client.nick
+            await _irc_send(
+                client,
+                f":{nick}!{nick}@{nick}.tmi.twitch.tv JOIN #{login}",
+                f":{nick}.tmi.twitch.tv 353 {nick} = #{login} :{nick}",
+                f":{nick}.tmi.twitch.tv 366 {nick} #{login} :End of /NAMES list",
+                f"@emote-only=0;followers-only=-1;r9k=0;room-id={room_id};slow=0;"
+                f"subs-only=0 :tmi.twitch.tv ROOMSTATE #{login}",
+            )
+    elif command == "PART":
+        for name in rest.strip().split(","):
+            client.channels.discard(name.strip().lstrip("#").lower())
+    elif command == "PING":
+        await _irc_send(client, f"PONG {rest}" if rest else "PONG :tmi.twitch.tv")
+
+
+async def irc_websocket(request):
+    state = request.app["state"]
+    ws = web.WebSocketResponse(heartbeat=60)
+    await ws.prepare(request)
+    client = IrcClient(ws)
+    request.app["irc_clients"].add(client)
+    try:
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            for line in msg.data.split("\r\n"):
+                if line.strip():
+                    await _irc_handle_line(state, client, line.strip())
+    finally:
+        request.app["irc_clients"].discard(client)
+    return ws
+
+
+async def chat_emitter(app):
+    """Emit PRIVMSGs to every joined, live channel at --chat-rate msgs/sec."""
+    state = app["state"]
+    rng = random.Random(state.args.seed)
+    tick = 0.1
+    per_tick = state.args.chat_rate * tick
+    while True:
+        await asyncio.sleep(tick)
+        if per_tick <= 0:
+            continue
+        now = time.time()
+        for client in list(app["irc_clients"]):
+            if client.ws.closed:
+                continue
+            lines = []
+            for login in client.channels:
+                channel = state.by_login.get(login)
+                if channel is None or not channel.is_live(now):
+                    continue
+                count = int(per_tick) + (rng.random() < per_tick % 1)
+                lines.extend(_privmsg(channel, rng) for _ in range(count))
+            if lines:
+                state.counters["irc_messages"] += len(lines)
+                try:
+                    await _irc_send(client, *lines)
+                except ConnectionResetError:
+                    pass
+
+
+async def _start_background(app):
+    app["chat_task"] = asyncio.create_task(chat_emitter(app))
+
+
+async def _stop_background(app):
+    app["chat_task"].cancel()
+    for client in list(app["irc_clients"]):
+        await client.ws.close()
+
+
+def build_app(args):
+    app = web.Application(middlewares=[count_requests, require_helix_auth])
+    app["state"] = StandinState(args)
+    app["irc_clients"] = set()
+    app.router.add_get("/helix/users", helix_users)
+    app.router.add_get("/helix/streams", helix_streams)
+    app.router.add_get("/helix/videos", helix_videos)
+    app.router.add_post("/oauth2/token", oauth_token)
+    app.router.add_get("/oauth2/validate", oauth_validate)
+    app.router.add_get("/irc", irc_websocket)
+    app.router.add_get("/hls/{login}/index.m3u8", hls_live_playlist)
+    app.router.add_get("/hls/{login}/{key}/{seq}.ts", hls_segment)
+    app.router.add_get("/vods/{vod_id}/index.m3u8", vod_playlist)
+    app.router.add_get("/vods/{vod_id}/{key}/{seq}.ts", hls_segment)
+    app.router.add_get("/thumbs/{name}", thumbnail)
+    app.router.add_get("/emoticons/v1/{emote_id}/{scale}", emote_image)
+    app.router.add_put("/ia/{item}/{name:.+}", ia_upload)
+    app.router.add_get("/standin/uploads", ia_uploads)
+    app.router.add_get("/standin/stats", stats)
+    app.on_startup.append(_start_background)
+    app.on_cleanup.append(_stop_background)
+    return app
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Offline Twitch stand-in server")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8710)
+    p.add_argument("--public-url", help="Base URL used in VOD/thumbnail links")
+    p.add_argument("--channels", type=int, default=50)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--live-minutes", type=float, default=120)
+    p.add_argument("--offline-minutes", type=float, default=240)
+    p.add_argument("--vods-per-channel", type=int, default=30)
+    p.add_argument(
+        "--vod-minutes", type=float, default=10, help="Length of served VOD media"
+    )
+    p.add_argument(
+        "--chat-rate", type=float, default=2.0, help="msgs/sec per live channel"
+    )
+    p.add_argument("--segment-duration", type=float, default=2.0)
+    p.add_argument("--segment-kbps", type=float, default=6000)
+    p.add_argument("--segment-file", help="Serve this .ts file for every segment")
+    p.add_argument("--playlist-window", type=int, default=6)
+    p.add_argument("--discontinuity-every", type=int, default=0)
+    p.add_argument(
+        "--drop-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of segment requests answered 503",
+    )
+    p.add_argument("--token-ttl", type=int, default=14400)
+    p.add_argument("--client-id", default=os.getenv("CLIENT_ID", "standin-client"))
+    p.add_argument("--login", default="archiver")
+    p.add_argument(
+        "--scopes",
+        default="user:read:email user:read:broadcast channel:read:subscriptions "
+        "chat:read chat:edit user_subscriptions",
+    )
+    p.add_argument(
+        "--static-token",
+        action="append",
+        default=[],
+        help="Never-expiring access token",
+    )
+    p.add_argument("--accept-any-token", action="store_true")
+    p.add_argument("--rotate-refresh-tokens", action="store_true")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logger.info(
+        f"Stand-in serving {args.channels} channels on http://{args.host}:{args.port}"
+    )
+    web.run_app(build_app(args), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()